@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# Stand-in for sacct that serves records from a recorded fixture, for
+# running pull_sacct_records.py without a cluster:
+#
+#   pull_sacct_records.py --start 2024-09-01 --end 2024-09-30 --sacct fixtures/fake_sacct.py
+#
+# The fixture (sacct -P output, '|' delimited, header first) defaults to
+# sacct_sample.txt next to this script and can be changed with the
+# FAKE_SACCT_FIXTURE environment variable. A job is reported when its
+# account matches and its Start..End overlaps --starttime..--endtime, the
+# same rule sacct uses. Other sacct options are accepted and ignored.
+
+import argparse
+import datetime
+import os
+import sys
+
+FIXTURE = os.environ.get(
+    "FAKE_SACCT_FIXTURE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sacct_sample.txt")
+)
+
+
+def _parse(value):
+    # sacct accepts bare and unpadded dates such as 2024-09-1.
+    day, _, clock = value.partition("T")
+    year, month, mday = (int(part) for part in day.split("-"))
+    hour, minute, second = (int(part) for part in (clock or "00:00:00").split(":"))
+    return datetime.datetime(year, month, mday, hour, minute, second)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--starttime", required=True)
+    parser.add_argument("--endtime", required=True)
+    parser.add_argument("--account", required=True)
+    parser.add_argument("--delimiter", default="|")
+    args, _ = parser.parse_known_args()
+    start = _parse(args.starttime)
+    end = _parse(args.endtime)
+
+    with open(FIXTURE) as f:
+        header = f.readline().rstrip("\n").split("|")
+        account_col = header.index("Account")
+        start_col = header.index("Start")
+        end_col = header.index("End")
+        sys.stdout.write(args.delimiter.join(header) + "\n")
+        for line in f:
+            fields = line.rstrip("\n").split("|")
+            if fields[account_col] != args.account:
+                continue
+            if _parse(fields[start_col]) > end or _parse(fields[end_col]) < start:
+                continue
+            sys.stdout.write(args.delimiter.join(fields) + "\n")
+
+
+if __name__ == "__main__":
+    main()
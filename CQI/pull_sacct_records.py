@@ -5,15 +5,46 @@
 # records using sacct. The resulting file can be imported into
 # Excel for analysis
 #
+# With --start/--end it instead pulls an arbitrary date range for one or
+# more accounts (--accounts): the range is split into day or week windows,
+# the windows are extracted concurrently by a bounded pool of sacct runs,
+# and the results are merged back in date order, keeping the first record
+# of each JobID (jobs spanning windows are reported by each of them). One
+# CSV is written per account.
+#
+# sacct is run directly (no shell pipeline) and its parsable output is
+# streamed line by line: records with a blank user (the per-step lines) are
+# dropped, after the largest MaxRSS/MaxVMSize of a job's steps is folded
+# into the job's record (sacct reports memory only on the steps), and the
+# rest are written to the CSV and counted in the same pass. For testing
+# without a cluster, --sacct-output reads a recorded sacct output file
+# instead, e.g. fixtures/sacct_sample.txt, and --sacct can point at a
+# stand-in such as fixtures/fake_sacct.py that serves a fixture by date.
+#
+# With --incremental, each account's month-to-date CSV is kept up to date
+# by daily runs: the end of the last window pulled is kept per account in a
+# state file (sacct_state.json: {"<account>": {"end": "<ISO time>"}}), and
+# only the time since then (less an --overlap-hours margin, to pick up jobs
+# whose state changed late) is queried. Rows are upserted into the CSV by
+# JobID, so a job that was RUNNING yesterday is replaced by its final
+# record. The first run of a new month first finishes the previous month's
+# CSV up to midnight.
+#
 # J Nucciarone, 10/2024, RC 1
 
 from datetime import date
 import datetime
 from calendar import monthrange
 
+import argparse
+import concurrent.futures
+import csv
+import json
+import shutil
 import subprocess
 import os
 import sys
+import tempfile
 
 def check_installation(rv):
     current_version = sys.version_info
@@ -29,6 +60,28 @@ def check_installation(rv):
 required_version = (3,10)
 check_installation(required_version)
 
+# The fields requested from sacct, in output column order.
+SACCT_FIELDS = "User,Account,JobID,Jobname,partition,state,time,start,end,elapsed,MaxRss,MaxVMSize,nnodes,ncpus,nodelist"
+
+# sacct's parsable output is split on this; unlike ',' it cannot appear in
+# node lists such as p-sc-[2001,2003].
+SACCT_DELIMITER = "|"
+
+DEFAULT_ACCOUNT = "pches"
+
+WINDOW_DAYS = {"day": 1, "week": 7}
+DEFAULT_WORKERS = 4
+
+STATE_FILE = "sacct_state.json"
+DEFAULT_OVERLAP_HOURS = 6
+
+# Column of JobID in SACCT_FIELDS, used to drop duplicate records.
+JOBID_COLUMN = 2
+
+# Columns of MaxRss and MaxVMSize, which sacct reports only on step lines.
+MEMORY_COLUMNS = (10, 11)
+MEMORY_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4, "P": 1024 ** 5}
+
 # This is a bit of a silly function, as the start of the month is always the 1st.
 def beginning_of_month(today: date | None = None) -> date:
     today = today or date.today()
@@ -40,109 +93,410 @@ def end_of_month(today: date | None = None) -> date:
     return date(today.year, today.month, num_days_in_month)
 
 
-# Print starting banner
-
-print(f"--------\n{sys.argv[0]} execution starting at {datetime.datetime.now()}.\n\n")
-
-# Get the CWD
-my_cwd = os.getcwd()
-#print(f"My current directory is {my_cwd}")
-
-
-# Obtain the account name, and verify it exists
-
-account = "pches"
-
-sacctmgr_command_string = f"sacctmgr -n -P   show account {account}  format=account%30 | grep ^{account} > /dev/null"
-
-#print(f"Command string is {sacctmgr_command_string}.\n")
-
-result = subprocess.run([f"{sacctmgr_command_string}"], shell=True, capture_output=True, text=True)
-sacctmgr_command_result_code = result.returncode
-
-if sacctmgr_command_result_code != 0:
-    sys.stderr.write(f"Error: Account {account} does not exist.\n")
-    print(result.stderror)
-    sys.exit(-1)
-else:
+def last_month(today: date | None = None) -> tuple[date, date]:
+    """Return the first and last day of the month before ``today``."""
+    today = today or date.today()
+    if today.month == 1:
+        date_last = date(today.year - 1, 12, 1)
+    else:
+        date_last = date(today.year, today.month - 1, 1)
+    return beginning_of_month(date_last), end_of_month(date_last)
+
+
+def sacct_date(day: date) -> str:
+    # Month is two digits, the day is not zero padded.
+    return f"{day.year}-{day.month:02d}-{day.day}"
+
+
+def account_exists(account: str) -> bool:
+    result = subprocess.run(
+        ["sacctmgr", "-n", "-P", "show", "account", account, "format=account%30"],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        return False
+    return any(line.startswith(account) for line in result.stdout.splitlines())
+
+
+def sacct_command(account: str, start: str, end: str, sacct: str = "sacct") -> list[str]:
+    return [
+        shutil.which(sacct) or sacct, "--allusers",
+        "--starttime", start, "--endtime", end,
+        "--account", account,
+        f"--format={SACCT_FIELDS}",
+        "-P", "--delimiter", SACCT_DELIMITER,
+    ]
+
+
+def memory_bytes(value: str) -> float:
+    """Bytes in a sacct memory value such as 18734212K or 3.20G; 0 if blank."""
+    value = value.strip()
+    if not value:
+        return 0
+    unit = MEMORY_UNITS.get(value[-1].upper())
+    if unit is None:
+        return float(value)
+    return float(value[:-1]) * unit
+
+
+def parse_sacct_lines(lines):
+    """
+    Yield the field lists of sacct parsable output, header first, skipping
+    records whose user field is blank (the per-step lines) after folding the
+    largest MaxRSS/MaxVMSize of a job's steps into the job's record.
+    """
+    job = None
+    for line in lines:
+        fields = line.rstrip("\n").split(SACCT_DELIMITER)
+        if fields[0].strip():
+            if job is not None:
+                yield job
+            job = fields
+        elif job is not None and fields[JOBID_COLUMN].split(".", 1)[0] == job[JOBID_COLUMN]:
+            for column in MEMORY_COLUMNS:
+                if memory_bytes(fields[column]) > memory_bytes(job[column]):
+                    job[column] = fields[column]
+    if job is not None:
+        yield job
+
+
+def write_records(rows, output_file: str) -> int:
+    """Write the header and records to ``output_file``; return the record count."""
+    count = -1  # the header is not a record
+    with open(output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return max(count, 0)
+
+
+def sacct_rows(command: list[str]):
+    """
+    Run sacct and yield its parsed rows as they arrive. Raises
+    CalledProcessError once the output is exhausted if sacct failed.
+    """
+    # stderr goes to a temporary file so a chatty sacct can't block on a full pipe
+    # while we are reading stdout.
+    with tempfile.TemporaryFile("w+") as errors:
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors, text=True) as proc:
+            yield from parse_sacct_lines(proc.stdout)
+        if proc.returncode != 0:
+            errors.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, command, stderr=errors.read())
+
+
+def run_sacct(command: list[str], output_file: str) -> int:
+    """Run sacct and stream its output into ``output_file``; return the record count."""
+    return write_records(sacct_rows(command), output_file)
+
+
+def date_windows(start: date, end: date, days: int):
+    """Split ``start``..``end`` (inclusive) into consecutive windows of ``days`` days."""
+    windows = []
+    window_start = start
+    while window_start <= end:
+        window_end = min(window_start + datetime.timedelta(days=days - 1), end)
+        windows.append((window_start, window_end))
+        window_start = window_end + datetime.timedelta(days=1)
+    return windows
+
+
+def _extract_window(command: list[str]) -> str:
+    """Run one windowed sacct into a temporary CSV and return its path."""
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="", delete=False) as f:
+        try:
+            writer = csv.writer(f)
+            for row in sacct_rows(command):
+                writer.writerow(row)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    return f.name
+
+
+def merge_windows(paths: list[str], output_file: str) -> int:
+    """
+    Concatenate window CSVs in order into ``output_file``, writing one header
+    and keeping only the first record seen for each JobID.
+    """
+    seen = set()
+
+    def rows():
+        header_written = False
+        for path in paths:
+            with open(path, newline="") as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is not None and not header_written:
+                    header_written = True
+                    yield header
+                for row in reader:
+                    if row[JOBID_COLUMN] in seen:
+                        continue
+                    seen.add(row[JOBID_COLUMN])
+                    yield row
+
+    return write_records(rows(), output_file)
+
+
+def extract_range(accounts: list[str], start: date, end: date, output_dir: str,
+                  window: str = "week", workers: int = DEFAULT_WORKERS, sacct: str = "sacct") -> dict[str, str]:
+    """
+    Extract ``start``..``end`` for every account with up to ``workers`` sacct
+    runs at once, and return a dict of account to the CSV written for it.
+    """
+    windows = date_windows(start, end, WINDOW_DAYS[window])
+    jobs = [
+        (account, index, sacct_command(
+            account,
+            f"{window_start.isoformat()}T00:00:00",
+            f"{window_end.isoformat()}T23:59:59",
+            sacct,
+        ))
+        for account in accounts
+        for index, (window_start, window_end) in enumerate(windows)
+    ]
+    print(f"Extracting {len(windows)} {window} windows for {len(accounts)} accounts with {workers} workers")
+
+    window_files = {account: [None] * len(windows) for account in accounts}
+    outputs = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_extract_window, command): (account, index) for account, index, command in jobs}
+            # Collect every window before raising the first failure, so the
+            # finally below removes the files of the windows that did finish.
+            error = None
+            for future in concurrent.futures.as_completed(futures):
+                account, index = futures[future]
+                try:
+                    window_files[account][index] = future.result()
+                except Exception as err:
+                    error = error or err
+            if error is not None:
+                raise error
+
+        for account in accounts:
+            output_file = os.path.join(
+                output_dir, f"{account}_usage_{sacct_date(start)}_{sacct_date(end)}.csv"
+            )
+            count = merge_windows(window_files[account], output_file)
+            print(f"{count} records written to file {output_file}.\n")
+            outputs[account] = output_file
+    finally:
+        for paths in window_files.values():
+            for path in paths:
+                if path is not None:
+                    os.unlink(path)
+    return outputs
+
+
+def load_state(state_file: str) -> dict:
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state: dict, state_file: str):
+    tmp_path = state_file + ".partial"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_file)
+
+
+def upsert_records(rows, output_file: str) -> tuple[int, int, int]:
+    """
+    Merge ``rows`` (header first) into ``output_file`` by JobID, replacing
+    records already there. Returns (new, updated, total) record counts.
+    """
+    records = {}
+    header = None
+    if os.path.exists(output_file):
+        with open(output_file, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            for row in reader:
+                records[row[JOBID_COLUMN]] = row
+    rows = iter(rows)
+    header = next(rows, None) or header
+    new = updated = 0
+    for row in rows:
+        if row[JOBID_COLUMN] in records:
+            updated += 1
+        else:
+            new += 1
+        records[row[JOBID_COLUMN]] = row
+
+    tmp_path = output_file + ".partial"
+    total = write_records(([header] if header else []) + list(records.values()), tmp_path)
+    os.replace(tmp_path, output_file)
+    return new, updated, total
+
+
+def _pull_into(account: str, start: datetime.datetime, end: datetime.datetime, output_file: str,
+               sacct: str = "sacct"):
+    """Upsert the records for ``account`` between ``start`` and ``end`` into ``output_file``."""
+    command = sacct_command(account, start.isoformat(timespec="seconds"), end.isoformat(timespec="seconds"), sacct)
+    print(f"Pulling records for \"{account}\" from {start} to {end}")
+    new, updated, total = upsert_records(sacct_rows(command), output_file)
+    print(f"{new} new and {updated} updated records; {total} records in file {output_file}.\n")
+
+
+def pull_incremental(account: str, now: datetime.datetime, output_dir: str, state: dict,
+                     overlap_hours: float = DEFAULT_OVERLAP_HOURS, sacct: str = "sacct") -> str:
+    """
+    Pull the records for ``account`` since its last pull (or the start of the
+    month) up to ``now`` into the month's CSV, and update ``state`` in place.
+    If the last pull was in an earlier month, that month's CSV (and any
+    skipped since) is first finished up to the month boundary. Returns the
+    CSV path.
+    """
+    month_start = datetime.datetime.combine(beginning_of_month(now.date()), datetime.time())
+    start = month_start
+    previous = state.get(account)
+    if previous is not None:
+        start = datetime.datetime.fromisoformat(previous["end"]) - datetime.timedelta(hours=overlap_hours)
+        previous_month = beginning_of_month(datetime.datetime.fromisoformat(previous["end"]).date())
+        while previous_month < month_start.date():
+            next_month = datetime.datetime.combine(end_of_month(previous_month) + datetime.timedelta(days=1),
+                                                   datetime.time())
+            _pull_into(account, max(start, datetime.datetime.combine(previous_month, datetime.time())),
+                       next_month - datetime.timedelta(seconds=1),
+                       os.path.join(output_dir, f"{account}_usage_{previous_month:%Y-%m}.csv"), sacct)
+            previous_month = next_month.date()
+        start = max(month_start, start)
+
+    output_file = os.path.join(output_dir, f"{account}_usage_{now:%Y-%m}.csv")
+    _pull_into(account, start, now, output_file, sacct)
+    state[account] = {"end": now.isoformat(timespec="seconds")}
+    return output_file
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--account", default=DEFAULT_ACCOUNT)
+    parser.add_argument("--accounts", type=lambda value: value.split(","),
+                        help="comma separated accounts for a --start/--end extraction")
+    parser.add_argument("--start", type=date.fromisoformat, default=None,
+                        help="first day (YYYY-MM-DD) of a date range extraction")
+    parser.add_argument("--end", type=date.fromisoformat, default=None,
+                        help="last day (YYYY-MM-DD) of a date range extraction")
+    parser.add_argument("--window", choices=sorted(WINDOW_DAYS), default="week",
+                        help="size of the windows a date range is split into")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="concurrent sacct runs for a date range extraction")
+    parser.add_argument("--sacct", default="sacct", help="sacct executable, or a stand-in for testing (skips the sacctmgr account check)")
+    parser.add_argument("--today", type=date.fromisoformat, default=None,
+                        help="pretend today is this date (YYYY-MM-DD); records are for the month before")
+    parser.add_argument("--output-dir", default=os.getcwd())
+    parser.add_argument("--sacct-output", metavar="FILE",
+                        help="parse a recorded sacct -P output file instead of running sacct")
+    parser.add_argument("--incremental", action="store_true",
+                        help="pull only what changed since the last run into this month's CSV")
+    parser.add_argument("--state-file", default=None,
+                        help=f"where --incremental keeps its progress (default OUTPUT_DIR/{STATE_FILE})")
+    parser.add_argument("--overlap-hours", type=float, default=DEFAULT_OVERLAP_HOURS,
+                        help="how far before the last pull an --incremental run starts")
+    args = parser.parse_args(argv)
+    if (args.start is None) != (args.end is None):
+        parser.error("--start and --end must be given together")
+    if args.incremental and (args.start is not None or args.sacct_output is not None):
+        parser.error("--incremental cannot be combined with --start/--end or --sacct-output")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Print starting banner
+
+    print(f"--------\n{sys.argv[0]} execution starting at {datetime.datetime.now()}.\n\n")
+
+    if args.incremental:
+        accounts = args.accounts or [args.account]
+        if args.sacct == "sacct":
+            for account in accounts:
+                if not account_exists(account):
+                    sys.stderr.write(f"Error: Account {account} does not exist.\n")
+                    sys.exit(-1)
+        # With --today, pull up to the end of that day instead of now.
+        if args.today is not None:
+            now = datetime.datetime.combine(args.today, datetime.time(23, 59, 59))
+        else:
+            now = datetime.datetime.now().replace(microsecond=0)
+        state_file = args.state_file or os.path.join(args.output_dir, STATE_FILE)
+        state = load_state(state_file)
+        for account in accounts:
+            try:
+                pull_incremental(account, now, args.output_dir, state, args.overlap_hours, args.sacct)
+            except subprocess.CalledProcessError as err:
+                print(f"Error encountered running {' '.join(err.cmd)}\n\n")
+                print(err.stderr)
+                sys.exit(-1)
+            save_state(state, state_file)
+        print(f"{sys.argv[0]} execution completed at {datetime.datetime.now()}.\n--------\n")
+        return
+
+    if args.start is not None:
+        accounts = args.accounts or [args.account]
+        if args.sacct == "sacct":
+            for account in accounts:
+                if not account_exists(account):
+                    sys.stderr.write(f"Error: Account {account} does not exist.\n")
+                    sys.exit(-1)
+        try:
+            extract_range(accounts, args.start, args.end, args.output_dir,
+                          window=args.window, workers=args.workers, sacct=args.sacct)
+        except subprocess.CalledProcessError as err:
+            print(f"Error encountered running {' '.join(err.cmd)}\n\n")
+            print(err.stderr)
+            sys.exit(-1)
+        print(f"{sys.argv[0]} execution completed at {datetime.datetime.now()}.\n--------\n")
+        return
+
+    # Obtain the account name, and verify it exists
+
+    account = args.account
+
+    if args.sacct_output is None and args.sacct == "sacct" and not account_exists(account):
+        sys.stderr.write(f"Error: Account {account} does not exist.\n")
+        sys.exit(-1)
     print(f"Account records will be obtained for account \"{account}\".\n")
 
+    today_date = args.today or date.today()
+    print(f"Today's date is {today_date}.\n")
 
-# Obtain today's date
-
-today_date = date.today()
-
-my_year = today_date.year
-my_month = today_date.month
-my_day = today_date.day
-
-# For testing we are going to fake a date. Uncomment these fields to set the fake date.
-
-#my_year = int(2024)
-#my_month = int(1)
-#my_day = int(13)
-#today_date = datetime.date(my_year, my_month, my_day)
-
-print(f"Today's date is {today_date}.\n")
-
-
-# We will use today's date to calculate the prior month and year
-
-if my_month == 1:
-    my_last_month = 12
-    my_last_months_year = my_year - 1
-else:
-    my_last_month = my_month - 1
-    my_last_months_year = my_year
-
-print(f"Running accounting records for  {int(my_last_month)} / {int(my_last_months_year)}\n")
+    start, end = last_month(today_date)
+    print(f"Running accounting records for  {start.month} / {start.year}\n")
 
-# As we are looking to what last month is, the day variable isn't important. Set it to 1.
+    # Create strings for the start and end date of the accounting period. Base the output file name on these dates.
 
-date_last = datetime.date(my_last_months_year, my_last_month, 1)
+    start_date_str = sacct_date(start)
+    end_date_str = sacct_date(end)
 
+    output_file = os.path.join(args.output_dir, f"{account}_usage_{start_date_str}_{end_date_str}.csv")
+    print(f"sacct records will be written to file {output_file}")
 
-# Calculate the start and end dates of last month
-
-start_day = beginning_of_month(date_last).day
-end_day = end_of_month(date_last).day
-#print(f"Starting day for month {int(date_last.month)} is {int(start_day)} and the ending day is {int(end_day)}\n")
-
-
-# Create strings for the start and end date of the accounting period. Base the output file name on these dates. 
-# The date format requires the month be two digits, so append the leading 0 in months < October.
-
-if my_last_month >= 10:
-    start_date_str = f"{int(my_last_months_year)}-{int(my_last_month)}-{int(start_day)}"
-    end_date_str = f"{int(my_last_months_year)}-{int(my_last_month)}-{int(end_day)}"
-else:
-    start_date_str = f"{int(my_last_months_year)}-0{int(my_last_month)}-{int(start_day)}"
-    end_date_str = f"{int(my_last_months_year)}-0{int(my_last_month)}-{int(end_day)}"
-    
-# print(f"Start date string {start_date_str}\nEnd date string {end_date_str}\n")
-
-output_file = f"{my_cwd}/pches_usage_{start_date_str}_{end_date_str}.csv"
-print(f"sacct records will be written to file {output_file}")
-
-
-# Build the sacct command string, pipe it through awk to eliminate lines where the user field is blank
-    
-sacct_command_string = f"`which sacct` --allusers --starttime {start_date_str} --endtime {end_date_str} --account {account} --format=User,Account,JobID,Jobname,partition,state,time,start,end,elapsed,MaxRss,MaxVMSize,nnodes,ncpus,nodelist -P --delimiter ',' | awk -F\, '$1~/\w/' >& {output_file}"
-
-#print(f"My command string is \"{sacct_command_string}\"\n")
-
+    if args.sacct_output is not None:
+        with open(args.sacct_output) as recorded:
+            num_records = write_records(parse_sacct_lines(recorded), output_file)
+    else:
+        command = sacct_command(account, start_date_str, end_date_str, args.sacct)
+        try:
+            num_records = run_sacct(command, output_file)
+        except subprocess.CalledProcessError as err:
+            print(f"Error encountered running {' '.join(command)}\n\n")
+            print(err.stderr)
+            sys.exit(-1)
 
-# Execute the sacct command
+    print(f"{num_records} records written to file {output_file}.\n")
 
-result = subprocess.run([f"{sacct_command_string}"], shell=True, capture_output=True, text=True)
-command_result_code = result.returncode
+    print(f"{sys.argv[0]} execution completed at {datetime.datetime.now()}.\n--------\n")
 
-if command_result_code != 0:
-    print(f"Error encountered running {sacct_command_string}\n\n")
-    print(result.stderror)
-else:
-    print(result.stdout)
-    num_lines = sum(1 for _ in open(output_file))
-    print(f"{num_lines - 1} records written to file {output_file}.\n")
 
-print(f"{sys.argv[0]} execution completed at {datetime.datetime.now()}.\n--------\n")
+if __name__ == "__main__":
+    main()
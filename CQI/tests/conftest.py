@@ -0,0 +1,7 @@
+# The scripts import each other as top-level modules.
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
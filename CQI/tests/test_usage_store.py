@@ -0,0 +1,71 @@
+# Ingesting pull_sacct_records.py output into the usage store.
+
+import os
+
+import pull_sacct_records
+import usage_store
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLE = os.path.join(HERE, os.pardir, "fixtures", "sacct_sample.txt")
+
+
+def pulled_csv(tmp_path):
+    """The CSV pull_sacct_records.py writes for the recorded sacct output."""
+    path = str(tmp_path / "pches_usage.csv")
+    with open(SAMPLE) as recorded:
+        pull_sacct_records.write_records(pull_sacct_records.parse_sacct_lines(recorded), path)
+    return path
+
+
+def by_user(store):
+    parts = [usage_store.Partition.read(path, text=False) for path in usage_store.select_partitions(store)]
+    results, _ = usage_store.aggregate(parts, by=("user",))
+    return {result["user"]: result for result in results}
+
+
+def test_pulled_csv_carries_step_memory(tmp_path):
+    store = str(tmp_path / "store")
+    usage_store.ingest(usage_store.read_csv_rows(pulled_csv(tmp_path)), store)
+    users = by_user(store)
+
+    assert users["abc123"]["jobs"] == 2
+    assert users["abc123"]["max_rss"] == 18734212 * 1024
+    assert users["abc123"]["max_vmsize"] == 24011880 * 1024
+    assert users["def456"]["max_rss"] == 912340 * 1024
+    assert users["ghi789"]["max_vmsize"] == 3120012 * 1024
+
+
+def test_csv_and_raw_sacct_ingest_agree(tmp_path):
+    from_csv = str(tmp_path / "from_csv")
+    from_raw = str(tmp_path / "from_raw")
+    usage_store.ingest(usage_store.read_csv_rows(pulled_csv(tmp_path)), from_csv)
+    usage_store.ingest(usage_store.fold_steps(usage_store.read_sacct_rows(SAMPLE)), from_raw)
+    assert by_user(from_csv) == by_user(from_raw)
+
+
+def test_reingest_moves_job_out_of_its_old_partition(tmp_path):
+    store = str(tmp_path / "store")
+    pending = ["abc123", "pches", "1001", "job", "open", "PENDING", "01:00:00", "Unknown", "Unknown",
+               "00:00:00", "", "", "1", "4", "None assigned"]
+    usage_store.ingest([pending], store)
+    assert os.path.isdir(os.path.join(store, "unknown", "pches"))
+
+    started = list(pending)
+    started[usage_store.STATE] = "COMPLETED"
+    started[usage_store.START] = "2024-09-03T10:00:00"
+    started[usage_store.END] = "2024-09-03T11:00:00"
+    started[usage_store.ELAPSED] = "01:00:00"
+    assert usage_store.ingest([started], store) == {("2024-09", "pches"): 1}
+
+    assert not os.path.exists(os.path.join(store, "unknown", "pches"))
+    users = by_user(store)
+    assert users["abc123"]["jobs"] == 1
+    assert users["abc123"]["states"] == {"COMPLETED": 1}
+
+
+def test_reingest_keeps_other_jobs(tmp_path):
+    store = str(tmp_path / "store")
+    csv_path = pulled_csv(tmp_path)
+    usage_store.ingest(usage_store.read_csv_rows(csv_path), store)
+    usage_store.ingest(list(usage_store.read_csv_rows(csv_path))[:1], store)
+    assert sum(result["jobs"] for result in by_user(store).values()) == 4
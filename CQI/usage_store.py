@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Columnar store and aggregation for SLURM accounting records.
+#
+# The CSVs written by pull_sacct_records.py stop being usable in Excel once a
+# month passes a million rows. This script ingests them (or raw sacct -P
+# output) into a compact columnar store, one directory per month and
+# account:
+#
+#   STORE/2024-09/pches/meta.json       row count and string dictionaries
+#   STORE/2024-09/pches/<column>.i64    numeric columns as packed int64
+#   STORE/2024-09/pches/<column>.u32    dictionary codes for user/partition/state
+#   STORE/2024-09/pches/<column>.json   free-text columns (JobID, JobName, NodeList)
+#
+# Times are stored as epoch seconds, Elapsed and Timelimit as seconds, and
+# MaxRSS/MaxVMSize as bytes. sacct only reports memory on the step lines, so
+# the highest MaxRSS/MaxVMSize of a job's steps is folded into the job: by
+# pull_sacct_records.py for its CSVs, and here when raw sacct output is
+# ingested. Re-ingesting a job replaces its row, in whichever partition it was
+# stored before (a pending job moves out of "unknown" once it has started).
+#
+# The aggregate command loads the selected partitions and produces
+# per-user/per-partition CPU-hours, memory high-water and job state
+# breakdowns. It uses numpy for the group-by when it is installed and falls
+# back to plain Python otherwise.
+#
+# Example:
+#   usage_store.py ingest --store usage pches_usage_2024-09-1_2024-09-30.csv
+#   usage_store.py aggregate --store usage --months 2024-09 --by user partition
+
+import argparse
+import array
+import calendar
+import csv
+import datetime
+import json
+import os
+import shutil
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Column positions in pull_sacct_records.SACCT_FIELDS order.
+(USER, ACCOUNT, JOBID, JOBNAME, PARTITION, STATE, TIMELIMIT, START, END,
+ ELAPSED, MAXRSS, MAXVMSIZE, NNODES, NCPUS, NODELIST) = range(15)
+
+NUMERIC_COLUMNS = ["start", "end", "elapsed", "timelimit", "maxrss", "maxvmsize", "nnodes", "ncpus"]
+DICT_COLUMNS = ["user", "partition", "state"]
+TEXT_COLUMNS = ["jobid", "jobname", "nodelist"]
+
+MEMORY_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4, "P": 1024 ** 5}
+
+
+def parse_duration(value: str) -> int:
+    """Seconds in a sacct [D-][HH:]MM:SS[.mmm] duration; -1 for UNLIMITED or blank."""
+    value = value.strip()
+    if not value or not value[0].isdigit():
+        return -1
+    days = 0
+    if "-" in value:
+        day_part, value = value.split("-", 1)
+        days = int(day_part)
+    seconds = 0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return days * 86400 + int(seconds)
+
+
+def parse_memory(value: str) -> int:
+    """Bytes in a sacct memory value such as 18734212K or 3.20G; 0 if blank."""
+    value = value.strip()
+    if not value:
+        return 0
+    unit = MEMORY_UNITS.get(value[-1].upper())
+    if unit is None:
+        return int(float(value))
+    return int(float(value[:-1]) * unit)
+
+
+def parse_time(value: str) -> int:
+    """Epoch seconds of a sacct timestamp (taken as UTC); -1 for Unknown/None."""
+    try:
+        return calendar.timegm(datetime.datetime.fromisoformat(value).timetuple())
+    except ValueError:
+        return -1
+
+
+def parse_int(value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+def normalize_state(value: str) -> str:
+    # "CANCELLED by 5512" -> "CANCELLED"
+    return value.split(" ", 1)[0]
+
+
+def fold_steps(rows):
+    """
+    Yield job rows from raw sacct rows, taking the largest MaxRSS/MaxVMSize
+    of each job's steps (the blank-user lines that follow it).
+    """
+    job = None
+    for row in rows:
+        if row[USER].strip():
+            if job is not None:
+                yield job
+            job = list(row)
+        elif job is not None and row[JOBID].split(".", 1)[0] == job[JOBID]:
+            for column in (MAXRSS, MAXVMSIZE):
+                if parse_memory(row[column]) > parse_memory(job[column]):
+                    job[column] = row[column]
+    if job is not None:
+        yield job
+
+
+class Partition:
+    """The columns of one month/account partition, held as compact arrays."""
+
+    def __init__(self):
+        self.numeric = {name: array.array("q") for name in NUMERIC_COLUMNS}
+        self.codes = {name: array.array("I") for name in DICT_COLUMNS}
+        self.dicts = {name: [] for name in DICT_COLUMNS}
+        self._lookup = {name: {} for name in DICT_COLUMNS}
+        self.text = {name: [] for name in TEXT_COLUMNS}
+
+    def __len__(self):
+        return len(self.text["jobid"])
+
+    def _code(self, column, value):
+        lookup = self._lookup[column]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self.dicts[column])
+            self.dicts[column].append(value)
+        return code
+
+    def append(self, row):
+        n = self.numeric
+        n["start"].append(parse_time(row[START]))
+        n["end"].append(parse_time(row[END]))
+        n["elapsed"].append(parse_duration(row[ELAPSED]))
+        n["timelimit"].append(parse_duration(row[TIMELIMIT]))
+        n["maxrss"].append(parse_memory(row[MAXRSS]))
+        n["maxvmsize"].append(parse_memory(row[MAXVMSIZE]))
+        n["nnodes"].append(parse_int(row[NNODES]))
+        n["ncpus"].append(parse_int(row[NCPUS]))
+        self.codes["user"].append(self._code("user", row[USER]))
+        self.codes["partition"].append(self._code("partition", row[PARTITION]))
+        self.codes["state"].append(self._code("state", normalize_state(row[STATE])))
+        self.text["jobid"].append(row[JOBID])
+        self.text["jobname"].append(row[JOBNAME])
+        self.text["nodelist"].append(row[NODELIST])
+
+    def extend(self, other, skip_jobids=frozenset()):
+        """Append the rows of ``other`` whose JobID is not in ``skip_jobids``."""
+        for i, jobid in enumerate(other.text["jobid"]):
+            if jobid in skip_jobids:
+                continue
+            for name in NUMERIC_COLUMNS:
+                self.numeric[name].append(other.numeric[name][i])
+            for name in DICT_COLUMNS:
+                self.codes[name].append(self._code(name, other.dicts[name][other.codes[name][i]]))
+            for name in TEXT_COLUMNS:
+                self.text[name].append(other.text[name][i])
+
+    def write(self, path):
+        tmp_path = path + ".partial"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name, values in self.numeric.items():
+            with open(os.path.join(tmp_path, f"{name}.i64"), "wb") as f:
+                values.tofile(f)
+        for name, values in self.codes.items():
+            with open(os.path.join(tmp_path, f"{name}.u32"), "wb") as f:
+                values.tofile(f)
+        for name, values in self.text.items():
+            with open(os.path.join(tmp_path, f"{name}.json"), "w") as f:
+                json.dump(values, f)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({"rows": len(self), "dicts": self.dicts}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def read(cls, path, text=True):
+        """Load a partition; with ``text=False`` the free-text columns are skipped."""
+        part = cls()
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        rows = meta["rows"]
+        for name in NUMERIC_COLUMNS:
+            with open(os.path.join(path, f"{name}.i64"), "rb") as f:
+                part.numeric[name].fromfile(f, rows)
+        for name in DICT_COLUMNS:
+            with open(os.path.join(path, f"{name}.u32"), "rb") as f:
+                part.codes[name].fromfile(f, rows)
+            part.dicts[name] = meta["dicts"][name]
+            part._lookup[name] = {value: code for code, value in enumerate(part.dicts[name])}
+        if text:
+            for name in TEXT_COLUMNS:
+                with open(os.path.join(path, f"{name}.json")) as f:
+                    part.text[name] = json.load(f)
+        else:
+            part.text["jobid"] = [None] * rows
+        return part
+
+
+def partition_key(row):
+    """(month, account) a record belongs to, by its start time (or end, if never started)."""
+    stamp = row[START] if row[START][:1].isdigit() else row[END]
+    return stamp[:7] if stamp[:1].isdigit() else "unknown", row[ACCOUNT]
+
+
+def ingest(rows, store):
+    """
+    Add job ``rows`` (field lists in SACCT_FIELDS order, no header) to the
+    store, replacing any existing rows with the same JobID. Returns a dict of
+    (month, account) to the number of rows ingested into it.
+    """
+    new = {}
+    for row in rows:
+        key = partition_key(row)
+        part = new.get(key)
+        if part is None:
+            part = new[key] = Partition()
+        part.append(row)
+
+    jobids = set()
+    for part in new.values():
+        jobids.update(part.text["jobid"])
+
+    # Drop earlier rows for these jobs from every partition they might be in,
+    # not only the one they are ingested into now.
+    accounts = {account for _, account in new}
+    merged = {}
+    if os.path.isdir(store):
+        for path in select_partitions(store, accounts=accounts):
+            month, account = os.path.relpath(path, store).split(os.sep)
+            old = Partition.read(path)
+            if (month, account) not in new and jobids.isdisjoint(old.text["jobid"]):
+                continue
+            part = merged[(month, account)] = Partition()
+            part.extend(old, skip_jobids=jobids)
+
+    for key, part in new.items():
+        merged.setdefault(key, Partition()).extend(part)
+    for (month, account), part in merged.items():
+        path = os.path.join(store, month, account)
+        if len(part) == 0:
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        os.makedirs(os.path.join(store, month), exist_ok=True)
+        part.write(path)
+    return {key: len(part) for key, part in new.items()}
+
+
+def read_csv_rows(path):
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        yield from reader
+
+
+def read_sacct_rows(path, delimiter="|"):
+    with open(path) as f:
+        f.readline()  # header
+        for line in f:
+            yield line.rstrip("\n").split(delimiter)
+
+
+def select_partitions(store, months=None, accounts=None):
+    for month in sorted(os.listdir(store)):
+        if months and month not in months:
+            continue
+        for account in sorted(os.listdir(os.path.join(store, month))):
+            if account.endswith(".partial") or (accounts and account not in accounts):
+                continue
+            yield os.path.join(store, month, account)
+
+
+def aggregate(parts, by=("user", "partition")):
+    """
+    Group the rows of ``parts`` by the dictionary columns in ``by`` and return
+    a list of result dicts with jobs, cpu_hours, max_rss, max_vmsize and a
+    per-state job count.
+    """
+    groups = {}
+    states = set()
+    for part in parts:
+        if len(part) == 0:
+            continue
+        keys = _group_keys(part, by)
+        states.update(part.dicts["state"])
+        if numpy is not None:
+            _aggregate_numpy(part, keys, groups)
+        else:
+            _aggregate_python(part, keys, groups)
+    results = []
+    for key in sorted(groups):
+        result = dict(zip(by, key))
+        result.update(groups[key])
+        result["cpu_hours"] = result.pop("cpu_seconds") / 3600
+        results.append(result)
+    return results, sorted(states)
+
+
+def _group_keys(part, by):
+    """Return (per-row group index array, list of group key tuples) for a partition."""
+    index = {}
+    keys = []
+    codes = [part.codes[name] for name in by]
+    dicts = [part.dicts[name] for name in by]
+    row_groups = array.array("I")
+    for combo in zip(*codes):
+        group = index.get(combo)
+        if group is None:
+            group = index[combo] = len(keys)
+            keys.append(tuple(d[c] for d, c in zip(dicts, combo)))
+        row_groups.append(group)
+    return row_groups, keys
+
+
+def _empty_group():
+    return {"jobs": 0, "cpu_seconds": 0, "max_rss": 0, "max_vmsize": 0, "states": {}}
+
+
+def _aggregate_numpy(part, keys, groups):
+    row_groups, group_keys = keys
+    g = numpy.frombuffer(row_groups, dtype=numpy.uint32)
+    n = len(group_keys)
+    elapsed = numpy.frombuffer(part.numeric["elapsed"], dtype=numpy.int64).clip(min=0)
+    ncpus = numpy.frombuffer(part.numeric["ncpus"], dtype=numpy.int64)
+    jobs = numpy.bincount(g, minlength=n)
+    cpu_seconds = numpy.bincount(g, weights=elapsed * ncpus, minlength=n)
+    max_rss = numpy.zeros(n, dtype=numpy.int64)
+    numpy.maximum.at(max_rss, g, numpy.frombuffer(part.numeric["maxrss"], dtype=numpy.int64))
+    max_vm = numpy.zeros(n, dtype=numpy.int64)
+    numpy.maximum.at(max_vm, g, numpy.frombuffer(part.numeric["maxvmsize"], dtype=numpy.int64))
+    state_codes = numpy.frombuffer(part.codes["state"], dtype=numpy.uint32)
+    n_states = len(part.dicts["state"])
+    state_counts = numpy.bincount(g.astype(numpy.int64) * n_states + state_codes, minlength=n * n_states)
+    state_counts = state_counts.reshape(n, n_states)
+    for i, key in enumerate(group_keys):
+        group = groups.setdefault(key, _empty_group())
+        group["jobs"] += int(jobs[i])
+        group["cpu_seconds"] += float(cpu_seconds[i])
+        group["max_rss"] = max(group["max_rss"], int(max_rss[i]))
+        group["max_vmsize"] = max(group["max_vmsize"], int(max_vm[i]))
+        for s, count in enumerate(state_counts[i]):
+            if count:
+                state = part.dicts["state"][s]
+                group["states"][state] = group["states"].get(state, 0) + int(count)
+
+
+def _aggregate_python(part, keys, groups):
+    row_groups, group_keys = keys
+    local = [_empty_group() for _ in group_keys]
+    state_names = part.dicts["state"]
+    columns = zip(row_groups, part.numeric["elapsed"], part.numeric["ncpus"],
+                  part.numeric["maxrss"], part.numeric["maxvmsize"], part.codes["state"])
+    for g, elapsed, ncpus, rss, vm, state in columns:
+        group = local[g]
+        group["jobs"] += 1
+        group["cpu_seconds"] += max(elapsed, 0) * ncpus
+        if rss > group["max_rss"]:
+            group["max_rss"] = rss
+        if vm > group["max_vmsize"]:
+            group["max_vmsize"] = vm
+        name = state_names[state]
+        group["states"][name] = group["states"].get(name, 0) + 1
+    for key, part_group in zip(group_keys, local):
+        group = groups.setdefault(key, _empty_group())
+        group["jobs"] += part_group["jobs"]
+        group["cpu_seconds"] += part_group["cpu_seconds"]
+        group["max_rss"] = max(group["max_rss"], part_group["max_rss"])
+        group["max_vmsize"] = max(group["max_vmsize"], part_group["max_vmsize"])
+        for name, count in part_group["states"].items():
+            group["states"][name] = group["states"].get(name, 0) + count
+
+
+def write_aggregate(results, states, by, out):
+    writer = csv.writer(out)
+    writer.writerow(list(by) + ["jobs", "cpu_hours", "max_rss_gb", "max_vmsize_gb"] + states)
+    for result in results:
+        writer.writerow(
+            [result[name] for name in by]
+            + [result["jobs"], f"{result['cpu_hours']:.2f}",
+               f"{result['max_rss'] / 1024 ** 3:.2f}", f"{result['max_vmsize'] / 1024 ** 3:.2f}"]
+            + [result["states"].get(state, 0) for state in states]
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", help="add pull_sacct_records.py CSVs or raw sacct -P output to the store")
+    p.add_argument("--store", required=True)
+    p.add_argument("--sacct-output", action="store_true",
+                   help="inputs are raw sacct -P output (with step lines) rather than CSVs")
+    p.add_argument("files", nargs="+")
+
+    p = sub.add_parser("aggregate", help="summarize usage by user/partition")
+    p.add_argument("--store", required=True)
+    p.add_argument("--months", nargs="*", help="YYYY-MM partitions to include (default all)")
+    p.add_argument("--accounts", nargs="*", help="accounts to include (default all)")
+    p.add_argument("--by", nargs="+", choices=DICT_COLUMNS, default=["user", "partition"])
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "ingest":
+        for path in args.files:
+            rows = fold_steps(read_sacct_rows(path)) if args.sacct_output else read_csv_rows(path)
+            for (month, account), count in sorted(ingest(rows, args.store).items()):
+                print(f"{count} records from {path} stored in {month}/{account}")
+        return
+
+    parts = (
+        Partition.read(path, text=False)
+        for path in select_partitions(args.store, args.months, args.accounts)
+    )
+    results, states = aggregate(parts, args.by)
+    write_aggregate(results, states, args.by, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
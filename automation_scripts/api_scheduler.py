@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+# Rate limiting, retries and a circuit breaker for every Transfer API call.
+#
+# Several scripts (sync.py, transfer_to_archive.py, routes.py, ...) often run
+# at once under the same Globus identity and so share its API rate limits.
+# Every request made through a TransferClient from globus_client.py goes
+# through here:
+#
+#   budgets   a token bucket per kind of call (submit, task, ls, other),
+#             kept in SQLite so that every process on the host draws from
+#             the same buckets
+#   retries   429, 500, 502-504 (but not endpoint or external errors, as in
+#             globus_sdk) and network errors are retried with full-jitter
+#             exponential backoff, honouring Retry-After, as long as the
+#             process's retry budget (a fraction of its successful calls)
+#             lasts, so retries cannot snowball into a storm. Task polls are
+#             not retried here: TaskWaiter reschedules them itself.
+#   breaker   after BREAKER_FAILURES failed calls in a row of one kind,
+#             further calls of that kind wait until a cooldown has passed
+#             and a single probe call has succeeded
+#
+# Submissions are safe to retry because each carries a submission ID.
+#
+
+import collections
+import functools
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+import globus_sdk
+
+DEFAULT_STATE_FILE = "~/.cache/mri_globus/api_budget.sqlite"
+
+# (requests per second, burst) for each kind of call, shared by all processes.
+BUDGETS = {
+    "submit": (1.0, 5),
+    "task": (10.0, 20),
+    "ls": (10.0, 20),
+    "other": (5.0, 10),
+}
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Retries allowed per successful call, on top of a starting allowance.
+RETRY_RATIO = 0.2
+RETRY_MINIMUM = 10
+
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN = 30.0
+BREAKER_MAX_COOLDOWN = 300.0
+
+# As globus_sdk's Transfer transport: these statuses are retried, unless the
+# error code says an endpoint or external service failed, which a retry
+# will not fix.
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+NON_TRANSIENT_CODES = ("ExternalError", "EndpointError")
+
+_TASK_POLL = re.compile(r"task/[^/]+")
+
+# Call kinds for clients without request(), i.e. the local stand-in.
+METHOD_KINDS = {
+    "submit_transfer": "submit",
+    "submit_delete": "submit",
+    "get_task": "task",
+    "task_successful_transfers": "task",
+    "operation_ls": "ls",
+    "get_submission_id": "other",
+    "cancel_task": "other",
+}
+# Methods whose callers retry for themselves; see is_task_poll.
+UNRETRIED_METHODS = ("get_task",)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+def call_kind(method, path):
+    """Which budget a request draws from."""
+    path = path.lstrip("/")
+    if method.upper() == "POST" and path in ("transfer", "delete"):
+        return "submit"
+    if path.startswith("task/"):
+        return "task"
+    if path.startswith("operation/"):
+        return "ls"
+    return "other"
+
+
+def is_task_poll(method, path):
+    """True for get_task, whose caller (TaskWaiter) already backs off and retries on its own schedule."""
+    return method.upper() == "GET" and _TASK_POLL.fullmatch(path.lstrip("/")) is not None
+
+
+def is_retryable(err):
+    """The errors globus_sdk itself treats as transient: network errors and
+    TRANSIENT_STATUSES, except the endpoint and external errors behind them."""
+    if isinstance(err, globus_sdk.NetworkError):
+        return True
+    if not isinstance(err, globus_sdk.GlobusAPIError) or err.http_status not in TRANSIENT_STATUSES:
+        return False
+    code = err.code or ""
+    return not any(name in code for name in NON_TRANSIENT_CODES)
+
+
+def _retry_after(err):
+    headers = getattr(err, "headers", None) or {}
+    try:
+        return max(float(headers.get("Retry-After")), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBuckets:
+    """
+    Token buckets in SQLite, so processes sharing ``db_path`` share budgets.
+    A caller always takes a token, letting the bucket go negative, and waits
+    for as long as the debt takes to refill; calls are served in order.
+    """
+
+    def __init__(self, db_path=DEFAULT_STATE_FILE, budgets=None):
+        self.budgets = dict(BUDGETS, **(budgets or {}))
+        if db_path != ":memory:":
+            db_path = os.path.expanduser(db_path)
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def reserve(self, kind):
+        """Take a token for ``kind`` and return how many seconds to wait before using it."""
+        rate, burst = self.budgets.get(kind, self.budgets["other"])
+        with self._lock:
+            now = time.time()
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (kind,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                tokens -= 1
+                self.db.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (kind, tokens, now))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return -tokens / rate if tokens < 0 else 0.0
+
+    def acquire(self, kind):
+        wait = self.reserve(kind)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RetryBudget:
+    """Allows RETRY_RATIO retries per successful call, plus RETRY_MINIMUM to start with."""
+
+    def __init__(self, ratio=RETRY_RATIO, minimum=RETRY_MINIMUM):
+        self.ratio = ratio
+        self.cap = minimum
+        self.balance = float(minimum)
+        self._lock = threading.Lock()
+
+    def succeeded(self):
+        with self._lock:
+            self.cap += self.ratio
+            self.balance = min(self.balance + self.ratio, self.cap)
+
+    def try_spend(self):
+        with self._lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class CircuitBreaker:
+    """
+    Closed until BREAKER_FAILURES calls in a row fail, then open: callers wait
+    out the cooldown, after which one probe call at a time is let through
+    until one succeeds. Each failed probe doubles the cooldown.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN,
+                 clock=time.monotonic):
+        self.failures = failures
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.consecutive = 0
+        self.open_until = None
+        self.probing = False
+        self._cond = threading.Condition()
+
+    @property
+    def state(self):
+        if self.open_until is None:
+            return "closed"
+        return "open" if self.clock() < self.open_until else "half-open"
+
+    def before_call(self):
+        """Block until a call may be made; return True if it is the probe."""
+        with self._cond:
+            while self.open_until is not None:
+                now = self.clock()
+                if now < self.open_until:
+                    self._cond.wait(self.open_until - now)
+                elif self.probing:
+                    self._cond.wait()
+                else:
+                    self.probing = True
+                    return True
+            return False
+
+    def record(self, ok, probe=False):
+        with self._cond:
+            if probe:
+                self.probing = False
+            if ok:
+                self.consecutive = 0
+                self.open_until = None
+                self.cooldown = self.base_cooldown
+            else:
+                self.consecutive += 1
+                if probe:
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                if probe or (self.open_until is None and self.consecutive >= self.failures):
+                    print(f"API circuit open for {self.cooldown:.0f} s after {self.consecutive} failures in a row")
+                    self.open_until = self.clock() + self.cooldown
+            self._cond.notify_all()
+
+
+class APIScheduler:
+    """Runs API calls through the shared budgets, the retry budget and a breaker per call kind."""
+
+    def __init__(self, buckets=None, retry_budget=None, max_attempts=MAX_ATTEMPTS,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.buckets = buckets if buckets is not None else TokenBuckets()
+        self.retry_budget = retry_budget if retry_budget is not None else RetryBudget()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breakers = collections.defaultdict(CircuitBreaker)
+        self.retries = collections.Counter()
+
+    def call(self, kind, func, *args, **kwargs):
+        return self._call(kind, self.max_attempts, func, args, kwargs)
+
+    def call_once(self, kind, func, *args, **kwargs):
+        """As call(), but without retries, for callers that retry on their own."""
+        return self._call(kind, 1, func, args, kwargs)
+
+    def _call(self, kind, max_attempts, func, args, kwargs):
+        breaker = self.breakers[kind]
+        for attempt in range(1, max_attempts + 1):
+            probe = breaker.before_call()
+            self.buckets.acquire(kind)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as err:
+                if not is_retryable(err):
+                    # The API answered; the call itself was at fault.
+                    breaker.record(True, probe)
+                    raise
+                breaker.record(False, probe)
+                if attempt == max_attempts or not self.retry_budget.try_spend():
+                    raise
+                delay = _retry_after(err)
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                self.retries[kind] += 1
+                time.sleep(delay)
+                continue
+            breaker.record(True, probe)
+            self.retry_budget.succeeded()
+            return result
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide APIScheduler, created on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = APIScheduler()
+        return _scheduler
+
+
+def install(client, scheduler=None):
+    """
+    Route every API call made through ``client`` via ``scheduler`` (the
+    process-wide one by default). A globus_sdk client is wrapped at
+    request(); anything else (the stand-in) at its Transfer methods.
+    """
+    scheduler = scheduler or get_scheduler()
+    if hasattr(client, "request"):
+        # Leave the SDK's transport only its retry after refreshing an expired
+        # token; transient errors are retried here, within the budgets.
+        transport = getattr(client, "transport", None)
+        if transport is not None and hasattr(transport, "retry_checks"):
+            transport.retry_checks = [
+                check for check in transport.retry_checks
+                if getattr(check, "__name__", None) == "default_check_expired_authorization"
+            ]
+        request = client.request
+
+        @functools.wraps(request)
+        def scheduled_request(method, path, *args, **kwargs):
+            call = scheduler.call_once if is_task_poll(method, path) else scheduler.call
+            return call(call_kind(method, path), request, method, path, *args, **kwargs)
+
+        client.request = scheduled_request
+        return client
+
+    for name, kind in METHOD_KINDS.items():
+        method = getattr(client, name, None)
+        if method is not None:
+            call = scheduler.call_once if name in UNRETRIED_METHODS else scheduler.call
+            setattr(client, name, functools.wraps(method)(functools.partial(call, kind, method)))
+    return client
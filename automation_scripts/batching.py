@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+# Split huge file lists into right-sized TransferData submissions.
+#
+# A single TransferData holding hundreds of thousands of explicit DICOM paths
+# is both a large in-memory document and liable to exceed the Transfer API's
+# request size limits. Here items are pulled from an iterator, grouped into
+# batches capped by item count and by estimated JSON payload size, and each
+# batch is built and submitted only when a submission slot is free. The task
+# IDs come back together as one BatchedJob. Deletions are batched the same way
+# into DeleteData submissions. Given a journal.Journal, batches
+# that already succeeded or were submitted in an interrupted run are skipped
+# or reattached to instead of being sent again.
+#
+
+import concurrent.futures
+import itertools
+import json
+import threading
+
+import globus_sdk
+
+import journal as journal_mod
+import metrics
+import profiling
+import task_waiter
+
+DEFAULT_MAX_ITEMS = 20000
+DEFAULT_MAX_PAYLOAD_BYTES = 8 * 1024 * 1024
+DEFAULT_CONCURRENCY = 4
+
+# Rough JSON size of one transfer_item or delete_item document apart from its paths.
+ITEM_OVERHEAD_BYTES = 100
+
+
+def _item_size(item):
+    size = sum(len(path.encode()) for path in item[:2]) + ITEM_OVERHEAD_BYTES
+    if len(item) > 2 and item[2]:
+        size += len(json.dumps(item[2]))
+    return size
+
+
+def iter_batches(items, max_items=DEFAULT_MAX_ITEMS, max_payload_bytes=DEFAULT_MAX_PAYLOAD_BYTES):
+    """
+    Group ``items`` into lists of at most ``max_items`` items and roughly
+    ``max_payload_bytes`` of JSON each.
+
+    Each item is a (source_path, destination_path) tuple, optionally with a
+    third element holding extra add_item keyword arguments (or None) and
+    further elements identifying the version of the source file, such as
+    its size and mtime, which go into the journal fingerprint; or a (path,)
+    tuple for deletions.
+    """
+    batch = []
+    batch_bytes = 0
+    for item in items:
+        size = _item_size(item)
+        if batch and (len(batch) >= max_items or batch_bytes + size > max_payload_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(item)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+class BatchedJob:
+    """The tasks submitted for one logical transfer."""
+
+    def __init__(self, label=None, journal=None, run_key=None):
+        self.label = label
+        self.journal = journal
+        self.run_key = run_key
+        self.task_ids = []
+        self.item_counts = []
+        self.errors = []
+        self.skipped = []
+
+    @property
+    def item_count(self):
+        return sum(self.item_counts)
+
+    def wait(self, transfer_client, **kwargs):
+        """Wait for every task and return a dict of task_id to task document."""
+        tasks = task_waiter.TaskWaiter(transfer_client).wait(self.task_ids, **kwargs)
+        if self.journal is not None:
+            for task_id, task in tasks.items():
+                if task is not None and task["status"] in task_waiter.TERMINAL_STATUSES:
+                    self.journal.task_finished(self.run_key, task_id, task["status"])
+        return tasks
+
+    def succeeded(self, tasks):
+        return not self.errors and all(
+            tasks.get(task_id) is not None and tasks[task_id]["status"] == "SUCCEEDED"
+            for task_id in self.task_ids
+        )
+
+
+@profiling.timed("batch")
+def build_batch(transfer_client, source_endpoint, destination_endpoint, batch, label=None, **transfer_kwargs):
+    transfer_data = globus_sdk.TransferData(
+        transfer_client, source_endpoint, destination_endpoint, label=label, **transfer_kwargs
+    )
+    for item in batch:
+        transfer_data.add_item(item[0], item[1], **(item[2] if len(item) > 2 and item[2] else {}))
+    return transfer_data
+
+
+@profiling.timed("batch")
+def build_delete_batch(transfer_client, endpoint, batch, label=None, **delete_kwargs):
+    delete_data = globus_sdk.DeleteData(transfer_client, endpoint, label=label, **delete_kwargs)
+    for item in batch:
+        delete_data.add_item(item[0])
+    return delete_data
+
+
+def submit_batches(transfer_client, source_endpoint, destination_endpoint, items,
+                   max_items=DEFAULT_MAX_ITEMS, max_payload_bytes=DEFAULT_MAX_PAYLOAD_BYTES,
+                   concurrency=DEFAULT_CONCURRENCY, label=None, filter_rules=(), journal=None, run_key=None,
+                   **transfer_kwargs):
+    """
+    Submit ``items`` as as many transfer tasks as needed and return a
+    BatchedJob. At most ``concurrency`` batches are being built or submitted
+    at once, so only that many batches are held in memory.
+
+    ``transfer_kwargs`` are passed to every globus_sdk.TransferData, and
+    ``filter_rules`` (add_filter_rule keyword dicts) are added to each. With
+    a ``journal``, each batch is recorded under ``run_key`` and batches from
+    an interrupted run of the same key are skipped or reattached to.
+    """
+    def build(batch, batch_label):
+        transfer_data = build_batch(
+            transfer_client, source_endpoint, destination_endpoint, batch, batch_label, **transfer_kwargs
+        )
+        for rule in filter_rules:
+            transfer_data.add_filter_rule(**rule)
+        return transfer_data
+
+    return _submit_all(transfer_client, iter_batches(items, max_items, max_payload_bytes), build,
+                       concurrency, label, journal, run_key)
+
+
+def submit_delete_batches(transfer_client, endpoint, paths,
+                          max_items=DEFAULT_MAX_ITEMS, max_payload_bytes=DEFAULT_MAX_PAYLOAD_BYTES,
+                          concurrency=DEFAULT_CONCURRENCY, label=None, journal=None, run_key=None,
+                          **delete_kwargs):
+    """
+    Submit the deletion of ``paths`` on ``endpoint`` as as many delete tasks
+    as needed and return a BatchedJob, as submit_batches does for transfers.
+    ``delete_kwargs`` are passed to every globus_sdk.DeleteData.
+    """
+    def build(batch, batch_label):
+        return build_delete_batch(transfer_client, endpoint, batch, batch_label, **delete_kwargs)
+
+    items = ((path,) for path in paths)
+    return _submit_all(transfer_client, iter_batches(items, max_items, max_payload_bytes), build,
+                       concurrency, label, journal, run_key)
+
+
+def _submit_all(transfer_client, batches, build, concurrency, label, journal, run_key):
+    job = BatchedJob(label, journal, run_key)
+    slots = threading.Semaphore(concurrency)
+    lock = threading.Lock()
+
+    def submit(number, batch):
+        batch_label = f"{label} batch {number}" if label else None
+        return metrics.submit(transfer_client, build(batch, batch_label))["task_id"]
+
+    def submit_one(number, batch):
+        try:
+            if journal is None:
+                task_id = submit(number, batch)
+            else:
+                task_id, done = journal_mod.resume_or_submit(
+                    journal, run_key, journal_mod.fingerprint((item[0], *item[3:]) for item in batch),
+                    lambda: submit(number, batch), number, len(batch),
+                )
+                if done:
+                    with lock:
+                        job.skipped.append(number)
+                    print(f"Batch {number} of {len(batch)} items already done; skipping")
+                    return
+            with lock:
+                job.task_ids.append(task_id)
+                job.item_counts.append(len(batch))
+            print(f"Submitted batch {number} of {len(batch)} items as task {task_id}")
+        except Exception as err:
+            # Not only API errors: a journal or build failure must also mark
+            # the job failed rather than vanish inside the pool.
+            with lock:
+                job.errors.append((number, err))
+            print(f"Batch {number} of {len(batch)} items failed to submit: {err!r}")
+        finally:
+            slots.release()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for number, batch in zip(itertools.count(1), batches):
+            slots.acquire()
+            pool.submit(submit_one, number, batch)
+
+    return job
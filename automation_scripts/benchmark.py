@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+# Benchmark the submit/poll/list code against a local Globus stand-in.
+#
+# Each scenario drives the same code the scripts use, with
+# fixtures/fake_transfer.py in place of the Transfer API and a synthetic
+# tree of the requested size:
+#
+#   ls        recursive listing, as ls_test.py --recursive
+#   transfer  one orchestrated task per top-level directory, as transfer.py
+#   sync      every file submitted in batches, as sync.py after a change scan
+#   archive   checksummed items, then the post-transfer listing check, as
+#             transfer_to_archive.py --checksums --verify
+#
+# For every scenario and tree size it reports the API calls made, calls per
+# task, wall time and peak Python memory (tracemalloc, which slows the run
+# down but counts only what our code allocates). --profile and its variants
+# (see profiling.py) add the per-phase and per-call breakdown.
+#
+# Example:
+#   benchmark.py --files 10000 100000 1000000 --latency 0.05 --scenarios ls sync
+#
+
+import argparse
+import contextlib
+import functools
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import globus_sdk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+
+import fake_transfer
+
+import change_index
+import checksums
+import globus_client
+import listing_cache
+import orchestrator
+import profiling
+import recursive_ls
+import sync
+import task_waiter
+import transfer
+import transfer_to_archive
+
+SCENARIOS = ["ls", "transfer", "sync", "archive"]
+DEFAULT_FILES = [10000, 100000]
+
+# Location name used for the archive scenario's ./LOCATION/DATA/ tree.
+ARCHIVE_LOCATION = "bench"
+
+
+class _SyntheticIndex:
+    """Stands in for change_index.ChangeIndex, reporting every file of a tree as changed."""
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    def scan(self, hash_changed=False, top=""):
+        for path in self.tree.iter_files():
+            yield change_index.FileRecord(path, self.tree.file_size, 0, 0, None)
+
+    def commit(self, records):
+        pass
+
+
+@contextlib.contextmanager
+def scratch_listing_cache():
+    """
+    Point the default listing cache at a temporary file, so the listings the
+    scenarios invalidate (as sync.py does after a transfer) are not the user's.
+    """
+    saved = listing_cache.DEFAULT_CACHE_FILE
+    with tempfile.TemporaryDirectory() as tmp:
+        listing_cache.DEFAULT_CACHE_FILE = os.path.join(tmp, "listings.sqlite")
+        try:
+            yield
+        finally:
+            listing_cache.DEFAULT_CACHE_FILE = saved
+
+
+def run_ls(client, tree, args):
+    with open(os.devnull, "w") as out:
+        rows = recursive_ls.walk(client, "bench", "/", workers=args.workers, page_size=args.page_size)
+        recursive_ls.write_jsonl(rows, out)
+    return True
+
+
+def run_transfer(client, tree, args):
+    top = ["/" + entry["name"] for entry in tree.list_dir([])]
+    waiter_factory = functools.partial(
+        task_waiter.TaskWaiter, min_interval=args.min_interval, max_interval=args.max_interval
+    )
+    results = orchestrator.Orchestrator(
+        client, concurrency=args.concurrency, retries=0, waiter_factory=waiter_factory
+    ).run(transfer.build_jobs(top, "/"))
+    return all(r.task is not None and r.task["status"] == "SUCCEEDED" for r in results)
+
+
+def run_sync(client, tree, args):
+    return sync.changed_sync(client, _SyntheticIndex(tree))
+
+
+def run_archive(client, tree, args):
+    entries = [
+        checksums.ManifestEntry("0" * 64, tree.file_size, path) for path in tree.iter_files()
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest_path = os.path.join(tmp, checksums.MANIFEST_DIR, "checksums_bench.txt")
+        checksums.write_manifest(entries, manifest_path)
+        transfer_data = globus_sdk.TransferData(
+            client, transfer_to_archive.source_collection_id, transfer_to_archive.dest_collection_id
+        )
+        checksums.add_items_with_checksums(
+            transfer_data, entries, f"./{ARCHIVE_LOCATION}/bench/", f"./{ARCHIVE_LOCATION}/DATA/"
+        )
+        del entries
+        task_id = globus_client.submit_transfer(client, transfer_data)
+        del transfer_data
+        task = task_waiter.wait_for_task(client, task_id)
+        if task["status"] != "SUCCEEDED":
+            return False
+        args_ns = argparse.Namespace(
+            DATA_LOCATION=ARCHIVE_LOCATION, dest_collection=transfer_to_archive.dest_collection_id
+        )
+        return transfer_to_archive.verify_archive(client, args_ns, manifest_path)
+
+
+RUNNERS = {"ls": run_ls, "transfer": run_transfer, "sync": run_sync, "archive": run_archive}
+
+
+def benchmark(scenario, files, args):
+    """Run one scenario on a tree of ``files`` files and return a dict of measurements."""
+    tree = fake_transfer.SyntheticTree(files, files_per_dir=args.files_per_dir, fanout=args.fanout)
+    mount = f"{ARCHIVE_LOCATION}/DATA" if scenario == "archive" else "/"
+    client = fake_transfer.FakeTransferClient(
+        tree, mount=mount, latency=args.latency, page_limit=args.page_size,
+        queue_seconds=args.queue_seconds, task_seconds=args.task_seconds,
+        files_per_second=args.files_per_second,
+    )
+    profiling.instrument(client)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    try:
+        with contextlib.redirect_stdout(output):
+            with profiling.phase(scenario):
+                ok = RUNNERS[scenario](client, tree, args)
+    finally:
+        wall = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if output is not sys.stdout:
+            output.close()
+
+    tasks = client.calls["submit_transfer"]
+    api_calls = sum(client.calls.values())
+    return {
+        "scenario": scenario,
+        "files": files,
+        "ok": ok,
+        "tasks": tasks,
+        "api_calls": api_calls,
+        "calls_per_task": api_calls / tasks if tasks else None,
+        "wall_s": wall,
+        "peak_mb": peak / 1e6,
+        "calls": dict(client.calls),
+    }
+
+
+def print_result(result):
+    per_task = f"{result['calls_per_task']:.1f}" if result["calls_per_task"] is not None else "-"
+    print(
+        f"{result['scenario']:<9} {result['files']:>10} {result['tasks']:>6} {result['api_calls']:>9} "
+        f"{per_task:>9} {result['wall_s']:>9.2f} {result['peak_mb']:>9.1f}"
+        + ("" if result["ok"] else "  FAILED")
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, nargs="+", default=DEFAULT_FILES,
+                        help="synthetic tree sizes to run, in files")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--files-per-dir", type=int, default=fake_transfer.DEFAULT_FILES_PER_DIR)
+    parser.add_argument("--fanout", type=int, default=fake_transfer.DEFAULT_FANOUT,
+                        help="subdirectories per directory above the leaves")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--page-size", type=int, default=recursive_ls.DEFAULT_PAGE_SIZE,
+                        help="operation_ls page size, and the most the fake returns per page")
+    parser.add_argument("--workers", type=int, default=recursive_ls.DEFAULT_WORKERS,
+                        help="concurrent listings for the ls scenario")
+    parser.add_argument("--concurrency", type=int, default=orchestrator.DEFAULT_CONCURRENCY,
+                        help="tasks in flight for the transfer scenario")
+    parser.add_argument("--min-interval", type=float, default=task_waiter.DEFAULT_MIN_INTERVAL,
+                        help="first poll interval for the transfer scenario")
+    parser.add_argument("--max-interval", type=float, default=task_waiter.DEFAULT_MAX_INTERVAL,
+                        help="largest poll interval for the transfer scenario")
+    parser.add_argument("--queue-seconds", type=float, default=0.0,
+                        help="how long each fake task stays queued")
+    parser.add_argument("--task-seconds", type=float, default=0.5,
+                        help="how long each fake task runs, before per-file time")
+    parser.add_argument("--files-per-second", type=float, default=100000.0,
+                        help="rate at which fake tasks move files")
+    parser.add_argument("--verbose", action="store_true", help="show the scripts' own output")
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiling.configure(args.profile, args.profile_cprofile, args.profile_sample)
+    print(f"{'scenario':<9} {'files':>10} {'tasks':>6} {'api_calls':>9} {'per_task':>9} {'wall_s':>9} {'peak_mb':>9}")
+    with scratch_listing_cache():
+        for files in args.files:
+            for scenario in args.scenarios:
+                print_result(benchmark(scenario, files, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Delete the files of an eligible_for_deletion list through Globus.
+#
+# transfer_to_archive.py --reconcile writes eligible_for_deletion_TODAY.txt,
+# the local paths of the bundles (and the files packed into them) that Globus
+# confirmed delivered to the archive. Rather than an rm per file, the list is
+# read as a stream, each path is mapped onto the collection that exposes the
+# scratch directory, and the paths are deleted in DeleteData tasks of at most
+# --max-items paths, --concurrency of them submitted at a time. Each batch is
+# journaled, so a re-run skips batches already deleted and reattaches to
+# those still running, and the run only counts as done once every task has
+# SUCCEEDED. Paths outside the collection are reported and left alone.
+#
+# Example:
+#   bulk_delete.py /storage/work/.../University_Park/20241018/eligible_for_deletion_20241018.txt \
+#       --local-root /storage/work/other_d666f751616c41/prod \
+#       --collection a7b0d0fe-f0ef-4186-a96b-fc89ee61679a --client-id ... --token-file ...
+#
+
+import argparse
+import os
+import sys
+
+import batching
+import globus_client
+import journal
+import metrics
+import profiling
+import task_waiter
+
+# Smaller than transfer batches, so one failed delete task holds back less.
+DEFAULT_MAX_ITEMS = 10000
+DEFAULT_CONCURRENCY = 4
+
+
+def read_paths(list_file):
+    """Yield the paths in a one-per-line list, skipping blank lines."""
+    with open(list_file) as f:
+        for line in f:
+            path = line.rstrip("\n")
+            if path.strip():
+                yield path
+
+
+def to_collection_path(local_path, local_root):
+    """The collection path of ``local_path`` for a collection rooted at ``local_root``, or None if outside it."""
+    rel = os.path.relpath(os.path.abspath(local_path), os.path.abspath(local_root))
+    if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+        return None
+    return "/" + rel.replace(os.sep, "/")
+
+
+def report_status(task_id, task):
+    print(f"Delete {task_id} status: {task_waiter.task_state(task)}")
+
+
+def delete_paths(transfer_client, collection_id, local_paths, local_root, jrnl=None, run_key=None,
+                 max_items=DEFAULT_MAX_ITEMS, concurrency=DEFAULT_CONCURRENCY, label=None):
+    """
+    Delete ``local_paths`` (an iterable, read once) on ``collection_id``,
+    which exposes ``local_root``, and wait for the tasks. Batches are
+    journaled under ``run_key`` when a journal is given. Returns True if every
+    delete task succeeded.
+    """
+    outside = []
+
+    def collection_paths():
+        for path in local_paths:
+            collection_path = to_collection_path(path, local_root)
+            if collection_path is None:
+                outside.append(path)
+            else:
+                yield collection_path
+
+    job = batching.submit_delete_batches(
+        transfer_client,
+        collection_id,
+        collection_paths(),
+        max_items=max_items,
+        concurrency=concurrency,
+        label=label,
+        journal=jrnl,
+        run_key=run_key,
+        # A re-run after a partial delete must not fail on what is already gone.
+        ignore_missing=True,
+    )
+    tasks = job.wait(transfer_client, on_update=report_status)
+    ok = job.succeeded(tasks)
+    skipped = f" ({len(job.skipped)} batches were already deleted)" if job.skipped else ""
+    if ok:
+        print(f"Deleted {job.item_count} paths in {len(job.task_ids)} tasks{skipped}.")
+    else:
+        print(f"Deletion failed for some of {len(job.task_ids)} tasks{skipped}. Check Globus dashboard for details.")
+    for path in outside[:20]:
+        print(f"Not under {local_root}, left in place: {path}")
+    if len(outside) > 20:
+        print(f"... and {len(outside) - 20} more")
+    return ok
+
+
+def delete_list(transfer_client, collection_id, list_file, local_root, jrnl, run_key=None, **kwargs):
+    """delete_paths for the paths in ``list_file``, as one journaled run."""
+    run_key = run_key or f"delete:{os.path.abspath(list_file)}"
+    if jrnl.start_run(run_key):
+        print(f"Resuming the interrupted deletion of {list_file}")
+    ok = delete_paths(transfer_client, collection_id, read_paths(list_file), local_root, jrnl, run_key, **kwargs)
+    jrnl.finish_run(run_key, journal.SUCCEEDED if ok else journal.FAILED)
+    return ok
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("list_file", metavar="LIST", help="file of local paths to delete, one per line")
+    parser.add_argument("--local-root", required=True, help="local directory the collection is rooted at")
+    parser.add_argument("--collection", required=True, help="collection to delete from")
+    parser.add_argument("--max-items", type=int, default=DEFAULT_MAX_ITEMS, help="paths per delete task")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="delete tasks submitted at once")
+    parser.add_argument("--journal", default=journal.DEFAULT_JOURNAL_FILE,
+                        help="journal of submitted tasks, used to resume an interrupted run")
+    parser.add_argument("--client-id", required=True)
+    parser.add_argument("--token-file", required=True)
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics.configure(args.metrics_log, args.metrics_prom, script="bulk_delete")
+    profiling.configure(args.profile, args.profile_cprofile, args.profile_sample)
+    transfer_client = globus_client.get_transfer_client(args.client_id, args.token_file)
+    with journal.Journal(args.journal) as jrnl:
+        ok = delete_list(
+            transfer_client, args.collection, args.list_file, args.local_root, jrnl,
+            max_items=args.max_items, concurrency=args.concurrency,
+            label=f"Delete {os.path.basename(args.list_file)}",
+        )
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
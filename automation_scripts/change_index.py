@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+# Persistent change-detection index of a local directory tree.
+#
+# sync.py used to push the whole of /storage/long with sync_level="checksum",
+# which makes both endpoints re-checksum every file on every run. This index
+# keeps path, size, mtime, inode and (optionally) a content hash for each file
+# in a SQLite database, so a run can walk the tree with os.scandir and submit
+# only the files that are new or have changed since the last successful sync.
+#
+# Index rows are only updated once the caller confirms the transfer worked
+# (see ChangeIndex.commit), so a failed run is simply retried next time.
+#
+
+import collections
+import hashlib
+import os
+import sqlite3
+import time
+
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+# One file found by a scan. path is relative to the index root, using "/"
+# separators. hash is None unless the scan was asked to hash changed files.
+FileRecord = collections.namedtuple("FileRecord", ["path", "size", "mtime_ns", "inode", "hash"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    hash TEXT,
+    PRIMARY KEY (dir, name)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def hash_file(path):
+    """Return the hex sha256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _split(path):
+    head, _, name = path.rpartition("/")
+    return head, name
+
+
+class ChangeIndex:
+    """SQLite-backed index of the files under ``root``."""
+
+    def __init__(self, db_path, root):
+        self.root = os.path.abspath(root)
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _walk(self, top=""):
+        """Yield (relative_dir, [DirEntry, ...]) for every directory under root, or under ``top`` in it."""
+        stack = [top.strip("/")]
+        while stack:
+            rel_dir = stack.pop()
+            files = []
+            try:
+                with os.scandir(os.path.join(self.root, rel_dir)) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(f"{rel_dir}/{entry.name}" if rel_dir else entry.name)
+                        elif entry.is_file(follow_symlinks=False):
+                            files.append(entry)
+            except OSError as err:
+                print(f"Skipping unreadable directory {rel_dir or '/'}: {err}")
+                continue
+            yield rel_dir, files
+
+    def scan(self, hash_changed=False, top=""):
+        """
+        Walk the tree and yield a FileRecord for every file that is new or whose
+        size, mtime or inode differ from the index. With ``hash_changed``, such
+        files are also hashed and skipped if their content hash is unchanged.
+        ``top`` limits the walk to one directory relative to the root.
+        """
+        for rel_dir, entries in self._walk(top):
+            known = {
+                name: (size, mtime_ns, inode, digest)
+                for name, size, mtime_ns, inode, digest in self.db.execute(
+                    "SELECT name, size, mtime_ns, inode, hash FROM files WHERE dir = ?", (rel_dir,)
+                )
+            }
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                previous = known.get(entry.name)
+                if previous is not None and previous[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+                    continue
+                path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                digest = None
+                if hash_changed:
+                    try:
+                        digest = hash_file(entry.path)
+                    except OSError:
+                        continue
+                    if previous is not None and previous[3] == digest:
+                        # Touched but not modified; just refresh the stat data.
+                        self.commit([FileRecord(path, st.st_size, st.st_mtime_ns, st.st_ino, digest)])
+                        continue
+                yield FileRecord(path, st.st_size, st.st_mtime_ns, st.st_ino, digest)
+
+    def commit(self, records):
+        """Record ``records`` as synced."""
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO files (dir, name, size, mtime_ns, inode, hash) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((*_split(r.path), r.size, r.mtime_ns, r.inode, r.hash) for r in records),
+            )
+
+    def rebuild(self, synced_at):
+        """
+        Replace the index with the current state of the tree. Used after a full
+        checksum sync that started at ``synced_at`` (a POSIX timestamp); files
+        modified after that are left out so the next run picks them up.
+        """
+        cutoff_ns = int(synced_at * 1e9)
+        with self.db:
+            self.db.execute("DELETE FROM files")
+            for rel_dir, entries in self._walk():
+                rows = []
+                for entry in entries:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if st.st_mtime_ns > cutoff_ns:
+                        continue
+                    rows.append((rel_dir, entry.name, st.st_size, st.st_mtime_ns, st.st_ino, None))
+                self.db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.set_meta("last_full_sync", synced_at)
+
+    def full_sync_due(self, max_age_days):
+        """True if no full sync has been recorded in the last ``max_age_days``."""
+        last = float(self.get_meta("last_full_sync", 0))
+        return time.time() - last > max_age_days * 86400
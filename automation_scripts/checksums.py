@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+# Precompute file checksums ahead of a transfer, and verify afterwards.
+#
+# With sync_level="checksum" and verify_checksum=True, Globus hashes files on
+# both endpoints while the transfer runs. This hashes the source files ahead
+# of time in a process pool (mmap for large files, large buffered reads for
+# small ones) and writes the digests to a manifest in the MANIFESTS
+# directory, which transfer_to_archive.py already routes to the archive.
+# Digests are cached by path, size and mtime so unchanged files are never
+# hashed twice. The digests can be passed to Globus as external_checksum, and
+# after the transfer the destination listing is checked against the manifest
+# for presence and size instead of re-reading every byte.
+#
+
+import collections
+import concurrent.futures
+import hashlib
+import mmap
+import os
+import sqlite3
+
+DEFAULT_CACHE_FILE = "~/.cache/mri_globus/digests.sqlite"
+DEFAULT_ALGORITHM = "sha256"
+MANIFEST_DIR = "MANIFESTS"
+
+# Files at least this big are hashed through mmap, smaller ones with reads.
+MMAP_THRESHOLD = 16 * 1024 * 1024
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Files handed to each worker at a time, so tiny files don't cost one IPC
+# round trip apiece.
+CHUNK_SIZE = 64
+
+ManifestEntry = collections.namedtuple("ManifestEntry", ["digest", "size", "path"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    algorithm TEXT NOT NULL,
+    digest TEXT NOT NULL
+);
+"""
+
+
+def hash_path(path, algorithm=DEFAULT_ALGORITHM):
+    """Return the hex digest of one file."""
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                digest.update(m)
+        else:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _hash_one(args):
+    path, algorithm = args
+    try:
+        return hash_path(path, algorithm)
+    except OSError:
+        return None
+
+
+class DigestCache:
+    """SQLite cache of file digests keyed by path, valid while size and mtime match."""
+
+    def __init__(self, db_path=DEFAULT_CACHE_FILE):
+        db_path = os.path.expanduser(db_path)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, path, st, algorithm):
+        row = self.db.execute(
+            "SELECT digest FROM digests WHERE path = ? AND size = ? AND mtime_ns = ? AND algorithm = ?",
+            (path, st.st_size, st.st_mtime_ns, algorithm),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, rows):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def _iter_files(root):
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != MANIFEST_DIR:
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry.stat(follow_symlinks=False)
+
+
+def compute_digests(root, cache=None, algorithm=DEFAULT_ALGORITHM, workers=None, paths=None):
+    """
+    Return a list of ManifestEntry for the files under ``root`` (or just
+    ``paths``, absolute paths under root), with paths relative to root.
+    Cached digests are reused; everything else is hashed in a process pool.
+    """
+    root = os.path.abspath(root)
+    if paths is None:
+        files = list(_iter_files(root))
+    else:
+        files = [(path, os.stat(path)) for path in paths]
+
+    entries = {}
+    to_hash = []
+    for path, st in files:
+        digest = cache.get(path, st, algorithm) if cache is not None else None
+        if digest is not None:
+            entries[path] = ManifestEntry(digest, st.st_size, os.path.relpath(path, root))
+        else:
+            to_hash.append((path, st))
+
+    print(f"Hashing {len(to_hash)} files ({len(entries)} digests reused from cache)")
+    if to_hash:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            digests = pool.map(_hash_one, [(path, algorithm) for path, _ in to_hash], chunksize=CHUNK_SIZE)
+            new_rows = []
+            for (path, st), digest in zip(to_hash, digests):
+                if digest is None:
+                    print(f"Could not read {path}; leaving it out of the manifest")
+                    continue
+                entries[path] = ManifestEntry(digest, st.st_size, os.path.relpath(path, root))
+                new_rows.append((path, st.st_size, st.st_mtime_ns, algorithm, digest))
+        if cache is not None:
+            cache.put_many(new_rows)
+
+    return sorted(entries.values(), key=lambda e: e.path)
+
+
+def write_manifest(entries, manifest_path):
+    """Write entries as ``<digest>  <size>  <path>`` lines, like the packing manifests."""
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = manifest_path + ".partial"
+    with open(tmp_path, "w") as f:
+        for entry in entries:
+            f.write(f"{entry.digest}  {entry.size}  {entry.path}\n")
+    os.replace(tmp_path, manifest_path)
+
+
+def read_manifest(manifest_path):
+    """Yield the ManifestEntry lines of a manifest written by write_manifest."""
+    with open(manifest_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            digest, size, path = line.rstrip("\n").split("  ", 2)
+            yield ManifestEntry(digest, int(size), path)
+
+
+def add_items_with_checksums(transfer_data, entries, source_root, destination_root,
+                             algorithm=DEFAULT_ALGORITHM):
+    """
+    Add one item per manifest entry, passing the precomputed digest as the
+    external checksum so Globus verifies the destination against it.
+    """
+    for entry in entries:
+        transfer_data.add_item(
+            f"{source_root.rstrip('/')}/{entry.path}",
+            f"{destination_root.rstrip('/')}/{entry.path}",
+            external_checksum=entry.digest,
+            checksum_algorithm=algorithm.upper(),
+        )
+
+
+def verify_listing(manifest_entries, listing):
+    """
+    Compare a manifest against a destination listing, given as an iterable of
+    (relative_path, size) pairs. Returns (missing, mismatched) path lists.
+
+    Globus listings do not carry checksums, so this checks presence and size;
+    content was already verified by Globus during the transfer.
+    """
+    sizes = dict(listing)
+    missing = []
+    mismatched = []
+    for entry in manifest_entries:
+        size = sizes.get(entry.path)
+        if size is None:
+            missing.append(entry.path)
+        elif size != entry.size:
+            mismatched.append(entry.path)
+    return missing, mismatched
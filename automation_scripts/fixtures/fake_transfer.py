@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+# Local stand-in for the Globus Transfer API, for benchmark.py.
+#
+# FakeTransferClient answers the calls the scripts make on a TransferClient
+# (get_submission_id, submit_transfer, submit_delete, get_task, operation_ls
+# and task_successful_transfers) from a SyntheticTree, a directory tree that is
+# computed on demand rather than stored, so trees of millions of files cost
+# nothing to set up. Every call sleeps for a configurable latency and is
+# counted in .calls, listings are cut into pages of at most page_limit
+# entries, and tasks run on the wall clock: queued for queue_seconds, then
+# active for task_seconds plus one second per files_per_second files.
+#
+
+import collections
+import datetime
+import itertools
+import math
+import posixpath
+import threading
+import time
+import uuid
+
+DEFAULT_FILES_PER_DIR = 1000
+DEFAULT_FANOUT = 10
+DEFAULT_FILE_SIZE = 512 * 1024
+DEFAULT_PAGE_LIMIT = 1000
+DEFAULT_TRANSFERS_PAGE_SIZE = 1000
+
+LAST_MODIFIED = "2024-01-01 00:00:00+00:00"
+
+
+class NotFound(Exception):
+    pass
+
+
+class SyntheticTree:
+    """
+    ``files`` files of ``file_size`` bytes, ``files_per_dir`` to a leaf
+    directory, under a tree of directories with ``fanout`` subdirectories
+    each. Leaf directories are all at the same depth and only leaves hold
+    files, like sessions/series of an MRI project.
+    """
+
+    def __init__(self, files, files_per_dir=DEFAULT_FILES_PER_DIR, fanout=DEFAULT_FANOUT,
+                 file_size=DEFAULT_FILE_SIZE):
+        self.files = files
+        self.files_per_dir = files_per_dir
+        self.fanout = fanout
+        self.file_size = file_size
+        self.leaves = max(math.ceil(files / files_per_dir), 1)
+        self.depth = max(math.ceil(math.log(self.leaves, fanout)), 1) if self.leaves > 1 else 1
+
+    def _leaf_range(self, digits):
+        """Leaf indexes [first, last) under the directory with these digits."""
+        span = self.fanout ** (self.depth - len(digits))
+        first = 0
+        for digit in digits:
+            first = first * self.fanout + digit
+        first *= span
+        return first, min(first + span, self.leaves)
+
+    def _files_in_leaf(self, leaf):
+        return max(min(self.files_per_dir, self.files - leaf * self.files_per_dir), 0)
+
+    def parse(self, components):
+        """Return (digits, file_name) for path components below the root."""
+        digits = []
+        for i, name in enumerate(components):
+            if len(digits) == self.depth:
+                if i == len(components) - 1:
+                    return digits, name
+                raise NotFound("/".join(components))
+            if not name.startswith("d") or not name[1:].isdigit():
+                raise NotFound("/".join(components))
+            digits.append(int(name[1:]))
+        first, last = self._leaf_range(digits)
+        if first >= last:
+            raise NotFound("/".join(components))
+        return digits, None
+
+    def dir_name(self, digit):
+        return f"d{digit:0{len(str(self.fanout - 1))}d}"
+
+    def list_dir(self, digits):
+        """Return the entries of a directory as operation_ls documents."""
+        if len(digits) == self.depth:
+            leaf = self._leaf_range(digits)[0]
+            return [
+                {"DATA_TYPE": "file", "type": "file", "name": f"{j:06d}.dcm", "size": self.file_size,
+                 "permissions": "0644", "user": "mri", "group": "mri", "last_modified": LAST_MODIFIED}
+                for j in range(self._files_in_leaf(leaf))
+            ]
+        entries = []
+        for digit in range(self.fanout):
+            first, last = self._leaf_range(digits + [digit])
+            if first >= last:
+                break
+            entries.append(
+                {"DATA_TYPE": "file", "type": "dir", "name": self.dir_name(digit), "size": 4096,
+                 "permissions": "0755", "user": "mri", "group": "mri", "last_modified": LAST_MODIFIED}
+            )
+        return entries
+
+    def count_files(self, digits):
+        first, last = self._leaf_range(list(digits))
+        if first >= last:
+            return 0
+        # Only the very last leaf of the tree can be short.
+        return (last - first - 1) * self.files_per_dir + self._files_in_leaf(last - 1)
+
+    def iter_files(self, digits=()):
+        """Yield the paths (relative to the root) of every file under a directory."""
+        first, last = self._leaf_range(list(digits))
+        for leaf in range(first, last):
+            parts = []
+            index = leaf
+            for _ in range(self.depth):
+                index, digit = divmod(index, self.fanout)
+                parts.append(self.dir_name(digit))
+            prefix = "/".join(reversed(parts))
+            for j in range(self._files_in_leaf(leaf)):
+                yield f"{prefix}/{j:06d}.dcm"
+
+
+def _iso(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+
+class FakeTransferClient:
+    """A TransferClient stand-in serving ``tree`` at ``mount`` on every collection."""
+
+    def __init__(self, tree, mount="/", latency=0.0, page_limit=DEFAULT_PAGE_LIMIT,
+                 transfers_page_size=DEFAULT_TRANSFERS_PAGE_SIZE, queue_seconds=0.0,
+                 task_seconds=0.5, files_per_second=100000.0):
+        self.tree = tree
+        self.mount = posixpath.normpath(mount)
+        self.latency = latency
+        self.page_limit = page_limit
+        self.transfers_page_size = transfers_page_size
+        self.queue_seconds = queue_seconds
+        self.task_seconds = task_seconds
+        self.files_per_second = files_per_second
+        self.calls = collections.Counter()
+        self.tasks = {}
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _resolve(self, path):
+        path = posixpath.normpath(path or "/")
+        root = self.mount.rstrip("/") + "/"
+        if path == self.mount:
+            return self.tree.parse([])
+        if not path.startswith(root):
+            raise NotFound(path)
+        return self.tree.parse(path[len(root):].split("/"))
+
+    def get_submission_id(self):
+        self._call("get_submission_id")
+        return {"value": str(uuid.uuid4())}
+
+    def submit_transfer(self, data):
+        self._call("submit_transfer")
+        files = 0
+        items = []
+        for item in data["DATA"]:
+            try:
+                digits, name = self._resolve(item["source_path"])
+            except NotFound:
+                # Paths outside the tree are taken to be single files.
+                digits, name = None, posixpath.basename(item["source_path"])
+            if name is None:
+                files += self.tree.count_files(digits)
+            else:
+                files += 1
+            items.append((item["source_path"], item["destination_path"], digits, name))
+        now = time.time()
+        task_id = str(uuid.uuid4())
+        self.tasks[task_id] = {
+            "label": data.get("label"),
+            "items": items,
+            "files": files,
+            "request_time": now,
+            "start_time": now + self.queue_seconds,
+            "completion_time": now + self.queue_seconds + self.task_seconds + files / self.files_per_second,
+            "cursor": None,
+        }
+        return {"task_id": task_id, "submission_id": data.get("submission_id"), "code": "Accepted"}
+
+    def submit_delete(self, data):
+        # Deletions leave the tree as it is; the task just takes its time.
+        self._call("submit_delete")
+        now = time.time()
+        task_id = str(uuid.uuid4())
+        files = len(data["DATA"])
+        self.tasks[task_id] = {
+            "type": "DELETE",
+            "label": data.get("label"),
+            "items": [],
+            "files": files,
+            "request_time": now,
+            "start_time": now + self.queue_seconds,
+            "completion_time": now + self.queue_seconds + self.task_seconds + files / self.files_per_second,
+            "cursor": None,
+        }
+        return {"task_id": task_id, "submission_id": data.get("submission_id"), "code": "Accepted"}
+
+    def get_task(self, task_id):
+        self._call("get_task")
+        task = self.tasks[task_id]
+        now = time.time()
+        doc = {
+            "task_id": task_id,
+            "label": task["label"],
+            "type": task.get("type", "TRANSFER"),
+            "request_time": _iso(task["request_time"]),
+            "files": task["files"],
+            "files_skipped": 0,
+            "faults": 0,
+            "is_paused": False,
+        }
+        if now < task["start_time"]:
+            doc.update(status="ACTIVE", nice_status="Queued", bytes_transferred=0, files_transferred=0)
+        elif now < task["completion_time"]:
+            done = int(task["files"] * (now - task["start_time"]) / (task["completion_time"] - task["start_time"]))
+            doc.update(status="ACTIVE", nice_status="OK", bytes_transferred=done * self.tree.file_size,
+                       files_transferred=done)
+        else:
+            active = task["completion_time"] - task["start_time"]
+            total = task["files"] * self.tree.file_size
+            doc.update(status="SUCCEEDED", nice_status=None, bytes_transferred=total,
+                       files_transferred=task["files"], completion_time=_iso(task["completion_time"]),
+                       effective_bytes_per_second=int(total / active) if active > 0 else 0)
+        return doc
+
+    def operation_ls(self, endpoint_id, path=None, *, limit=None, offset=None, **kwargs):
+        self._call("operation_ls")
+        digits, name = self._resolve(path)
+        if name is not None:
+            raise NotFound(path)
+        entries = self.tree.list_dir(digits)
+        offset = offset or 0
+        limit = min(limit or self.page_limit, self.page_limit)
+        return {"DATA_TYPE": "file_list", "path": path, "DATA": entries[offset:offset + limit],
+                "offset": offset, "limit": limit, "total": len(entries)}
+
+    def _successful(self, task):
+        for source_path, destination_path, digits, name in task["items"]:
+            if name is not None:
+                yield source_path, destination_path
+                continue
+            for rel_path in self.tree.iter_files(digits):
+                suffix = rel_path.split("/", len(digits))[-1]
+                yield posixpath.join(source_path, suffix), posixpath.join(destination_path, suffix)
+
+    def task_successful_transfers(self, task_id, *, marker=None, query_params=None):
+        self._call("task_successful_transfers")
+        task = self.tasks[task_id]
+        offset = int(marker or 0)
+        # Pages are asked for in order, so carry on from the previous page's
+        # position instead of regenerating the paths before it.
+        cursor = task["cursor"]
+        if cursor is None or cursor[0] != offset:
+            cursor = (offset, itertools.islice(self._successful(task), offset, None))
+        pairs = list(itertools.islice(cursor[1], self.transfers_page_size))
+        next_offset = offset + len(pairs)
+        task["cursor"] = (next_offset, cursor[1])
+        more = len(pairs) == self.transfers_page_size and next_offset < task["files"]
+        return {
+            "DATA_TYPE": "successful_transfers",
+            "DATA": [{"DATA_TYPE": "successful_transfer", "source_path": src, "destination_path": dst}
+                     for src, dst in pairs],
+            "marker": marker,
+            "next_marker": str(next_offset) if more else None,
+        }
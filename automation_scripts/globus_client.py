@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+# Shared Globus client bootstrap for the automation scripts.
+#
+# transfer.py, sync.py, transfer_to_archive.py and ls_test.py all need a
+# TransferClient authenticated with a native app refresh token. This module
+# does that once per process: the token file is read a single time, the
+# RefreshTokenAuthorizer and the TransferClient (and with it the pooled HTTP
+# session) are cached, and a daemon thread refreshes the access token ahead
+# of its expiry so long-running drivers never stall on a refresh mid-run.
+#
+# The first time a given token file is used it will open a web browser for
+# initial authentication, after which the token file is saved. Tokens can be
+# recinded by deleting the file or going to
+# https://app.globus.org/settings/consents, referencing the consent, and
+# then deleting it.
+#
+
+import os
+import threading
+import time
+import webbrowser
+
+import globus_sdk
+from globus_sdk import NativeAppAuthClient, RefreshTokenAuthorizer
+from globus_sdk.tokenstorage import SimpleJSONFileAdapter
+from globus_sdk.scopes import TransferScopes
+
+import api_scheduler
+import metrics
+import profiling
+
+TRANSFER_RESOURCE_SERVER = "transfer.api.globus.org"
+
+# Refresh the access token this many seconds before it expires.
+REFRESH_MARGIN_SECONDS = 600
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def _login(auth_client, file_adapter):
+    """Run the native app login flow and store the resulting tokens."""
+    # requested_scopes specifies a list of scopes to request
+    # instead of the defaults, only request access to the Transfer API
+    auth_client.oauth2_start_flow(requested_scopes=TransferScopes.all, refresh_tokens=True)
+    authorize_url = auth_client.oauth2_get_authorize_url()
+
+    print(f"Native App Authorizaion URL:\n{authorize_url}\n")
+
+    # If a web browser is available, we'll open a web page for the authorization
+    # request, otherwise the user must enter the URL in another web browser.
+    try:
+        webbrowser.open(authorize_url, new=1)
+    except Exception:
+        print(f"Please go to this URL and login:\n\n{authorize_url}\n")
+
+    auth_code = input("Please enter the code here: ").strip()
+    token_response = auth_client.oauth2_exchange_code_for_tokens(auth_code)
+
+    # Store tokens for later
+    file_adapter.store(token_response)
+
+    return token_response.by_resource_server[TRANSFER_RESOURCE_SERVER]
+
+
+def _load_tokens(auth_client, file_adapter):
+    if not file_adapter.file_exists():
+        return _login(auth_client, file_adapter)
+    # otherwise, we already did this whole song-and-dance, so just
+    # load the tokens from that file
+    return file_adapter.get_token_data(TRANSFER_RESOURCE_SERVER)
+
+
+class _TokenRefresher(threading.Thread):
+    """Daemon thread that renews an authorizer's token before it expires."""
+
+    def __init__(self, authorizer, margin=REFRESH_MARGIN_SECONDS):
+        super().__init__(name="globus-token-refresher", daemon=True)
+        self.authorizer = authorizer
+        self.margin = margin
+        self.refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def refresh_if_needed(self):
+        with self.refresh_lock:
+            expires_at = self.authorizer.expires_at or 0
+            if time.time() < expires_at - self.margin:
+                return
+            # Drop the current token so ensure_valid_token() fetches a new one
+            # and fires on_refresh, which writes it back to the token file.
+            self.authorizer.handle_missing_authorization()
+            self.authorizer.ensure_valid_token()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh_if_needed()
+            except globus_sdk.GlobusError as err:
+                # The request path will retry the refresh on its own; just
+                # try again shortly rather than killing the thread.
+                print(f"Background token refresh failed: {err}")
+                self._stop_event.wait(60)
+                continue
+            expires_at = self.authorizer.expires_at or 0
+            delay = max(expires_at - self.margin - time.time(), 30)
+            self._stop_event.wait(delay)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def get_authorizer(client_id, token_file, background_refresh=True):
+    """Return the cached RefreshTokenAuthorizer for this app and token file."""
+    return _get_entry(client_id, token_file, background_refresh)["authorizer"]
+
+
+def get_transfer_client(client_id, token_file, background_refresh=True):
+    """
+    Return a TransferClient for the native app ``client_id``, using the refresh
+    token stored in ``token_file``.
+
+    The client is built on first use and reused for the rest of the process, so
+    every caller shares the same authorizer and HTTP connection pool.
+    """
+    return _get_entry(client_id, token_file, background_refresh)["transfer_client"]
+
+
+def _get_entry(client_id, token_file, background_refresh):
+    token_file = os.path.abspath(os.path.expanduser(token_file))
+    key = (client_id, token_file)
+    with _lock:
+        entry = _clients.get(key)
+        if entry is None:
+            with profiling.phase("auth"):
+                entry = _build_entry(client_id, token_file, background_refresh)
+            _clients[key] = entry
+        return entry
+
+
+def _build_entry(client_id, token_file, background_refresh):
+    auth_client = NativeAppAuthClient(client_id)
+    file_adapter = SimpleJSONFileAdapter(token_file)
+    transfer_tokens = _load_tokens(auth_client, file_adapter)
+
+    authorizer = RefreshTokenAuthorizer(
+        transfer_tokens["refresh_token"],
+        auth_client,
+        access_token=transfer_tokens["access_token"],
+        expires_at=transfer_tokens["expires_at_seconds"],
+        on_refresh=file_adapter.on_refresh,
+    )
+    profiling.instrument_authorizer(authorizer)
+
+    refresher = None
+    if background_refresh:
+        refresher = _TokenRefresher(authorizer)
+        refresher.start()
+
+    return {
+        "authorizer": authorizer,
+        "transfer_client": api_scheduler.install(
+            profiling.instrument(globus_sdk.TransferClient(authorizer=authorizer))
+        ),
+        "refresher": refresher,
+    }
+
+
+def submit_transfer(client, transfer_data):
+    """
+    Submit ``transfer_data`` and return its task ID, or None if the submission
+    needs additional consents that have to be granted by logging in again.
+    """
+    try:
+        task_doc = metrics.submit(client, transfer_data)
+    except globus_sdk.TransferAPIError as err:
+        if not err.info.consent_required:
+            raise
+        print(
+            "Encountered a ConsentRequired error.\n"
+            "You must login a second time to grant consents.\n\n"
+        )
+        return None
+    task_id = task_doc["task_id"]
+    print(f"submitted transfer, task_id={task_id}")
+    return task_id
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+# Journal of submitted batches, so an interrupted run can pick up where it
+# stopped.
+#
+# A run (identified by a run key such as "sync:<collection>") records each
+# batch it plans, keyed by a fingerprint of the batch's contents, then the
+# task ID it was submitted as and the task's final status. If the process
+# dies (host reboot, failed token refresh), the next run with the same key
+# finds the journal still open: batches whose task succeeded are skipped,
+# batches whose task was submitted are reattached to by task ID instead of
+# being sent again, and only the rest are submitted. Once a run finishes
+# successfully its key starts afresh next time.
+#
+# The journal is SQLite in WAL mode, shared between the submitting threads.
+#
+
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_JOURNAL_FILE = "~/.cache/mri_globus/journal.sqlite"
+
+PLANNED = "PLANNED"
+SUBMITTED = "SUBMITTED"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+
+Batch = collections.namedtuple(
+    "Batch", ["fingerprint", "number", "item_count", "members", "task_id", "status"]
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_key TEXT PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL,
+    status TEXT
+);
+CREATE TABLE IF NOT EXISTS batches (
+    run_key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    item_count INTEGER NOT NULL,
+    members TEXT,
+    task_id TEXT,
+    status TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (run_key, fingerprint)
+);
+"""
+
+
+def fingerprint(paths):
+    """
+    A stable digest of a batch's source paths. A path may be given as a
+    (path, *version) tuple, e.g. with the file's size and mtime, so a batch
+    whose files changed since it was journaled is not mistaken for it.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        if not isinstance(path, str):
+            path, *version = path
+            for part in version:
+                digest.update(b"\1" + str(part).encode())
+        digest.update(path.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class Journal:
+    """SQLite journal of the batches of each run. Safe to share between threads."""
+
+    def __init__(self, db_path=DEFAULT_JOURNAL_FILE):
+        db_path = os.path.expanduser(db_path)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start_run(self, run_key):
+        """
+        Open ``run_key``, and return True if an unfinished run with that key
+        is being resumed, False if a new one was started.
+        """
+        with self._lock, self.db:
+            row = self.db.execute("SELECT finished FROM runs WHERE run_key = ?", (run_key,)).fetchone()
+            if row is not None and row[0] is None:
+                return True
+            self.db.execute("DELETE FROM batches WHERE run_key = ?", (run_key,))
+            self.db.execute(
+                "INSERT OR REPLACE INTO runs (run_key, started, finished, status) VALUES (?, ?, NULL, NULL)",
+                (run_key, time.time()),
+            )
+            return False
+
+    def run_started(self, run_key):
+        """When ``run_key`` was started (as a POSIX timestamp; resuming keeps it), or None."""
+        with self._lock:
+            row = self.db.execute("SELECT started FROM runs WHERE run_key = ?", (run_key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def finish_run(self, run_key, status=SUCCEEDED):
+        """
+        Close the run. Only a successful run is closed, so a failed one is
+        resumed (retrying just its failed batches) next time.
+        """
+        if status != SUCCEEDED:
+            return
+        with self._lock, self.db:
+            self.db.execute(
+                "UPDATE runs SET finished = ?, status = ? WHERE run_key = ?", (time.time(), status, run_key)
+            )
+
+    def batches(self, run_key):
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT fingerprint, number, item_count, members, task_id, status FROM batches "
+                "WHERE run_key = ? ORDER BY number",
+                (run_key,),
+            ).fetchall()
+        return [_batch(row) for row in rows]
+
+    def lookup(self, run_key, batch_fingerprint):
+        with self._lock:
+            row = self.db.execute(
+                "SELECT fingerprint, number, item_count, members, task_id, status FROM batches "
+                "WHERE run_key = ? AND fingerprint = ?",
+                (run_key, batch_fingerprint),
+            ).fetchone()
+        return _batch(row) if row is not None else None
+
+    def plan(self, run_key, batch_fingerprint, number, item_count, members=None):
+        self._write(
+            "INSERT OR REPLACE INTO batches "
+            "(run_key, fingerprint, number, item_count, members, task_id, status, updated) "
+            "VALUES (?, ?, ?, ?, ?, NULL, ?, ?)",
+            (run_key, batch_fingerprint, number, item_count,
+             json.dumps(members) if members is not None else None, PLANNED, time.time()),
+        )
+
+    def submitted(self, run_key, batch_fingerprint, task_id):
+        self._write(
+            "UPDATE batches SET task_id = ?, status = ?, updated = ? WHERE run_key = ? AND fingerprint = ?",
+            (task_id, SUBMITTED, time.time(), run_key, batch_fingerprint),
+        )
+
+    def finished(self, run_key, batch_fingerprint, status):
+        self._write(
+            "UPDATE batches SET status = ?, updated = ? WHERE run_key = ? AND fingerprint = ?",
+            (status, time.time(), run_key, batch_fingerprint),
+        )
+
+    def task_finished(self, run_key, task_id, status):
+        """Record the final status of whichever batch was submitted as ``task_id``."""
+        self._write(
+            "UPDATE batches SET status = ?, updated = ? WHERE run_key = ? AND task_id = ?",
+            (status, time.time(), run_key, task_id),
+        )
+
+    def _write(self, sql, params):
+        with self._lock, self.db:
+            self.db.execute(sql, params)
+
+
+def _batch(row):
+    batch_fingerprint, number, item_count, members, task_id, status = row
+    return Batch(batch_fingerprint, number, item_count,
+                 json.loads(members) if members is not None else None, task_id, status)
+
+
+def resume_or_submit(journal, run_key, batch_fingerprint, submit, number=0, item_count=0, members=None):
+    """
+    Return (task_id, done) for one batch. A batch that already succeeded in
+    this run gives (None, True); one already submitted gives its journaled
+    task ID to reattach to; otherwise ``submit()`` is called for a new task
+    ID, which may be None if the submission was refused.
+    """
+    batch = journal.lookup(run_key, batch_fingerprint)
+    if batch is not None:
+        if batch.status == SUCCEEDED:
+            return None, True
+        if batch.status == SUBMITTED and batch.task_id is not None:
+            print(f"Reattaching to task {batch.task_id} from the interrupted run")
+            return batch.task_id, False
+    journal.plan(run_key, batch_fingerprint, number, item_count, members)
+    task_id = submit()
+    if task_id is not None:
+        journal.submitted(run_key, batch_fingerprint, task_id)
+    return task_id, False
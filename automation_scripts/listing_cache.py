@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+# On-disk cache of Globus directory listings.
+#
+# Archived lab396 directories never change, yet every inventory or planning
+# run used to list them again through the Transfer API. This cache keeps
+# operation_ls results in SQLite keyed by (collection_id, path). Entries
+# expire after a TTL, the cache is capped at a number of directories with the
+# least recently used ones evicted first, and our own transfers invalidate the
+# paths they write to.
+#
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import recursive_ls
+
+DEFAULT_CACHE_FILE = "~/.cache/mri_globus/listings.sqlite"
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_ENTRIES = 200000
+
+# Check the LRU bound every this many puts rather than counting rows each time.
+TRIM_INTERVAL = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    collection_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    entries TEXT NOT NULL,
+    PRIMARY KEY (collection_id, path)
+);
+CREATE INDEX IF NOT EXISTS listings_accessed ON listings (accessed_at);
+"""
+
+
+def _normalize(path):
+    return path.rstrip("/") or "/"
+
+
+def _ancestors(path):
+    """A normalized ``path`` and each directory above it, up to "/" (or "." for a relative path)."""
+    while True:
+        yield path
+        if path == "/" or "/" not in path:
+            return
+        path = path.rsplit("/", 1)[0] or "/"
+
+
+class ListingCache:
+    """
+    SQLite-backed cache of directory listings. Safe to share between the
+    threads of a recursive_ls walk.
+    """
+
+    def __init__(self, db_path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        db_path = os.path.expanduser(db_path or DEFAULT_CACHE_FILE)
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.trim()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, collection_id, path):
+        """Return the cached entries for a directory, or None if absent or expired."""
+        path = _normalize(path)
+        now = time.time()
+        with self._lock:
+            row = self.db.execute(
+                "SELECT fetched_at, entries FROM listings WHERE collection_id = ? AND path = ?",
+                (collection_id, path),
+            ).fetchone()
+            if row is None or now - row[0] > self.ttl:
+                self.misses += 1
+                return None
+            with self.db:
+                self.db.execute(
+                    "UPDATE listings SET accessed_at = ? WHERE collection_id = ? AND path = ?",
+                    (now, collection_id, path),
+                )
+            self.hits += 1
+        return json.loads(row[1])
+
+    def put(self, collection_id, path, entries):
+        path = _normalize(path)
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)",
+                (collection_id, path, now, now, json.dumps(entries)),
+            )
+            self._puts += 1
+        if self._puts % TRIM_INTERVAL == 0:
+            self.trim()
+
+    def trim(self):
+        """Evict the least recently used listings beyond ``max_entries``."""
+        with self._lock, self.db:
+            count = self.db.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+            if count > self.max_entries:
+                self.db.execute(
+                    "DELETE FROM listings WHERE rowid IN "
+                    "(SELECT rowid FROM listings ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def invalidate(self, collection_id, path, recursive=True):
+        """
+        Drop the listing of ``path`` and of every directory above it (whose
+        listings may now lack a new subdirectory or show a changed entry),
+        and with ``recursive`` everything below it.
+        """
+        path = _normalize(path)
+        with self._lock, self.db:
+            self.db.executemany(
+                "DELETE FROM listings WHERE collection_id = ? AND path = ?",
+                ((collection_id, ancestor) for ancestor in _ancestors(path)),
+            )
+            if recursive:
+                prefix = "/" if path == "/" else path + "/"
+                self.db.execute(
+                    "DELETE FROM listings WHERE collection_id = ? AND substr(path, 1, ?) = ?",
+                    (collection_id, len(prefix), prefix),
+                )
+
+    def expire(self):
+        """Remove every entry older than the TTL."""
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM listings WHERE fetched_at < ?", (time.time() - self.ttl,))
+
+
+def cached_lister(transfer_client, collection_id, cache, page_size=recursive_ls.DEFAULT_PAGE_SIZE, **ls_kwargs):
+    """
+    Return a ``lister(path)`` for recursive_ls.walk that serves directories from
+    ``cache`` and only calls operation_ls for ones missing or expired.
+    """
+    def lister(path):
+        entries = cache.get(collection_id, path)
+        if entries is None:
+            entries = list(
+                recursive_ls.list_directory(transfer_client, collection_id, path, page_size, **ls_kwargs)
+            )
+            cache.put(collection_id, path, entries)
+        return entries
+
+    return lister
+
+
+def invalidate_paths(collection_id, paths, recursive=True, db_path=None):
+    """
+    Invalidate ``paths`` on ``collection_id`` in the cache at ``db_path``
+    (default DEFAULT_CACHE_FILE) after a transfer wrote to them. Does nothing
+    if no cache has been created.
+    """
+    db_path = db_path or DEFAULT_CACHE_FILE
+    if not os.path.exists(os.path.expanduser(db_path)):
+        return
+    with ListingCache(db_path) as cache:
+        for path in paths:
+            cache.invalidate(collection_id, path, recursive=recursive)
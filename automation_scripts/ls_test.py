@@ -2,15 +2,13 @@
 
 
 # This script will list the contents of a user-defined Globus Guest Collection,
-# using Globus and persistent authentication using a refresh token. 
+# using Globus and persistent authentication using a refresh token.
 #
 # This makes use of the Globus-hosted native app "My Data Flow Application".
-# 
+#
 # The first time this app is run, it will open a web browser for initial authentication,
-# after which a token file will be saved in the $CWD. Tokens can be 
-# recinded by deleting the file or going to 
-# https://app.globus.org/settings/consents, referencing the consent, and
-# then deleting it.
+# after which a token file will be saved in the $CWD. Authentication is handled by
+# globus_client.py; see there for how to recind the tokens.
 #
 # Written by J. Nucciarone with assistance from Globus support
 # April 29, 2024.
@@ -18,101 +16,83 @@
 #  Version 1.0
 #
 
+import argparse
+import sys
 
-import os
-
-import webbrowser
-
- 
-
-import globus_sdk
-from globus_sdk import GroupsClient, NativeAppAuthClient, RefreshTokenAuthorizer
-from globus_sdk.tokenstorage import SimpleJSONFileAdapter
-from globus_sdk.scopes import TransferScopes
+import globus_client
+import listing_cache
+import profiling
+import recursive_ls
 
- 
-
-Set source and destination endpoint UUID
+# Set source endpoint UUID
 # Source is the Guest Collection "nucci-share", which is the directory
-
 # /storage/group/RISE/nucci/globus-share
 
 source_collection_id = "606bef12-cf0b-4c90-9432-13039595d2b3"
 
- 
-
 # CLIENT_ID is the UUID of the registered app we will use for the authentication flow.
 # For this example, this is the app "My Data Flow Application", created in the earlier section.
 # This is part of the project "My Test Globus Project"
 
 CLIENT_ID = "c3554afe-be59-4196-a9a0-3f5abc29f021"
 
-
 # The refresh token will be saved in a file named "my-globus-refresh-token.json"
 # that will be written to the current directory.
 
-
-auth_client = NativeAppAuthClient(CLIENT_ID)
-my_file_adapter = SimpleJSONFileAdapter(
-    os.path.expanduser("./my-globus-refresh-token.json")
-)
-
-
-if not my_file_adapter.file_exists():
-    # requested_scopes specifies a list of scopes to request
-    # instead of the defaults, only request access to the Transfer API
-    auth_client.oauth2_start_flow(requested_scopes=TransferScopes.all, refresh_tokens=True)
-    authorize_url = auth_client.oauth2_get_authorize_url()
-
-    print(f"Native App Authorizaion URL:\n{authorize_url}\n")
-
-    # If a web browser is available, we'll open a web page for the authorization request, otherwise we 
-    # will request the user manually enter the URL in another web browser.
-
+TOKEN_FILE = "./my-globus-refresh-token.json"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="~/", help="directory to list")
+    parser.add_argument("--collection", default=source_collection_id)
+    parser.add_argument("--recursive", action="store_true",
+                        help="walk the whole tree below --path instead of listing one directory")
+    parser.add_argument("--format", choices=sorted(recursive_ls.WRITERS), default="jsonl",
+                        help="output format for --recursive")
+    parser.add_argument("--workers", type=int, default=recursive_ls.DEFAULT_WORKERS,
+                        help="concurrent operation_ls calls for --recursive")
+    parser.add_argument("--page-size", type=int, default=recursive_ls.DEFAULT_PAGE_SIZE)
+    parser.add_argument("--cache", action="store_true",
+                        help="serve --recursive listings from the on-disk listing cache")
+    parser.add_argument("--cache-file", default=listing_cache.DEFAULT_CACHE_FILE)
+    parser.add_argument("--cache-ttl", type=float, default=listing_cache.DEFAULT_TTL / 3600,
+                        help="hours before a cached listing is fetched again")
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiling.configure(args.profile, args.profile_cprofile, args.profile_sample)
+
+    # A one-shot listing gains nothing from the background refresher.
+    transfer_client = globus_client.get_transfer_client(CLIENT_ID, TOKEN_FILE, background_refresh=False)
+
+    if args.recursive:
+        cache = None
+        lister = None
+        if args.cache:
+            cache = listing_cache.ListingCache(args.cache_file, ttl=args.cache_ttl * 3600)
+            lister = listing_cache.cached_lister(transfer_client, args.collection, cache, args.page_size)
+        rows = recursive_ls.walk(
+            transfer_client, args.collection, args.path,
+            workers=args.workers, page_size=args.page_size, lister=lister,
+        )
+        recursive_ls.WRITERS[args.format](rows, sys.stdout)
+        if cache is not None:
+            print(f"Listing cache: {cache.hits} hits, {cache.misses} misses", file=sys.stderr)
+            cache.close()
+        return
+
+    # Print out a directory listing. Refer to the Globus CLI documentation for details on the operation_ls command
 
     try:
-        webbrowser.open(authorize_url, new=1)
-    except:
-        print(f"Please go to this URL and login:\n\n{authorize_url}\n")
-
-
-    auth_code = input("Please enter the code here: ").strip()
-    token_response = auth_client.oauth2_exchange_code_for_tokens(auth_code)
-
-    # Store tokens for later
-
-    my_file_adapter.store(token_response)
-
-    # Use the current transfer tokens
-
-    transfer_tokens = token_response.by_resource_server["transfer.api.globus.org"]
-else:
-    # otherwise, we already did this whole song-and-dance, so just
-    # load the tokens from that file
-    transfer_tokens = my_file_adapter.get_token_data("transfer.api.globus.org")
-
-
-authorizer = globus_sdk.RefreshTokenAuthorizer(
-    transfer_tokens["refresh_token"],
-    auth_client,
-    access_token=transfer_tokens["access_token"],
-    expires_at=transfer_tokens["expires_at_seconds"],
-    on_refresh=my_file_adapter.on_refresh,
-)
-
-
-# construct an AccessTokenAuthorizer and use it to construct the
-# TransferClient operation
-
-
-transfer_client = globus_sdk.TransferClient(authorizer=authorizer)
-
-
-# Print out a directory listing. Refer to the Globus CLI documentation for details on the operation_ls command
+        for entry in transfer_client.operation_ls(args.collection, path=args.path, orderby=["type", "name"]):
+            print(entry["type"], "\t", entry["name"], entry["size"], entry["permissions"], entry["user"], entry["group"], entry["last_modified"])
+    except Exception:
+        print("Error encountered\n")
 
 
-try:
-    for entry in transfer_client.operation_ls(source_collection_id,path="~/", orderby=["type", "name"]):
-        print(entry["type"], "\t", entry["name"], entry["size"], entry["permissions"], entry["user"], entry["group"], entry["last_modified"])
-except:
-    print("Error encountered\n")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+# Timings and outcomes of the transfer tasks the scripts run.
+#
+# Every submission made through submit() and every task waited on by
+# task_waiter.TaskWaiter is recorded here: how long the submission took,
+# how long the task sat queued, how long it was active, and the byte, file,
+# skip and fault counts and effective rate from its final task document.
+# When a task finishes one JSON line is appended to the --metrics-log file,
+# and at exit the --metrics-prom file is rewritten in the Prometheus text
+# format for node_exporter's textfile collector, so throughput between
+# converge.mri.psu.edu and RC storage can be graphed across runs.
+#
+
+import atexit
+import collections
+import datetime
+import json
+import os
+import threading
+import time
+
+import profiling
+
+METRIC_PREFIX = "mri_globus_task"
+
+TaskMetrics = collections.namedtuple(
+    "TaskMetrics",
+    ["task_id", "label", "script", "status", "submit_latency", "queue_time", "active_time",
+     "bytes_transferred", "files", "files_skipped", "faults", "mb_per_s"],
+)
+
+# TaskMetrics fields exported as Prometheus gauges, with their help text.
+GAUGES = {
+    "submit_latency": "Seconds taken by the submit_transfer call",
+    "queue_time": "Seconds between the request and the task first running",
+    "active_time": "Seconds the task spent running",
+    "bytes_transferred": "Bytes transferred by the task",
+    "files": "Files in the task",
+    "files_skipped": "Files skipped because they were already up to date",
+    "faults": "Faults the task recovered from",
+    "mb_per_s": "Effective transfer rate in MB/s",
+}
+
+
+def _timestamp(value):
+    if not value:
+        return None
+    try:
+        when = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return when.timestamp()
+
+
+def _is_running(task):
+    # Queued tasks are ACTIVE with a nice_status of "Queued".
+    return task["status"] == "ACTIVE" and (
+        task.get("nice_status") not in (None, "Queued") or task.get("bytes_transferred", 0) > 0
+    )
+
+
+def task_metrics(task, submit_latency=None, started=None, script=None):
+    """
+    Build TaskMetrics from a finished task document. ``started`` is when the
+    task was first seen running, if it was; without it the whole time from
+    request to completion counts as active.
+    """
+    requested = _timestamp(task.get("request_time"))
+    completed = _timestamp(task.get("completion_time"))
+    queue_time = None
+    active_time = None
+    if requested is not None and started is not None:
+        queue_time = max(started - requested, 0.0)
+    if completed is not None:
+        begin = started if started is not None else requested
+        if begin is not None:
+            active_time = max(completed - begin, 0.0)
+
+    bytes_transferred = task.get("bytes_transferred", 0)
+    rate = task.get("effective_bytes_per_second")
+    if rate is not None:
+        mb_per_s = rate / 1e6
+    elif active_time:
+        mb_per_s = bytes_transferred / active_time / 1e6
+    else:
+        mb_per_s = None
+
+    return TaskMetrics(
+        task_id=task["task_id"],
+        label=task.get("label"),
+        script=script,
+        status=task["status"],
+        submit_latency=submit_latency,
+        queue_time=queue_time,
+        active_time=active_time,
+        bytes_transferred=bytes_transferred,
+        files=task.get("files", 0),
+        files_skipped=task.get("files_skipped", 0),
+        faults=task.get("faults", 0),
+        mb_per_s=mb_per_s,
+    )
+
+
+class Recorder:
+    """Collects TaskMetrics for the tasks of one process."""
+
+    def __init__(self, log_file=None, prometheus_file=None, script=None):
+        self.log_file = log_file
+        self.prometheus_file = prometheus_file
+        self.script = script
+        self.tasks = {}
+        self._submit_latency = {}
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def submitted(self, task_id, latency):
+        with self._lock:
+            self._submit_latency[task_id] = latency
+
+    def observe(self, task_id, task, now):
+        """Note a polled task document; ``now`` is when it was fetched."""
+        if task_id in self._started or not _is_running(task):
+            return
+        with self._lock:
+            self._started.setdefault(task_id, now)
+
+    def finished(self, task_id, task):
+        """Record a task that reached a final state, once, and log it."""
+        with self._lock:
+            if task_id in self.tasks:
+                return self.tasks[task_id]
+            record = task_metrics(
+                task, self._submit_latency.get(task_id), self._started.get(task_id), self.script
+            )
+            self.tasks[task_id] = record
+        if self.log_file:
+            line = dict(record._asdict(), time=time.time())
+            with self._lock, open(self.log_file, "a") as f:
+                f.write(json.dumps(line) + "\n")
+        return record
+
+    def write_prometheus(self, path=None):
+        """Write every recorded task as Prometheus gauges to ``path``."""
+        path = path or self.prometheus_file
+        if not path:
+            return
+        with self._lock:
+            records = list(self.tasks.values())
+        lines = []
+        for field, help_text in GAUGES.items():
+            name = f"{METRIC_PREFIX}_{field}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for record in records:
+                value = getattr(record, field)
+                if value is None:
+                    continue
+                labels = ",".join(
+                    f'{key}="{_escape(getattr(record, key))}"'
+                    for key in ("script", "task_id", "label", "status")
+                    if getattr(record, key) is not None
+                )
+                lines.append(f"{name}{{{labels}}} {value}")
+        # Write then rename, so the collector never reads a half-written file.
+        tmp_path = path + ".partial"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+recorder = Recorder()
+
+
+def configure(log_file=None, prometheus_file=None, script=None):
+    """Set where the process-wide recorder writes; the Prometheus file is written at exit."""
+    recorder.log_file = log_file
+    recorder.prometheus_file = prometheus_file
+    recorder.script = script
+    if prometheus_file:
+        atexit.register(recorder.write_prometheus)
+
+
+def add_arguments(parser):
+    parser.add_argument("--metrics-log", metavar="FILE",
+                        help="append a JSON line of timings and counts for each finished task")
+    parser.add_argument("--metrics-prom", metavar="FILE",
+                        help="write task metrics in Prometheus text format at exit")
+
+
+def submit(transfer_client, transfer_data):
+    """
+    submit_transfer, or submit_delete for a DeleteData, recording how long the
+    call took. Returns the response.
+    """
+    started = time.monotonic()
+    with profiling.phase("submit"):
+        if transfer_data["DATA_TYPE"] == "delete":
+            response = transfer_client.submit_delete(transfer_data)
+        else:
+            response = transfer_client.submit_transfer(transfer_data)
+    recorder.submitted(response["task_id"], time.monotonic() - started)
+    return response
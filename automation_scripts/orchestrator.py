@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Run many Globus transfers at once.
+#
+# A nightly run covers several labs or CQI DATA_LOCATIONs. Rather than submit
+# one transfer and block on it before starting the next, the orchestrator
+# keeps up to N tasks in flight from a thread pool, resubmits jobs whose task
+# fails, and prints one throughput summary for the whole run.
+#
+
+import collections
+import concurrent.futures
+import datetime
+import time
+
+import globus_sdk
+
+import metrics
+import task_waiter
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RETRIES = 2
+
+# A single source -> destination copy. options are passed through to
+# globus_sdk.TransferData (sync_level, verify_checksum, ...), and
+# filter_rules is a list of add_filter_rule keyword dicts.
+TransferJob = collections.namedtuple(
+    "TransferJob",
+    ["source_endpoint", "destination_endpoint", "source_path",
+     "destination_path", "label", "options", "filter_rules"],
+    defaults=(None, None, None, ()),
+)
+
+JobResult = collections.namedtuple("JobResult", ["job", "task_id", "task", "attempts", "error"])
+
+
+def build_transfer_data(transfer_client, job):
+    """Build the TransferData document for one job."""
+    transfer_data = globus_sdk.TransferData(
+        transfer_client,
+        job.source_endpoint,
+        job.destination_endpoint,
+        label=job.label,
+        **(job.options or {}),
+    )
+    destination_path = job.destination_path if job.destination_path is not None else job.source_path
+    transfer_data.add_item(job.source_path, destination_path)
+    for rule in job.filter_rules:
+        transfer_data.add_filter_rule(**rule)
+    return transfer_data
+
+
+def _is_retryable(err):
+    if isinstance(err, globus_sdk.NetworkError):
+        return True
+    return isinstance(err, globus_sdk.GlobusAPIError) and (err.http_status == 429 or err.http_status >= 500)
+
+
+def _deadline_passed(job):
+    """True if ``job`` has a Globus deadline and it has passed, so a retry would be refused or cut short."""
+    deadline = (job.options or {}).get("deadline")
+    if deadline is None:
+        return False
+    if isinstance(deadline, str):
+        deadline = datetime.datetime.fromisoformat(deadline)
+    now = datetime.datetime.now(deadline.tzinfo) if deadline.tzinfo is not None else datetime.datetime.now()
+    return now >= deadline
+
+
+class Orchestrator:
+    """
+    Submit and track a list of TransferJobs with at most ``concurrency`` tasks
+    in flight. A job is resubmitted up to ``retries`` times if its task fails
+    or its submission hits a retryable API error, unless its deadline has
+    passed.
+    """
+
+    def __init__(self, transfer_client, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES,
+                 waiter_factory=task_waiter.TaskWaiter):
+        self.transfer_client = transfer_client
+        self.concurrency = concurrency
+        self.retries = retries
+        self.waiter_factory = waiter_factory
+
+    def run_job(self, job):
+        task_id = None
+        task = None
+        error = None
+        transfer_data = None
+        for attempt in range(1, self.retries + 2):
+            try:
+                # Kept across retries after an API error, so its submission_id
+                # makes Globus return the original task if the submit had in
+                # fact gone through.
+                if transfer_data is None:
+                    transfer_data = build_transfer_data(self.transfer_client, job)
+                task_id = metrics.submit(self.transfer_client, transfer_data)["task_id"]
+                print(f"Submitted {job.source_path} as task {task_id} (attempt {attempt})")
+                waiter = self.waiter_factory(self.transfer_client)
+                task = waiter.wait([task_id])[task_id]
+                error = None
+            except globus_sdk.GlobusError as err:
+                if not _is_retryable(err):
+                    return JobResult(job, task_id, task, attempt, err)
+                error = err
+                if attempt <= self.retries:
+                    if _deadline_passed(job):
+                        print(f"Not retrying {job.source_path}: its deadline has passed")
+                        break
+                    time.sleep(min(2 ** attempt, 60))
+                continue
+            if task["status"] == "SUCCEEDED":
+                break
+            print(f"Task {task_id} for {job.source_path} ended {task['status']}")
+            # The task itself failed: the retry is a new task with a new submission_id.
+            transfer_data = None
+            if attempt <= self.retries and _deadline_passed(job):
+                print(f"Not retrying {job.source_path}: its deadline has passed")
+                break
+        return JobResult(job, task_id, task, attempt, error)
+
+    def run(self, jobs):
+        """Run every job and return their JobResults in the order given."""
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(self.run_job, jobs))
+        print_summary(results, time.time() - start)
+        return results
+
+
+def print_summary(results, elapsed):
+    """Print one aggregate line of task outcomes and throughput."""
+    succeeded = sum(1 for r in results if r.task is not None and r.task["status"] == "SUCCEEDED")
+    total_bytes = sum(r.task.get("bytes_transferred", 0) for r in results if r.task is not None)
+    total_files = sum(r.task.get("files_transferred", 0) for r in results if r.task is not None)
+    rate = total_bytes / elapsed / 1e6 if elapsed > 0 else 0.0
+    print(
+        f"{succeeded}/{len(results)} transfers succeeded: "
+        f"{total_files} files, {total_bytes / 1e9:.2f} GB in {elapsed:.0f} s ({rate:.1f} MB/s)"
+    )
+    for r in results:
+        if r.error is not None:
+            print(f"  {r.job.source_path}: {r.error}")
+        elif r.task is None or r.task["status"] != "SUCCEEDED":
+            print(f"  {r.job.source_path}: task {r.task_id} did not succeed")
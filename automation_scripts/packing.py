@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+# Pack small MRI files into archive bundles before transfer.
+#
+# An MRI session is tens of thousands of small DICOM slices, and Globus
+# per-file overhead dominates on files that small. This stage groups the
+# files of each series (each directory holding files) into zip or tar
+# bundles of up to a target size, packs the bundles in a process pool, and
+# writes a MANIFESTS/<bundle>.txt for each listing its members with their
+# size and sha256. A file larger than the target size ends up alone in its
+# own bundle.
+#
+# The bundles and manifests are written in the layout transfer_to_archive.py
+# expects: OUTPUT_DIR/*.zip and OUTPUT_DIR/MANIFESTS/*.txt.
+#
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import os
+import tarfile
+import zipfile
+
+DEFAULT_TARGET_SIZE = 4 * 1024 ** 3
+DEFAULT_FORMAT = "zip"
+COPY_BLOCK_SIZE = 1024 * 1024
+
+MANIFEST_DIR = "MANIFESTS"
+
+# One bundle to write: name is the archive file name, members are
+# (relative_path, size) pairs.
+Bundle = collections.namedtuple("Bundle", ["name", "members"])
+
+PackResult = collections.namedtuple("PackResult", ["bundle_path", "manifest_path", "members", "bytes"])
+
+
+def _walk_series(source_dir):
+    """Yield (relative_dir, [(relative_path, size), ...]) for every directory holding files."""
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        files = []
+        with os.scandir(os.path.join(source_dir, rel_dir)) as it:
+            for entry in it:
+                rel_path = os.path.join(rel_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(rel_path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append((rel_path, entry.stat(follow_symlinks=False).st_size))
+        if files:
+            files.sort()
+            yield rel_dir, files
+
+
+def _bundle_name(rel_dir, part, fmt):
+    base = rel_dir.replace(os.sep, "__") or "top"
+    return f"{base}.part{part:03d}.{fmt}"
+
+
+def plan_bundles(source_dir, target_size=DEFAULT_TARGET_SIZE, fmt=DEFAULT_FORMAT):
+    """Group the files under ``source_dir`` into bundles, one series at a time."""
+    bundles = []
+    for rel_dir, files in _walk_series(source_dir):
+        part = 1
+        members = []
+        total = 0
+        for rel_path, size in files:
+            if members and total + size > target_size:
+                bundles.append(Bundle(_bundle_name(rel_dir, part, fmt), members))
+                part += 1
+                members = []
+                total = 0
+            members.append((rel_path, size))
+            total += size
+        if members:
+            bundles.append(Bundle(_bundle_name(rel_dir, part, fmt), members))
+    return bundles
+
+
+class _HashingReader:
+    """File wrapper that hashes everything read through it."""
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        block = self.f.read(size)
+        self.digest.update(block)
+        return block
+
+
+def pack_bundle(source_dir, output_dir, bundle):
+    """
+    Write one bundle and its manifest. Each member is read once, hashing it
+    while it is copied into the archive.
+    """
+    bundle_path = os.path.join(output_dir, bundle.name)
+    manifest_path = os.path.join(output_dir, MANIFEST_DIR, bundle.name + ".txt")
+    tmp_path = bundle_path + ".partial"
+    lines = []
+    total = 0
+
+    if bundle.name.endswith(".zip"):
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for rel_path, size in bundle.members:
+                info = zipfile.ZipInfo.from_file(os.path.join(source_dir, rel_path), rel_path)
+                with open(os.path.join(source_dir, rel_path), "rb") as f, \
+                        archive.open(info, "w", force_zip64=size > 2 ** 31) as dst:
+                    src = _HashingReader(f)
+                    for block in iter(lambda: src.read(COPY_BLOCK_SIZE), b""):
+                        dst.write(block)
+                lines.append(f"{src.digest.hexdigest()}  {size}  {rel_path}\n")
+                total += size
+    else:
+        with tarfile.open(tmp_path, "w") as archive:
+            for rel_path, size in bundle.members:
+                full_path = os.path.join(source_dir, rel_path)
+                with open(full_path, "rb") as f:
+                    src = _HashingReader(f)
+                    archive.addfile(archive.gettarinfo(full_path, rel_path), src)
+                lines.append(f"{src.digest.hexdigest()}  {size}  {rel_path}\n")
+                total += size
+
+    with open(manifest_path, "w") as manifest:
+        manifest.writelines(lines)
+    os.replace(tmp_path, bundle_path)
+    return PackResult(bundle_path, manifest_path, len(lines), total)
+
+
+def pack_directory(source_dir, output_dir, target_size=DEFAULT_TARGET_SIZE, fmt=DEFAULT_FORMAT, workers=None):
+    """
+    Pack ``source_dir`` into bundles under ``output_dir`` using a process pool
+    of ``workers`` (default: one per CPU), and return a PackResult per bundle.
+    """
+    os.makedirs(os.path.join(output_dir, MANIFEST_DIR), exist_ok=True)
+    bundles = plan_bundles(source_dir, target_size, fmt)
+    print(f"Packing {sum(len(b.members) for b in bundles)} files into {len(bundles)} bundles")
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(pack_bundle, source_dir, output_dir, bundle) for bundle in bundles]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            print(f"Wrote {result.bundle_path} ({result.members} files, {result.bytes / 1e6:.1f} MB)")
+            results.append(result)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("SOURCE_DIR", help="session directory to pack")
+    parser.add_argument("OUTPUT_DIR", help="directory to write bundles and MANIFESTS to")
+    parser.add_argument("--target-size", type=float, default=DEFAULT_TARGET_SIZE / 1024 ** 3,
+                        help="target bundle size in GiB")
+    parser.add_argument("--format", choices=["zip", "tar"], default=DEFAULT_FORMAT)
+    parser.add_argument("--workers", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = pack_directory(
+        args.SOURCE_DIR,
+        args.OUTPUT_DIR,
+        target_size=int(args.target_size * 1024 ** 3),
+        fmt=args.format,
+        workers=args.workers,
+    )
+    print(f"{len(results)} bundles written to {args.OUTPUT_DIR}")
+
+
+if __name__ == "__main__":
+    main()
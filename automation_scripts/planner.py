@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+
+# Size a transfer before it is submitted.
+#
+# Walks the same source paths, under the same filter rules, that sync.py,
+# transfer_to_archive.py or a routes.toml route would submit, and reports
+# the exact file count, byte total and a size histogram without submitting
+# anything. The tree is read either locally with os.scandir or from the
+# listing cache (see listing_cache.py), listing any directories missing from
+# it through the API only with --list-missing.
+#
+# Directories are walked by a pool of threads, each keeping only counters;
+# no per-file objects outlive the directory being read, so multi-million
+# file trees cost a few MB. Filter rules are applied as Globus applies them:
+# the first rule whose type and name pattern match an entry decides, entries
+# no rule matches are included, and excluded directories are not descended.
+#
+# Example:
+#   planner.py archive University_Park 20241018
+#   planner.py sync --json plan.json
+#   planner.py local /storage/long/lab396 --rule exclude:file:*.tmp
+#   planner.py listing 095bd11b-e263-44dc-ad19-6dd4b463207e /lab396
+#
+
+import argparse
+import fnmatch
+import json
+import math
+import os
+import posixpath
+import queue
+import re
+import sys
+import threading
+
+import batching
+import listing_cache
+import profiling
+
+DEFAULT_WORKERS = 16
+DEFAULT_RATE_MB_S = 100.0
+
+# Histogram buckets are powers of two from 1 KiB; the last one is open-ended.
+HISTOGRAM_MIN_BITS = 10
+HISTOGRAM_BUCKETS = 28
+
+
+def _bucket_label(index):
+    def size(bits):
+        for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+            if bits < 10:
+                return f"{1 << bits} {unit}"
+            bits -= 10
+        return f"{1 << bits} PiB"
+
+    if index == 0:
+        return f"< {size(HISTOGRAM_MIN_BITS)}"
+    if index == HISTOGRAM_BUCKETS - 1:
+        return f">= {size(HISTOGRAM_MIN_BITS + index - 1)}"
+    return f"{size(HISTOGRAM_MIN_BITS + index - 1)} - {size(HISTOGRAM_MIN_BITS + index)}"
+
+
+class Totals:
+    """Counters for one walk, or one worker's share of it."""
+
+    __slots__ = ("files", "bytes", "dirs", "excluded_files", "excluded_bytes", "excluded_dirs",
+                 "unlisted_dirs", "errors", "largest", "histogram")
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.dirs = 0
+        self.excluded_files = 0
+        self.excluded_bytes = 0
+        self.excluded_dirs = 0
+        self.unlisted_dirs = 0
+        self.errors = 0
+        self.largest = 0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, size):
+        self.files += 1
+        self.bytes += size
+        if size > self.largest:
+            self.largest = size
+        self.histogram[min(max(size.bit_length() - HISTOGRAM_MIN_BITS, 0), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def merge(self, other):
+        for name in self.__slots__:
+            if name == "histogram":
+                self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+            elif name == "largest":
+                self.largest = max(self.largest, other.largest)
+            else:
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+    @property
+    def complete(self):
+        """False if some directories could not be read or were missing from the listing cache."""
+        return not self.unlisted_dirs and not self.errors
+
+    def as_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__ if name != "histogram"}
+        data["histogram"] = {_bucket_label(i): count for i, count in enumerate(self.histogram) if count}
+        data["batches"] = math.ceil(self.files / batching.DEFAULT_MAX_ITEMS)
+        return data
+
+
+def compile_rules(rules):
+    """
+    Turn add_filter_rule keyword dicts into (is_dir, match, include) tuples.
+    is_dir is None for a rule without a type, which Globus applies to files
+    and directories alike.
+    """
+    return [
+        ({"dir": True, "file": False}.get(rule.get("type")), re.compile(fnmatch.translate(rule["name"])).match,
+         rule.get("method", "exclude") == "include")
+        for rule in rules
+    ]
+
+
+def included(compiled_rules, name, is_dir):
+    for rule_is_dir, match, include in compiled_rules:
+        if (rule_is_dir is None or rule_is_dir == is_dir) and match(name):
+            return include
+    return True
+
+
+def walk(top, list_dir, rules=(), workers=DEFAULT_WORKERS):
+    """
+    Walk the directory ``top`` and return its Totals. ``list_dir(path)``
+    returns an iterable of (name, is_dir, size) for a directory, or None if
+    its contents are unknown; an exception it raises is counted as an error
+    for that directory.
+    """
+    compiled = compile_rules(rules)
+    pending = queue.Queue()
+    pending.put(top)
+    shares = [Totals() for _ in range(workers)]
+
+    def work(totals):
+        while True:
+            path = pending.get()
+            if path is None:
+                return
+            try:
+                entries = list_dir(path)
+                if entries is None:
+                    totals.unlisted_dirs += 1
+                    continue
+                totals.dirs += 1
+                for name, is_dir, size in entries:
+                    if not included(compiled, name, is_dir):
+                        if is_dir:
+                            totals.excluded_dirs += 1
+                        else:
+                            totals.excluded_files += 1
+                            totals.excluded_bytes += size
+                    elif is_dir:
+                        pending.put(posixpath.join(path, name))
+                    else:
+                        totals.add(size)
+            except Exception as err:
+                # Anything list_dir raises (an unreadable directory, a network
+                # error from the API) costs that directory, not the walk.
+                totals.errors += 1
+                print(f"Skipping unreadable directory {path}: {err!r}", file=sys.stderr)
+            finally:
+                pending.task_done()
+
+    threads = [threading.Thread(target=work, args=(share,), daemon=True) for share in shares]
+    for thread in threads:
+        thread.start()
+    pending.join()
+    for _ in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+
+    totals = Totals()
+    for share in shares:
+        totals.merge(share)
+    return totals
+
+
+def scandir_entries(path):
+    """list_dir for a local directory; symlinks and special files are left out, as Globus does."""
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield entry.name, True, 0
+            elif entry.is_file(follow_symlinks=False):
+                try:
+                    yield entry.name, False, entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+
+
+def plan_local(paths, rules=(), workers=DEFAULT_WORKERS):
+    """Totals for local ``paths``, each a directory sent recursively or a single file."""
+    totals = Totals()
+    for path in paths:
+        if os.path.isdir(path):
+            totals.merge(walk(path, scandir_entries, rules, workers))
+        elif os.path.isfile(path):
+            totals.add(os.path.getsize(path))
+        else:
+            totals.errors += 1
+            print(f"No such file or directory: {path}", file=sys.stderr)
+    return totals
+
+
+def listing_entries(lister):
+    """list_dir over ``lister(path)``, which returns operation_ls entries or None."""
+    def list_dir(path):
+        entries = lister(path)
+        if entries is None:
+            return None
+        return ((entry["name"], entry["type"] == "dir", entry.get("size", 0)) for entry in entries)
+    return list_dir
+
+
+def plan_listing(lister, paths, rules=(), workers=DEFAULT_WORKERS):
+    """Totals for collection ``paths`` from ``lister(path)``, which returns operation_ls entries or None."""
+    totals = Totals()
+    list_dir = listing_entries(lister)
+    for path in paths:
+        path = path.rstrip("/") or "/"
+        if lister(path) is not None:
+            totals.merge(walk(path, list_dir, rules, workers))
+            continue
+        # Not a listed directory: a single file, if its parent lists it.
+        parent, name = posixpath.split(path)
+        for entry_name, is_dir, size in list_dir(parent) or ():
+            if entry_name == name and not is_dir:
+                totals.add(size)
+                break
+        else:
+            totals.unlisted_dirs += 1
+    return totals
+
+
+def cache_lister(cache, collection_id, transfer_client=None):
+    """
+    A lister reading ``cache``, or with a ``transfer_client`` listing what is
+    not cached through the API and caching it.
+    """
+    if transfer_client is None:
+        return lambda path: cache.get(collection_id, path)
+    import globus_sdk
+
+    fetch = listing_cache.cached_lister(transfer_client, collection_id, cache)
+
+    def lister(path):
+        try:
+            return fetch(path)
+        except globus_sdk.GlobusAPIError:
+            return None
+    return lister
+
+
+def report(totals, rate_mb_s=DEFAULT_RATE_MB_S, out=sys.stdout):
+    print(f"{totals.files} files, {totals.bytes / 1e9:.2f} GB in {totals.dirs} directories", file=out)
+    if totals.excluded_files or totals.excluded_dirs:
+        print(f"Excluded by filter rules: {totals.excluded_files} files ({totals.excluded_bytes / 1e9:.2f} GB), "
+              f"{totals.excluded_dirs} directories", file=out)
+    print(f"Largest file {totals.largest / 1e6:.1f} MB; "
+          f"{math.ceil(totals.files / batching.DEFAULT_MAX_ITEMS)} batches of up to {batching.DEFAULT_MAX_ITEMS} "
+          f"files; about {totals.bytes / (rate_mb_s * 1e6) / 3600:.1f} h at {rate_mb_s:g} MB/s", file=out)
+    if totals.files:
+        width = max(totals.histogram)
+        for index, count in enumerate(totals.histogram):
+            if count:
+                bar = "#" * max(round(40 * count / width), 1)
+                print(f"  {_bucket_label(index):>22} {count:>10} {bar}", file=out)
+    if not totals.complete:
+        print(f"INCOMPLETE: {totals.unlisted_dirs} directories not in the listing cache, "
+              f"{totals.errors} missing or unreadable", file=out)
+
+
+def parse_rule(value):
+    try:
+        method, rule_type, name = value.split(":", 2)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected METHOD:TYPE:NAME, got {value!r}") from None
+    if method not in ("include", "exclude") or rule_type not in ("file", "dir", "any"):
+        raise argparse.ArgumentTypeError(f"expected include|exclude:file|dir|any:NAME, got {value!r}")
+    if rule_type == "any":
+        # A typeless rule, applied to files and directories alike.
+        return {"name": name, "method": method}
+    return {"name": name, "method": method, "type": rule_type}
+
+
+def parse_args(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="directories read at once")
+    common.add_argument("--rate", type=float, default=DEFAULT_RATE_MB_S,
+                        help="MB/s used for the duration estimate")
+    common.add_argument("--json", metavar="FILE", help="also write the totals as JSON")
+    profiling.add_arguments(common)
+    with_rules = argparse.ArgumentParser(add_help=False, parents=[common])
+    with_rules.add_argument("--rule", type=parse_rule, action="append", default=[], dest="rules",
+                            metavar="METHOD:TYPE:NAME", help="filter rule, e.g. exclude:dir:MANIFESTS; in order")
+
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("local", parents=[with_rules], help="walk local paths with os.scandir")
+    p.add_argument("paths", nargs="+")
+
+    p = sub.add_parser("listing", parents=[with_rules], help="walk collection paths from the listing cache")
+    p.add_argument("collection")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--listing-cache", default=listing_cache.DEFAULT_CACHE_FILE)
+    p.add_argument("--list-missing", action="store_true",
+                   help="list directories missing from the cache through the API")
+    p.add_argument("--client-id", help="needed with --list-missing")
+    p.add_argument("--token-file", help="needed with --list-missing")
+
+    p = sub.add_parser("sync", parents=[common], help="what sync.py --full would send, from its local root")
+    p.add_argument("--local-root", help="default sync.py's LOCAL_ROOT")
+
+    p = sub.add_parser("archive", parents=[common],
+                       help="what transfer_to_archive.py would send for a location and date")
+    p.add_argument("DATA_LOCATION")
+    p.add_argument("TODAY")
+    p.add_argument("--scratch-root", help="default transfer_to_archive.py's SCRATCH_ROOT")
+
+    args = parser.parse_args(argv)
+    if args.command == "listing" and args.list_missing and not (args.client_id and args.token_file):
+        parser.error("--list-missing needs --client-id and --token-file")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiling.configure(args.profile, args.profile_cprofile, args.profile_sample)
+
+    if args.command == "local":
+        totals = plan_local(args.paths, args.rules, args.workers)
+    elif args.command == "sync":
+        import sync
+
+        totals = plan_local([args.local_root or sync.LOCAL_ROOT], (), args.workers)
+    elif args.command == "archive":
+        import transfer_to_archive
+
+        local_dir = os.path.join(args.scratch_root or transfer_to_archive.SCRATCH_ROOT, args.DATA_LOCATION, args.TODAY)
+        # MANIFESTS is excluded from the day's directory but sent as its own item.
+        manifests = os.path.join(local_dir, "MANIFESTS")
+        totals = plan_local(
+            [local_dir] + ([manifests] if os.path.isdir(manifests) else []),
+            transfer_to_archive.archive_filter_rules(args.TODAY),
+            args.workers,
+        )
+    else:
+        transfer_client = None
+        if args.list_missing:
+            import globus_client
+
+            transfer_client = globus_client.get_transfer_client(args.client_id, args.token_file)
+        with listing_cache.ListingCache(args.listing_cache) as cache:
+            lister = cache_lister(cache, args.collection, transfer_client)
+            totals = plan_listing(lister, args.paths, args.rules, args.workers)
+
+    report(totals, args.rate)
+    if args.json:
+        tmp_path = args.json + ".partial"
+        with open(tmp_path, "w") as f:
+            json.dump(totals.as_dict(), f, indent=2)
+        os.replace(tmp_path, args.json)
+    if not totals.complete:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+# Opt-in profiling of where a driver script's time goes.
+#
+# Off by default, and then every hook below is a single flag check. With
+# --profile (or MRI_GLOBUS_PROFILE set) the shared modules time their phases:
+#
+#   auth     loading tokens and refreshing the access token
+#   list     operation_ls pages
+#   batch    building TransferData documents
+#   submit   submit_transfer calls
+#   wait     polling tasks until they finish
+#
+# and the scripts add their own (scan, pack, reconcile, ...). The
+# TransferClient counts calls, bytes sent and received and time for each API
+# endpoint. At exit a per-phase breakdown is printed to stderr, and written as
+# JSON if --profile was given a file. Phases running in several threads at
+# once add up, so their total can exceed the wall time; self time excludes
+# nested phases.
+#
+# For offline digging, --profile-cprofile writes a cProfile stats file of the
+# main thread (read it with pstats or snakeviz), and --profile-sample writes
+# stacks of every thread sampled every 10 ms in the folded format taken by
+# flamegraph.pl and speedscope. Both work the same against the local Globus
+# stand-in, e.g. benchmark.py --profile.
+#
+# Environment equivalents: MRI_GLOBUS_PROFILE=1 or =FILE,
+# MRI_GLOBUS_PROFILE_CPROFILE=FILE, MRI_GLOBUS_PROFILE_SAMPLE=FILE.
+#
+
+import atexit
+import collections
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+ENV_PROFILE = "MRI_GLOBUS_PROFILE"
+ENV_CPROFILE = "MRI_GLOBUS_PROFILE_CPROFILE"
+ENV_SAMPLE = "MRI_GLOBUS_PROFILE_SAMPLE"
+
+SAMPLE_INTERVAL = 0.01
+
+# Methods counted on clients without a request() method, i.e. the stand-in.
+CLIENT_METHODS = (
+    "get_submission_id", "submit_transfer", "submit_delete", "get_task", "operation_ls",
+    "task_successful_transfers", "cancel_task",
+)
+
+# Path segments that are IDs are collapsed so calls group by endpoint.
+_ID_SEGMENT = re.compile(r"^[0-9a-fA-F-]{32,36}$")
+
+enabled = False
+
+Phase = collections.namedtuple("Phase", ["name", "calls", "total_s", "self_s"])
+Endpoint = collections.namedtuple("Endpoint", ["name", "calls", "sent", "received", "total_s"])
+
+
+class Profile:
+    """Phase timings and API call counts for one process."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._phases = collections.defaultdict(lambda: [0, 0.0, 0.0])
+        self._endpoints = collections.defaultdict(lambda: [0, 0, 0, 0.0])
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        stack = self._local.__dict__.setdefault("stack", [])
+        # Each frame collects the time of the phases nested inside it.
+        frame = [0.0]
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+            with self._lock:
+                entry = self._phases[name]
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] += elapsed - frame[0]
+
+    def api_call(self, name, sent, received, elapsed):
+        with self._lock:
+            entry = self._endpoints[name]
+            entry[0] += 1
+            entry[1] += sent
+            entry[2] += received
+            entry[3] += elapsed
+
+    def phases(self):
+        with self._lock:
+            return sorted((Phase(name, *values) for name, values in self._phases.items()),
+                          key=lambda p: p.self_s, reverse=True)
+
+    def endpoints(self):
+        with self._lock:
+            return sorted((Endpoint(name, *values) for name, values in self._endpoints.items()),
+                          key=lambda e: e.total_s, reverse=True)
+
+    def report(self, out=sys.stderr):
+        wall = time.perf_counter() - self.started
+        print(f"Profile: {wall:.2f} s wall", file=out)
+        print(f"{'phase':<24} {'calls':>8} {'total_s':>10} {'self_s':>10} {'% wall':>7}", file=out)
+        for p in self.phases():
+            print(f"{p.name:<24} {p.calls:>8} {p.total_s:>10.2f} {p.self_s:>10.2f} "
+                  f"{100 * p.self_s / wall if wall else 0:>6.1f}%", file=out)
+        endpoints = self.endpoints()
+        if endpoints:
+            print(f"{'API endpoint':<40} {'calls':>8} {'sent_MB':>9} {'recv_MB':>9} {'total_s':>10}", file=out)
+            for e in endpoints:
+                print(f"{e.name:<40} {e.calls:>8} {e.sent / 1e6:>9.2f} {e.received / 1e6:>9.2f} "
+                      f"{e.total_s:>10.2f}", file=out)
+
+    def write_json(self, path):
+        data = {
+            "wall_s": time.perf_counter() - self.started,
+            "phases": [p._asdict() for p in self.phases()],
+            "endpoints": [e._asdict() for e in self.endpoints()],
+        }
+        tmp_path = path + ".partial"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+class Sampler(threading.Thread):
+    """Samples the stacks of every other thread and counts them in folded form."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write(self, path):
+        tmp_path = path + ".partial"
+        with open(tmp_path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(tmp_path, path)
+
+
+profile = Profile()
+
+
+def phase(name):
+    """Context manager timing ``name``; does nothing unless profiling is on."""
+    if not enabled:
+        return contextlib.nullcontext()
+    return profile.phase(name)
+
+
+def timed(name):
+    """Decorator form of phase()."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _endpoint(method, path):
+    segments = ["{id}" if _ID_SEGMENT.match(s) else s for s in path.split("?")[0].split("/")]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+def _size(value):
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    try:
+        return len(json.dumps(getattr(value, "data", value), default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def instrument(client):
+    """
+    Count the API calls made through ``client`` per endpoint, if profiling is
+    on. A globus_sdk client is wrapped at request(), which every call goes
+    through; anything else (the stand-in) at its Transfer methods.
+    """
+    if not enabled:
+        return client
+    if hasattr(client, "request"):
+        request = client.request
+
+        @functools.wraps(request)
+        def counted_request(method, path, *args, **kwargs):
+            start = time.perf_counter()
+            response = request(method, path, *args, **kwargs)
+            raw = getattr(response, "_raw_response", None)
+            sent = _size(raw.request.body) if raw is not None else _size(kwargs.get("data"))
+            received = len(raw.content) if raw is not None else _size(response)
+            profile.api_call(_endpoint(method, path), sent, received, time.perf_counter() - start)
+            return response
+
+        client.request = counted_request
+        return client
+
+    for name in CLIENT_METHODS:
+        method = getattr(client, name, None)
+        if method is None:
+            continue
+
+        def counted(*args, _method=method, _name=name, **kwargs):
+            start = time.perf_counter()
+            result = _method(*args, **kwargs)
+            sent = sum(_size(a) for a in args if not isinstance(a, str))
+            profile.api_call(_name, sent, _size(result), time.perf_counter() - start)
+            return result
+
+        setattr(client, name, functools.wraps(method)(counted))
+    return client
+
+
+def instrument_authorizer(authorizer):
+    """Time access token refreshes as the auth phase, if profiling is on."""
+    refresh = getattr(authorizer, "_get_new_access_token", None)
+    if enabled and refresh is not None:
+        authorizer._get_new_access_token = timed("auth")(refresh)
+    return authorizer
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                        help="time each phase and API endpoint and print the breakdown at exit; "
+                             "with FILE also write it as JSON")
+    parser.add_argument("--profile-cprofile", metavar="FILE",
+                        help="write cProfile stats of the main thread to FILE")
+    parser.add_argument("--profile-sample", metavar="FILE",
+                        help="write folded stacks of all threads, sampled every 10 ms, to FILE")
+
+
+def configure(profile_file=None, cprofile_file=None, sample_file=None):
+    """
+    Turn profiling on if any output is asked for, by argument or environment,
+    and arrange for the results to be written at exit.
+    """
+    global enabled
+    profile_file = profile_file or os.environ.get(ENV_PROFILE)
+    cprofile_file = cprofile_file or os.environ.get(ENV_CPROFILE)
+    sample_file = sample_file or os.environ.get(ENV_SAMPLE)
+    if not (profile_file or cprofile_file or sample_file):
+        return
+    enabled = True
+    profile.started = time.perf_counter()
+
+    profiler = None
+    if cprofile_file:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    sampler = None
+    if sample_file:
+        sampler = Sampler()
+        sampler.start()
+
+    def finish():
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_file)
+        if sampler is not None:
+            sampler.stop()
+            sampler.write(sample_file)
+        profile.report()
+        if profile_file and profile_file not in ("-", "1"):
+            profile.write_json(profile_file)
+
+    atexit.register(finish)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+# Reconcile what a transfer actually delivered with what was planned.
+#
+# A SUCCEEDED status says the task finished, not that every planned file is
+# in it. This streams the task's successful transfers page by page and
+# checks them against the planned files (a checksum manifest or any list of
+# source paths), and writes out exactly which source files are safe to
+# delete.
+#
+# Both sides are split by a hash of the path into bucket files in a temporary
+# directory, then each bucket is checked with an in-memory set of the
+# transferred paths. Time is linear in the number of files and memory is
+# bounded by the bucket size, so multi-million-file tasks reconcile in a few
+# hundred MB at most.
+#
+# Example:
+#   reconcile.py TASK_ID --manifest MANIFESTS/checksums_20241018.txt \
+#       --source-root ./University_Park/20241018/ \
+#       --local-root /storage/work/.../University_Park/20241018 \
+#       --output eligible_for_deletion_20241018.txt
+#
+
+import argparse
+import contextlib
+import math
+import os
+import posixpath
+import sys
+import tempfile
+import zlib
+
+import checksums
+import globus_client
+import profiling
+
+# Planned paths per bucket; each bucket's transferred paths are held in a set.
+DEFAULT_BUCKET_SIZE = 200000
+DEFAULT_BUCKETS = 64
+
+
+def normalize(path):
+    """Compare paths without leading ./ or /, trailing / or doubled separators."""
+    return posixpath.normpath(path).lstrip("/").removeprefix("./")
+
+
+def successful_transfers(transfer_client, task_id):
+    """Yield the source_path of every file a task transferred, one page at a time."""
+    marker = None
+    while True:
+        page = transfer_client.task_successful_transfers(task_id, marker=marker)
+        for record in page["DATA"]:
+            yield record["source_path"]
+        marker = page.get("next_marker")
+        if not marker:
+            return
+
+
+class _Buckets:
+    """Lines appended to one of ``count`` files chosen by a hash of the path."""
+
+    def __init__(self, directory, name, count):
+        self.paths = [os.path.join(directory, f"{name}.{i}") for i in range(count)]
+        self.files = [open(path, "w") for path in self.paths]
+
+    def add(self, key, line=None):
+        self.files[zlib.crc32(key.encode()) % len(self.files)].write((line or key) + "\n")
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    def read(self, index):
+        with open(self.paths[index]) as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+
+def reconcile(planned, transferred, buckets=None):
+    """
+    Yield (path, confirmed) for each path in ``planned``, in no particular
+    order, where ``confirmed`` says whether it appears in ``transferred``.
+    Paths are compared after normalize() and yielded as given in
+    ``planned``, which must not contain newlines.
+    """
+    if buckets is None:
+        buckets = (
+            max(math.ceil(len(planned) / DEFAULT_BUCKET_SIZE), 1) if hasattr(planned, "__len__")
+            else DEFAULT_BUCKETS
+        )
+    with tempfile.TemporaryDirectory(prefix="reconcile-") as tmp:
+        planned_buckets = _Buckets(tmp, "planned", buckets)
+        done_buckets = _Buckets(tmp, "done", buckets)
+        try:
+            for path in planned:
+                key = normalize(path)
+                # Keep the planned spelling alongside the key when they differ.
+                planned_buckets.add(key, f"{key}\0{path}" if key != path else None)
+            for path in transferred:
+                done_buckets.add(normalize(path))
+        finally:
+            planned_buckets.close()
+            done_buckets.close()
+
+        for index in range(buckets):
+            done = set(done_buckets.read(index))
+            for line in planned_buckets.read(index):
+                key, _, original = line.partition("\0")
+                yield original or key, key in done
+
+
+def write_paths(paths, output_file):
+    """Write one path per line to ``output_file``, replacing it atomically; return the count."""
+    count = 0
+    tmp_path = output_file + ".partial"
+    with open(tmp_path, "w") as f:
+        for path in paths:
+            f.write(path + "\n")
+            count += 1
+    os.replace(tmp_path, output_file)
+    return count
+
+
+def reconcile_to_file(transfer_client, task_ids, planned, output_file, to_local=None):
+    """
+    Reconcile the successful transfers of ``task_ids`` against ``planned``
+    source paths. The confirmed ones, mapped through ``to_local(path)`` (which
+    may return several paths, e.g. a bundle's members), are written to
+    ``output_file``. Returns the list of planned paths that were not
+    transferred.
+    """
+    def transferred():
+        for task_id in task_ids:
+            yield from successful_transfers(transfer_client, task_id)
+
+    missing = []
+
+    def confirmed():
+        for path, ok in reconcile(planned, transferred()):
+            if not ok:
+                missing.append(path)
+            elif to_local is None:
+                yield path
+            else:
+                yield from to_local(path)
+
+    count = write_paths(confirmed(), output_file)
+    print(f"{count} files confirmed transferred and safe to delete; written to {output_file}")
+    for path in missing[:20]:
+        print(f"Not in the successful transfers: {path}")
+    if len(missing) > 20:
+        print(f"... and {len(missing) - 20} more")
+    return missing
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("task_ids", nargs="+", metavar="TASK_ID")
+    planned = parser.add_mutually_exclusive_group(required=True)
+    planned.add_argument("--manifest", help="checksum manifest of the planned files, relative to --source-root")
+    planned.add_argument("--paths", help="file of planned source paths, one per line")
+    parser.add_argument("--source-root", default="/",
+                        help="where the manifest paths are on the source collection")
+    parser.add_argument("--local-root",
+                        help="local directory for --source-root; confirmed files are written as local paths")
+    parser.add_argument("--output", required=True, help="file to write the safe-to-delete paths to")
+    parser.add_argument("--client-id", required=True)
+    parser.add_argument("--token-file", required=True)
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiling.configure(args.profile, args.profile_cprofile, args.profile_sample)
+    transfer_client = globus_client.get_transfer_client(args.client_id, args.token_file, background_refresh=False)
+
+    with contextlib.ExitStack() as stack:
+        if args.manifest:
+            planned = (
+                posixpath.join(args.source_root, entry.path) for entry in checksums.read_manifest(args.manifest)
+            )
+        else:
+            f = stack.enter_context(open(args.paths))
+            planned = (line.rstrip("\n") for line in f if line.strip())
+
+        to_local = None
+        if args.local_root:
+            root = normalize(args.source_root)
+
+            def to_local(path):
+                return [os.path.join(args.local_root, posixpath.relpath(normalize(path), root or "."))]
+
+        missing = reconcile_to_file(transfer_client, args.task_ids, planned, args.output, to_local)
+    if missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
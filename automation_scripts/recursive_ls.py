@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# Recursive, parallel listing of a Globus collection.
+#
+# Directories are walked breadth-first with a bounded pool of concurrent
+# operation_ls calls. Each directory is read page by page using the API's
+# offset/limit pagination, and entries are yielded as soon as their page
+# arrives, so the whole inventory is never held in memory.
+#
+
+import collections
+import concurrent.futures
+import csv
+import json
+import posixpath
+import queue
+import sys
+import threading
+
+import profiling
+
+DEFAULT_WORKERS = 8
+DEFAULT_PAGE_SIZE = 1000
+
+# Marks the end of one directory's listing on the results queue.
+_DONE = object()
+
+OUTPUT_FIELDS = ["path", "type", "name", "size", "permissions", "user", "group", "last_modified"]
+
+
+def list_directory(transfer_client, collection_id, path, page_size=DEFAULT_PAGE_SIZE, **ls_kwargs):
+    """Yield every entry of one directory, fetching ``page_size`` entries per call."""
+    offset = 0
+    while True:
+        with profiling.phase("list"):
+            page = transfer_client.operation_ls(
+                collection_id, path=path, limit=page_size, offset=offset, **ls_kwargs
+            )
+        entries = page["DATA"]
+        yield from entries
+        offset += len(entries)
+        total = page.get("total")
+        if total is not None and offset >= total:
+            return
+        if len(entries) < page_size:
+            return
+
+
+def walk(transfer_client, collection_id, path="/", workers=DEFAULT_WORKERS,
+         page_size=DEFAULT_PAGE_SIZE, max_depth=None, lister=None, **ls_kwargs):
+    """
+    Walk ``path`` on ``collection_id`` and yield (directory, entry) for every
+    entry below it. Up to ``workers`` directories are listed at once, and
+    entries stream out in whatever order their pages come back.
+
+    ``lister(path)`` may be given to replace list_directory, e.g. with a cached
+    version; it must return an iterable of entries.
+    """
+    if lister is None:
+        def lister(dir_path):
+            return list_directory(transfer_client, collection_id, dir_path, page_size, **ls_kwargs)
+
+    # Workers push (dir, entry) tuples, a _DONE marker per finished directory,
+    # or an exception; the caller's thread drains the queue. The queue is
+    # bounded so a slow consumer throttles the listing.
+    results = queue.Queue(maxsize=workers * page_size)
+    stop = threading.Event()
+
+    def list_one(dir_path, depth):
+        try:
+            for entry in lister(dir_path):
+                if stop.is_set():
+                    return
+                results.put((dir_path, depth, entry))
+        except Exception as err:
+            results.put((dir_path, depth, err))
+        finally:
+            results.put((dir_path, depth, _DONE))
+
+    pending = collections.deque([(path, 0)])
+    in_flight = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            while pending or in_flight:
+                while pending and in_flight < workers:
+                    pool.submit(list_one, *pending.popleft())
+                    in_flight += 1
+                dir_path, depth, item = results.get()
+                if item is _DONE:
+                    in_flight -= 1
+                elif isinstance(item, Exception):
+                    print(f"Error listing {dir_path}: {item}", file=sys.stderr)
+                else:
+                    yield dir_path, item
+                    if item["type"] == "dir" and (max_depth is None or depth < max_depth):
+                        pending.append((posixpath.join(dir_path, item["name"]), depth + 1))
+        finally:
+            stop.set()
+            # Unblock any worker still waiting to put a result.
+            while in_flight:
+                if results.get()[2] is _DONE:
+                    in_flight -= 1
+
+
+def write_jsonl(rows, out):
+    for dir_path, entry in rows:
+        record = {"path": posixpath.join(dir_path, entry["name"])}
+        record.update((field, entry.get(field)) for field in OUTPUT_FIELDS[1:])
+        out.write(json.dumps(record) + "\n")
+
+
+def write_csv(rows, out):
+    writer = csv.writer(out)
+    writer.writerow(OUTPUT_FIELDS)
+    for dir_path, entry in rows:
+        writer.writerow(
+            [posixpath.join(dir_path, entry["name"])] + [entry.get(field) for field in OUTPUT_FIELDS[1:]]
+        )
+
+
+WRITERS = {"jsonl": write_jsonl, "csv": write_csv}
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+# Run every configured transfer route from one process.
+#
+# Instead of a copy of transfer.py per lab with its own collection UUIDs,
+# paths and token file, the routes are declared in a TOML file (see
+# routes.example.toml): the native app and token file once, then one
+# [[route]] per source/destination collection pair with its path mappings,
+# filter rules, sync level and concurrency. The file is parsed and checked
+# up front, so a typo fails before anything is submitted. All routes then
+# run at the same time, each through its own orchestrator, sharing a single
+# authenticated TransferClient. transfer.py, sync.py and transfer_to_archive.py
+# take their collections and auth from one route of the same file with
+# --config and --route instead of their built-in UUIDs, along with the
+# route's paths, filter rules and transfer options where they apply (see
+# each script). A route used only by sync.py or transfer_to_archive.py may
+# leave out paths; routes.py and scheduler.py refuse to run such a route.
+#
+# Needs Python 3.11 for tomllib, or the tomli package on 3.10.
+#
+# Example:
+#   routes.py routes.toml
+#   routes.py routes.toml --only lab396 --dry-run
+#
+
+import argparse
+import collections
+import concurrent.futures
+import sys
+import time
+import uuid
+
+try:
+    import tomllib
+except ImportError:
+    # Python 3.10, as on the CQI hosts: the same parser from PyPI.
+    import tomli as tomllib
+
+import globus_client
+import listing_cache
+import metrics
+import orchestrator
+import profiling
+
+SYNC_LEVELS = ("exists", "size", "mtime", "checksum")
+FILTER_METHODS = ("include", "exclude")
+FILTER_TYPES = ("file", "dir")
+
+# Route keys passed straight through to globus_sdk.TransferData.
+TRANSFER_OPTIONS = {
+    "sync_level": str,
+    "verify_checksum": bool,
+    "preserve_timestamp": bool,
+    "encrypt_data": bool,
+    "fail_on_quota_errors": bool,
+    "skip_source_errors": bool,
+    "delete_destination_extra": bool,
+}
+
+ROUTE_KEYS = {"name", "source", "destination", "paths", "label", "concurrency", "retries",
+              "filter_rules"} | set(TRANSFER_OPTIONS)
+
+Config = collections.namedtuple("Config", ["client_id", "token_file", "routes"])
+
+# paths is a list of (source_path, destination_path) pairs, empty if the route sets none.
+Route = collections.namedtuple(
+    "Route",
+    ["name", "source", "destination", "paths", "label", "concurrency", "retries", "options", "filter_rules"],
+)
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def _require(table, key, kind, where):
+    if key not in table:
+        raise ConfigError(f"{where}: missing '{key}'")
+    return _check(table[key], kind, f"{where}.{key}")
+
+
+def _check(value, kind, where):
+    if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+        names = kind.__name__ if isinstance(kind, type) else " or ".join(k.__name__ for k in kind)
+        raise ConfigError(f"{where}: expected {names}, got {value!r}")
+    return value
+
+
+def _known_keys(table, allowed, where):
+    unknown = set(table) - set(allowed)
+    if unknown:
+        raise ConfigError(f"{where}: unknown keys {', '.join(sorted(unknown))}")
+
+
+def _collection(table, key, where):
+    value = _require(table, key, str, where)
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        raise ConfigError(f"{where}.{key}: {value!r} is not a collection UUID") from None
+    return value
+
+
+def _paths(route, where):
+    if "paths" not in route:
+        return []
+    paths = []
+    for i, mapping in enumerate(_require(route, "paths", list, where)):
+        item = f"{where}.paths[{i}]"
+        if isinstance(mapping, str):
+            # A bare path is copied to the same path on the destination.
+            paths.append((mapping, mapping))
+            continue
+        _check(mapping, dict, item)
+        _known_keys(mapping, ("source", "destination"), item)
+        source = _require(mapping, "source", str, item)
+        paths.append((source, _check(mapping.get("destination", source), str, f"{item}.destination")))
+    if not paths:
+        raise ConfigError(f"{where}.paths: no paths to transfer")
+    return paths
+
+
+def _filter_rules(route, where):
+    rules = []
+    for i, rule in enumerate(route.get("filter_rules", [])):
+        item = f"{where}.filter_rules[{i}]"
+        _check(rule, dict, item)
+        _known_keys(rule, ("name", "method", "type"), item)
+        name = _require(rule, "name", str, item)
+        method = rule.get("method", "exclude")
+        if method not in FILTER_METHODS:
+            raise ConfigError(f"{item}.method: must be one of {', '.join(FILTER_METHODS)}")
+        # Without a type Globus applies the rule to files and directories alike.
+        if "type" in rule and rule["type"] not in FILTER_TYPES:
+            raise ConfigError(f"{item}.type: must be one of {', '.join(FILTER_TYPES)}")
+        rules.append({"name": name, "method": method, **({"type": rule["type"]} if "type" in rule else {})})
+    return tuple(rules)
+
+
+def _route(route, defaults, where):
+    merged = dict(defaults, **route)
+    name = _require(merged, "name", str, where)
+    where = f"route {name!r}"
+    options = {}
+    for key, kind in TRANSFER_OPTIONS.items():
+        if key in merged:
+            options[key] = _check(merged[key], kind, f"{where}.{key}")
+    if options.get("sync_level", "checksum") not in SYNC_LEVELS:
+        raise ConfigError(f"{where}.sync_level: must be one of {', '.join(SYNC_LEVELS)}")
+    concurrency = _check(merged.get("concurrency", orchestrator.DEFAULT_CONCURRENCY), int, f"{where}.concurrency")
+    retries = _check(merged.get("retries", orchestrator.DEFAULT_RETRIES), int, f"{where}.retries")
+    if concurrency < 1 or retries < 0:
+        raise ConfigError(f"{where}: concurrency must be at least 1 and retries at least 0")
+    _known_keys(route, ROUTE_KEYS, where)
+    return Route(
+        name=name,
+        source=_collection(merged, "source", where),
+        destination=_collection(merged, "destination", where),
+        paths=_paths(merged, where),
+        label=_check(merged.get("label", f"{name} transfer"), str, f"{where}.label"),
+        concurrency=concurrency,
+        retries=retries,
+        options=options,
+        filter_rules=_filter_rules(merged, where),
+    )
+
+
+def parse_config(data):
+    """Validate a parsed TOML document and return a Config. Raises ConfigError."""
+    _known_keys(data, ("auth", "defaults", "route"), "config")
+    auth = _require(data, "auth", dict, "config")
+    _known_keys(auth, ("client_id", "token_file"), "auth")
+    defaults = _check(data.get("defaults", {}), dict, "defaults")
+    _known_keys(defaults, ROUTE_KEYS - {"name"}, "defaults")
+    routes = [_route(_check(route, dict, f"route[{i}]"), defaults, f"route[{i}]")
+              for i, route in enumerate(_require(data, "route", list, "config"))]
+    names = [route.name for route in routes]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ConfigError(f"duplicate route names: {', '.join(duplicates)}")
+    return Config(
+        client_id=_require(auth, "client_id", str, "auth"),
+        token_file=_require(auth, "token_file", str, "auth"),
+        routes=routes,
+    )
+
+
+def load_config(path):
+    with open(path, "rb") as f:
+        try:
+            data = tomllib.load(f)
+        except tomllib.TOMLDecodeError as err:
+            raise ConfigError(f"{path}: {err}") from None
+    return parse_config(data)
+
+
+def select_route(path, name=None):
+    """
+    Load ``path`` and return (config, route) for the route called ``name``,
+    or for its only route if no name is given. Raises ConfigError.
+    """
+    config = load_config(path)
+    if name is None:
+        if len(config.routes) != 1:
+            raise ConfigError(f"{path}: has {len(config.routes)} routes; choose one with --route")
+        return config, config.routes[0]
+    for route in config.routes:
+        if route.name == name:
+            return config, route
+    raise ConfigError(f"{path}: no route named {name!r}")
+
+
+def check_paths(routes):
+    """Raise ConfigError if any of ``routes`` has no paths to transfer."""
+    missing = [route.name for route in routes if not route.paths]
+    if missing:
+        raise ConfigError(f"no paths to transfer in routes {', '.join(missing)}")
+
+
+def add_arguments(parser):
+    """--config and --route, for scripts that can take their collections and auth from a routes file."""
+    parser.add_argument("--config", metavar="TOML",
+                        help="routes file to take the collections, auth and route settings from, "
+                             "instead of the built-in ones")
+    parser.add_argument("--route", metavar="NAME", help="route in --config to use; default its only route")
+
+
+def configured_route(args, check=None):
+    """
+    (config, route) for --config and --route, or (None, None) without
+    --config. ``check(route)`` may raise ConfigError for a route the calling
+    script cannot use. Exits on a bad config.
+    """
+    if not args.config:
+        return None, None
+    try:
+        config, route = select_route(args.config, args.route)
+        if check is not None:
+            check(route)
+        return config, route
+    except ConfigError as err:
+        print(f"Invalid config: {err}", file=sys.stderr)
+        sys.exit(2)
+
+
+def route_jobs(route):
+    """One TransferJob per path mapping of a route."""
+    return [
+        orchestrator.TransferJob(
+            route.source,
+            route.destination,
+            source_path,
+            destination_path,
+            label=f"{route.label} {source_path}",
+            options=route.options,
+            filter_rules=route.filter_rules,
+        )
+        for source_path, destination_path in route.paths
+    ]
+
+
+def run_route(transfer_client, route):
+    """Run one route's jobs and return its JobResults."""
+    print(f"[{route.name}] starting {len(route.paths)} transfers")
+    results = orchestrator.Orchestrator(
+        transfer_client, concurrency=route.concurrency, retries=route.retries
+    ).run(route_jobs(route))
+    listing_cache.invalidate_paths(route.destination, [dst for _, dst in route.paths])
+    return results
+
+
+def run_routes(transfer_client, routes):
+    """Run every route at once; return a dict of route name to its JobResults."""
+    outcomes = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(routes), 1)) as pool:
+        futures = {pool.submit(run_route, transfer_client, route): route for route in routes}
+        for future in concurrent.futures.as_completed(futures):
+            outcomes[futures[future].name] = future.result()
+    return outcomes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="TOML file of routes")
+    parser.add_argument("--only", nargs="+", metavar="ROUTE", help="run just these routes")
+    parser.add_argument("--dry-run", action="store_true", help="check the config and print the routes")
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics.configure(args.metrics_log, args.metrics_prom, script="routes")
+    profiling.configure(args.profile, args.profile_cprofile, args.profile_sample)
+
+    try:
+        config = load_config(args.config)
+    except ConfigError as err:
+        print(f"Invalid config: {err}", file=sys.stderr)
+        sys.exit(2)
+
+    routes = config.routes
+    if args.only:
+        unknown = set(args.only) - {route.name for route in routes}
+        if unknown:
+            print(f"No such route: {', '.join(sorted(unknown))}", file=sys.stderr)
+            sys.exit(2)
+        routes = [route for route in routes if route.name in args.only]
+    try:
+        check_paths(routes)
+    except ConfigError as err:
+        print(f"Invalid config: {err}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.dry_run:
+        for route in routes:
+            print(f"{route.name}: {route.source} -> {route.destination}, "
+                  f"concurrency {route.concurrency}, {route.options}")
+            for source_path, destination_path in route.paths:
+                print(f"    {source_path} -> {destination_path}")
+        return
+
+    transfer_client = globus_client.get_transfer_client(config.client_id, config.token_file)
+
+    start = time.time()
+    outcomes = run_routes(transfer_client, routes)
+    failed = [
+        name for name, results in outcomes.items()
+        if not all(r.task is not None and r.task["status"] == "SUCCEEDED" for r in results)
+    ]
+    print(f"{len(routes) - len(failed)}/{len(routes)} routes succeeded in {time.time() - start:.0f} s")
+    if failed:
+        print(f"Failed routes: {', '.join(sorted(failed))}. Check Globus dashboard for details.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+# Fit the night's transfers into the transfer window.
+#
+# Run from cron at the start of the window instead of starting each route's
+# transfers separately. Only the jobs of the routes in routes.toml (see
+# routes.py) are scheduled; sync.py and transfer_to_archive.py still run from
+# their own cron entries and are not counted against the window. Every job
+# is sized before anything is submitted:
+#
+#   history  bytes the same job (by label) moved last time it succeeded,
+#            from the --metrics-log JSON lines
+#   listing  total size under the source path that the route's filter
+#            rules let through, from the listing cache (see planner.py),
+#            without any API calls unless --list-missing is given
+#
+# Jobs are then ordered smallest first with a fair share per lab: the next
+# job always comes from the lab with the fewest bytes scheduled so far, so
+# one big lab cannot hold back the others. The order is laid out over the
+# concurrency slots at the expected rate of one task (the median of past
+# tasks, or --rate split between the slots) and every job whose projected
+# finish is after --window-end is reported before the run starts. All tasks
+# carry the window end as their Globus deadline; with --defer-late the jobs
+# that will not fit are left for the next night. Jobs whose size is unknown
+# are warned about and run last rather than deferred, so a new route is not
+# put off night after night.
+#
+# Example:
+#   scheduler.py routes.toml --window-end 06:00 --metrics-log ~/transfer_metrics.jsonl
+#
+
+import argparse
+import collections
+import datetime
+import heapq
+import json
+import os
+import statistics
+import sys
+import time
+
+import globus_client
+import listing_cache
+import metrics
+import orchestrator
+import planner
+import profiling
+import routes
+
+DEFAULT_RATE_MB_S = 100.0
+
+# Runs of the same job are matched on their label, so only the most recent
+# successful ones are kept, and the rate is taken over the latest tasks.
+HISTORY_TASKS = 500
+
+ScheduledJob = collections.namedtuple("ScheduledJob", ["lab", "job", "bytes", "source"])
+Slot = collections.namedtuple("Slot", ["scheduled", "start", "finish"])
+
+
+def parse_window_end(value, now=None):
+    """
+    Parse ``HH:MM`` as the next such local time after ``now``, or an ISO 8601
+    date and time. Returns an aware datetime.
+    """
+    now = now or datetime.datetime.now().astimezone()
+    try:
+        clock = datetime.time.fromisoformat(value)
+    except ValueError:
+        when = datetime.datetime.fromisoformat(value)
+        return when if when.tzinfo is not None else when.astimezone()
+    when = datetime.datetime.combine(now.date(), clock, tzinfo=now.tzinfo)
+    if when <= now:
+        when += datetime.timedelta(days=1)
+    return when
+
+
+def load_history(log_file):
+    """
+    Read a metrics log and return (bytes by label, median MB/s of a task)
+    over its successful tasks; either may be empty or None. The rate is that
+    of one task, i.e. of one concurrency slot, not of all of them together.
+    """
+    sizes = {}
+    rates = collections.deque(maxlen=HISTORY_TASKS)
+    if not log_file or not os.path.exists(log_file):
+        return sizes, None
+    with open(log_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") != "SUCCEEDED":
+                continue
+            if record.get("label"):
+                sizes[record["label"]] = record.get("bytes_transferred", 0)
+            if record.get("mb_per_s"):
+                rates.append(record["mb_per_s"])
+    return sizes, statistics.median(rates) if rates else None
+
+
+def listing_size(lister, path, rules=()):
+    """
+    Total size of the files under ``path`` (or of ``path`` itself if it is a
+    file) that ``rules`` let through, from ``lister(dir)``, which returns a
+    listing or None when it has none; the result is None if any directory
+    below is missing.
+    """
+    totals = planner.plan_listing(lister, [path], rules)
+    return totals.bytes if totals.complete else None
+
+
+def estimate(jobs_by_lab, history, cache=None, transfer_client=None):
+    """
+    Size every job and return a list of ScheduledJobs. ``jobs_by_lab`` maps a
+    lab name to its TransferJobs. Listings come from ``cache``, and, when a
+    ``transfer_client`` is given, from the API for directories not cached.
+    """
+    sized = []
+    for lab, jobs in jobs_by_lab.items():
+        for job in jobs:
+            if job.label in history:
+                sized.append(ScheduledJob(lab, job, history[job.label], "history"))
+                continue
+            size = None
+            if cache is not None:
+                lister = planner.cache_lister(cache, job.source_endpoint, transfer_client)
+                size = listing_size(lister, job.source_path, job.filter_rules)
+            sized.append(ScheduledJob(lab, job, size, "listing" if size is not None else None))
+    return sized
+
+
+def fair_order(sized):
+    """
+    Order jobs smallest first within each lab, taking the next one from the
+    lab with the fewest bytes scheduled so far. Jobs of unknown size go last.
+    """
+    queues = collections.defaultdict(list)
+    unknown = []
+    for scheduled in sized:
+        if scheduled.bytes is None:
+            unknown.append(scheduled)
+        else:
+            queues[scheduled.lab].append(scheduled)
+    for queue in queues.values():
+        queue.sort(key=lambda s: s.bytes, reverse=True)
+
+    heap = [(0, lab) for lab in sorted(queues)]
+    heapq.heapify(heap)
+    ordered = []
+    while heap:
+        share, lab = heapq.heappop(heap)
+        scheduled = queues[lab].pop()
+        ordered.append(scheduled)
+        if queues[lab]:
+            heapq.heappush(heap, (share + scheduled.bytes, lab))
+    return ordered + unknown
+
+
+def plan(ordered, start, slot_rate_mb_s, concurrency):
+    """
+    Lay ``ordered`` over ``concurrency`` slots that each move
+    ``slot_rate_mb_s``, in submission order, and return a Slot per job with
+    projected start and finish times (None for jobs of unknown size).
+    """
+    per_slot = slot_rate_mb_s * 1e6
+    free = [start] * concurrency
+    slots = []
+    for scheduled in ordered:
+        if scheduled.bytes is None:
+            slots.append(Slot(scheduled, None, None))
+            continue
+        begin = heapq.heappop(free)
+        finish = begin + scheduled.bytes / per_slot
+        heapq.heappush(free, finish)
+        slots.append(Slot(scheduled, begin, finish))
+    return slots
+
+
+def report(slots, window_end):
+    """
+    Print the plan and return the Slots projected to finish after
+    ``window_end``. Jobs of unknown size are warned about but not returned:
+    they run last, so that a route with no history or listing still runs.
+    """
+    late = [slot for slot in slots if slot.finish is not None and slot.finish > window_end]
+    unknown = [slot for slot in slots if slot.finish is None]
+    total = sum(slot.scheduled.bytes or 0 for slot in slots)
+    finish = max((slot.finish for slot in slots if slot.finish is not None), default=None)
+    print(f"{len(slots)} jobs, {total / 1e9:.2f} GB estimated, window ends "
+          f"{datetime.datetime.fromtimestamp(window_end).astimezone():%Y-%m-%d %H:%M %Z}")
+    if finish is not None:
+        print(f"Projected finish {datetime.datetime.fromtimestamp(finish).astimezone():%Y-%m-%d %H:%M %Z}")
+    for slot in late:
+        s = slot.scheduled
+        print(f"  WILL NOT FIT [{s.lab}] {s.job.source_path}: {s.bytes / 1e9:.2f} GB, "
+              f"{(slot.finish - window_end) / 60:.0f} min past the window")
+    for slot in unknown:
+        s = slot.scheduled
+        print(f"  SIZE UNKNOWN [{s.lab}] {s.job.source_path}: runs last and may not fit "
+              f"(seed the listing cache or use --list-missing)")
+    return late
+
+
+def with_deadline(job, deadline):
+    return job._replace(options=dict(job.options or {}, deadline=deadline.isoformat()))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="TOML file of routes, as for routes.py")
+    parser.add_argument("--window-end", required=True,
+                        help="end of the transfer window, HH:MM (next occurrence) or ISO date and time")
+    parser.add_argument("--only", nargs="+", metavar="ROUTE", help="schedule just these routes")
+    parser.add_argument("--concurrency", type=int, default=orchestrator.DEFAULT_CONCURRENCY,
+                        help="tasks in flight across all routes")
+    parser.add_argument("--retries", type=int, default=orchestrator.DEFAULT_RETRIES)
+    parser.add_argument("--rate", type=float,
+                        help="expected total MB/s across all tasks; default the median rate of a task "
+                             f"in --metrics-log for each task, else {DEFAULT_RATE_MB_S} in total")
+    parser.add_argument("--listing-cache", default=listing_cache.DEFAULT_CACHE_FILE,
+                        help="listing cache to size jobs from")
+    parser.add_argument("--list-missing", action="store_true",
+                        help="list source directories missing from the cache through the API")
+    parser.add_argument("--defer-late", action="store_true",
+                        help="do not submit jobs projected to finish after the window")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without submitting")
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics.configure(args.metrics_log, args.metrics_prom, script="scheduler")
+    profiling.configure(args.profile, args.profile_cprofile, args.profile_sample)
+
+    try:
+        config = routes.load_config(args.config)
+        selected = [route for route in config.routes if not args.only or route.name in args.only]
+        routes.check_paths(selected)
+    except routes.ConfigError as err:
+        print(f"Invalid config: {err}", file=sys.stderr)
+        sys.exit(2)
+    window_end = parse_window_end(args.window_end)
+
+    transfer_client = None
+    if not args.dry_run or args.list_missing:
+        transfer_client = globus_client.get_transfer_client(config.client_id, config.token_file)
+
+    history, history_rate = load_history(args.metrics_log)
+    if args.rate or not history_rate:
+        slot_rate = (args.rate or DEFAULT_RATE_MB_S) / args.concurrency
+    else:
+        slot_rate = history_rate
+    print(f"Expected rate {slot_rate:.1f} MB/s per task over {args.concurrency} concurrent tasks")
+    with listing_cache.ListingCache(args.listing_cache) as cache:
+        sized = estimate(
+            {route.name: routes.route_jobs(route) for route in selected},
+            history,
+            cache,
+            transfer_client if args.list_missing else None,
+        )
+    slots = plan(fair_order(sized), time.time(), slot_rate, args.concurrency)
+    late = report(slots, window_end.timestamp())
+
+    if args.dry_run:
+        return
+    if args.defer_late:
+        slots = [slot for slot in slots if slot not in late]
+        print(f"Deferring {len(late)} jobs to the next window")
+
+    jobs = [with_deadline(slot.scheduled.job, window_end) for slot in slots]
+    results = orchestrator.Orchestrator(
+        transfer_client, concurrency=args.concurrency, retries=args.retries
+    ).run(jobs)
+    for route in selected:
+        listing_cache.invalidate_paths(
+            route.destination, [dst for _, dst in route.paths], db_path=args.listing_cache
+        )
+    if not all(r.task is not None and r.task["status"] == "SUCCEEDED" for r in results):
+        print("Some transfers failed or were stopped at the deadline. Check Globus dashboard for details.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
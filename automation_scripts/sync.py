@@ -1,30 +1,39 @@
 #!/usr/bin/env python
 
 # This makes use of the Globus-hosted native app "MRI_2_RC_Test_App".
-# 
+#
 # Written by Lindsay Wells with assistance from J. Nucciarone and Globus support
 # January 23, 2025.
 #
 # Version 1.0
 #
-import os
-
-import time
-
 import argparse
-
-import webbrowser
+import collections
+import contextlib
+import fcntl
+import posixpath
+import sys
+import time
 
 import globus_sdk
-from globus_sdk import GroupsClient, NativeAppAuthClient, RefreshTokenAuthorizer
-from globus_sdk.tokenstorage import SimpleJSONFileAdapter
-from globus_sdk.scopes import TransferScopes
+
+import batching
+import change_index
+import globus_client
+import journal
+import listing_cache
+import metrics
+import planner
+import profiling
+import routes
+import task_waiter
+import watch
 
 # Set source and destination endpoint UUID
 # Source is the Guest Collection "MRI_Converge_Guest_Collection"
 # This guest collection corrsponds to directory /storage/long/ on converge.mri.psu.edu
 
-source_collection_id = "095bd11b-e263-44dc-ad19-6dd4b463207e" 
+source_collection_id = "095bd11b-e263-44dc-ad19-6dd4b463207e"
 
 # Destination is the Guest Collection "MRI_Data_Transfer_Guest_Collection"
 # This guest collection corresponds to directory /storage/group/MCL/default/globus-share/
@@ -35,157 +44,315 @@ dest_collection_id = "eef905af-dc3e-4f55-8c87-7b804cfb654f"
 
 CLIENT_ID = "0ba8e7a7-3f08-49bd-adde-61491161882c"
 
+TOKEN_FILE = "/root/globus_auth_scripts/my-globus-refresh-token.json"
+
 # Set the source and destination paths
 source_path = '/'
 destination_path = '/'
 
-auth_client = NativeAppAuthClient(CLIENT_ID)
-my_file_adapter = SimpleJSONFileAdapter(
-    os.path.expanduser("/root/globus_auth_scripts/my-globus-refresh-token.json")
+# The source collection root as seen on this host, and the change index
+# kept between runs. Only files that changed since the last successful run
+# are submitted; a full checksum sync of the whole tree is still run every
+# FULL_SYNC_DAYS as a safety net.
+LOCAL_ROOT = '/storage/long'
+INDEX_FILE = '/root/globus_auth_scripts/sync_index.sqlite'
+FULL_SYNC_DAYS = 7
+# How long --watch waits before trying a failed full sync again.
+FULL_SYNC_RETRY_SECONDS = 3600
+
+# Submitted batches are journaled here, so a run that dies part way is
+# resumed by the next one rather than re-sending everything.
+JOURNAL_FILE = '/root/globus_auth_scripts/sync_journal.sqlite'
+# Held for the whole run, so only one sync.py (cron or --watch) runs at a time.
+LOCK_FILE = '/root/globus_auth_scripts/sync.lock'
+RUN_KEY = f"sync:{dest_collection_id}"
+
+LABEL = "Transfer from /storage/long to /storage/group/MCL/default/globus-share"
+
+# Where a sync sends, with what TransferData options (over the defaults of
+# each kind of sync), filter rules and batches in flight: the collections
+# and paths above, or those of a routes file route given with --config.
+Target = collections.namedtuple(
+    "Target",
+    ["source", "destination", "source_path", "destination_path", "label", "options", "filter_rules",
+     "concurrency", "run_key"],
 )
 
-if not my_file_adapter.file_exists():
-    # requested_scopes specifies a list of scopes to request
-    # instead of the defaults, only request access to the Transfer API
-
-    auth_client.oauth2_start_flow(requested_scopes=TransferScopes.all, refresh_tokens=True)
-    authorize_url = auth_client.oauth2_get_authorize_url()
-     
-    print(f"Native App Authorizaion URL:\n{authorize_url}\n")
-
-    try:
-        webbrowser.open(authorize_url, new=1)
-    except:
-        print(f"Please go to this URL and login:\n\n{authorize_url}\n")
-
-    auth_code = input("Please enter the code here: ").strip()
-
-    token_response = auth_client.oauth2_exchange_code_for_tokens(auth_code)
-
-    # Store tokens for later
-    my_file_adapter.store(token_response)
-
-    # Use the current transfer tokens
-
-    transfer_tokens = token_response.by_resource_server["transfer.api.globus.org"]
-else:
-    # otherwise, we already did this whole song-and-dance, so just
-    # load the tokens from that file
-    transfer_tokens = my_file_adapter.get_token_data("transfer.api.globus.org")
-
-authorizer = globus_sdk.RefreshTokenAuthorizer(
-    transfer_tokens["refresh_token"],
-    auth_client,
-    access_token=transfer_tokens["access_token"],
-    expires_at=transfer_tokens["expires_at_seconds"],
-    on_refresh=my_file_adapter.on_refresh,
-)
-
-# construct an AccessTokenAuthorizer and use it to construct the
-# TransferClient
-
-transfer_client = globus_sdk.TransferClient(authorizer=authorizer)
-
-# create a Transfer task consisting of one or more items
-# task_data = globus_sdk.TransferData(
-#     transfer_client,source_endpoint=source_collection_id, destination_endpoint=dest_collection_id
-#)
-
-# create a Transfer task consisting of one or more items
-
-task_data = globus_sdk.TransferData(
-
-    transfer_client,source_endpoint=source_collection_id, destination_endpoint=dest_collection_id,
-
-    sync_level="checksum",
-
-    verify_checksum=True,
-
-    fail_on_quota_errors=True
-
-)
-
-# Create a data transfer object
-transfer_data = globus_sdk.TransferData(
-    transfer_client,
-    source_collection_id,
-    dest_collection_id,
-    label="Transfer from /storage/long to /storage/group/MCL/default/globus-share",
-    sync_level="checksum",  # Use "checksum" for data validation
-)
-
-# Add file paths to the transfer data object
-transfer_data.add_item(source_path, destination_path)
-
-task_data.add_filter_rule(name="*", method="include", type="dir")
-
-# Start the transfer
-print("Starting transfer...")
-transfer_result = transfer_client.submit_transfer(transfer_data)
-
-# Monitor the transfer status
-transfer_id = transfer_result['task_id']
-print(f"Transfer started with task ID: {transfer_id}")
+DEFAULT_TARGET = Target(source_collection_id, dest_collection_id, source_path, destination_path, LABEL, {}, (),
+                        batching.DEFAULT_CONCURRENCY, RUN_KEY)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--local-root", default=LOCAL_ROOT,
+                        help="local directory of the source path (the source collection's root, "
+                             "or the --route's source path)")
+    parser.add_argument("--index", default=INDEX_FILE, help="change index database")
+    parser.add_argument("--journal", default=JOURNAL_FILE, help="journal of submitted batches")
+    parser.add_argument("--lock-file", default=LOCK_FILE, help="lock held while this sync runs")
+    parser.add_argument("--full", action="store_true",
+                        help="run a full checksum sync of the whole tree")
+    parser.add_argument("--full-every-days", type=float, default=FULL_SYNC_DAYS,
+                        help="run a full checksum sync if the last one is older than this")
+    parser.add_argument("--hash", action="store_true",
+                        help="hash changed files and skip ones whose content is unchanged")
+    parser.add_argument("--watch", action="store_true",
+                        help="after the usual run, keep watching and sync each session once it goes quiet")
+    parser.add_argument("--quiet-seconds", type=float, default=watch.DEFAULT_QUIET_SECONDS,
+                        help="how long a session must go unchanged before it is sent")
+    parser.add_argument("--session-depth", type=int, default=watch.SESSION_DEPTH,
+                        help="directory levels below --local-root that make up a session")
+    parser.add_argument("--poll-interval", type=float, default=watch.DEFAULT_POLL_INTERVAL,
+                        help="seconds between scandir walks when inotify is not used")
+    parser.add_argument("--no-inotify", action="store_true", help="poll even if inotify is available")
+    routes.add_arguments(parser)
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def check_route(route):
+    """Raise ConfigError for a route with several path mappings: sync.py sends one tree ('/' if none is set)."""
+    if len(route.paths) > 1:
+        raise routes.ConfigError(f"route {route.name!r}: sync.py sends a single path, not {len(route.paths)}")
+
+
+def route_target(route):
+    """The Target of a routes file route; --local-root must be the local directory of its source path."""
+    (src, dst), = route.paths or [(source_path, destination_path)]
+    return Target(route.source, route.destination, src, dst, route.label, route.options, route.filter_rules,
+                  route.concurrency, f"sync:{route.destination}")
+
+
+def included(compiled_rules, path):
+    """Whether ``path``, relative to the source path, gets past the filter rules, as Globus applies them."""
+    *dirs, name = path.split("/")
+    return (all(planner.included(compiled_rules, part, True) for part in dirs)
+            and planner.included(compiled_rules, name, False))
+
+
+def full_sync(transfer_client, index, jrnl, target=DEFAULT_TARGET):
+    # A resumed full sync was submitted by an earlier process; only what
+    # existed when that run started is known to have been sent.
+    started = jrnl.run_started(target.run_key) or time.time()
+
+    def submit():
+        options = dict(
+            sync_level="checksum",  # Use "checksum" for data validation
+            verify_checksum=True,
+            fail_on_quota_errors=True,
+        )
+        options.update(target.options)
+        transfer_data = globus_sdk.TransferData(
+            transfer_client,
+            target.source,
+            target.destination,
+            label=target.label,
+            **options,
+        )
+        transfer_data.add_item(target.source_path, target.destination_path)
+        for rule in target.filter_rules:
+            transfer_data.add_filter_rule(**rule)
+        return globus_client.submit_transfer(transfer_client, transfer_data)
+
+    print("Starting full checksum sync...")
+    transfer_id, done = journal.resume_or_submit(jrnl, target.run_key, "full", submit, item_count=1)
+    ok = done or wait_transfer(transfer_client, transfer_id, jrnl, target.run_key)
+    listing_cache.invalidate_paths(target.destination, [target.destination_path])
+    if not ok:
+        return False
+    index.rebuild(started)
+    return True
+
+
+def changed_sync(transfer_client, index, hash_changed=False, jrnl=None, top="", run_key=None,
+                 target=DEFAULT_TARGET):
+    run_key = run_key or target.run_key
+    with profiling.phase("scan"):
+        changed = list(index.scan(hash_changed=hash_changed, top=top))
+    if target.filter_rules:
+        # Files are sent one by one, so the rules are applied here, not by Globus.
+        rules = planner.compile_rules(target.filter_rules)
+        changed = [record for record in changed if included(rules, record.path)]
+    if not changed:
+        print("No new or modified files; nothing to transfer.")
+        return True
+    # A fixed order gives the same batches, and so the same journal entries,
+    # when an interrupted run is repeated.
+    changed.sort(key=lambda record: record.path)
+
+    # Size and mtime go into the journal fingerprint, so a file rewritten
+    # after an interrupted run is sent again rather than skipped.
+    items = (
+        (posixpath.join(target.source_path, record.path), posixpath.join(target.destination_path, record.path),
+         None, record.size, record.mtime_ns)
+        for record in changed
+    )
 
-while True:
-    task = transfer_client.get_task(transfer_id)
-    status = task['status']
-    
-    if status == 'SUCCEEDED':
+    total = sum(record.size for record in changed)
+    print(f"Starting transfer of {len(changed)} new or modified files ({total / 1e9:.2f} GB)...")
+    options = dict(verify_checksum=True, fail_on_quota_errors=True)
+    options.update(target.options)
+    job = batching.submit_batches(
+        transfer_client,
+        target.source,
+        target.destination,
+        items,
+        concurrency=target.concurrency,
+        label=target.label,
+        journal=jrnl,
+        run_key=run_key,
+        **options,
+    )
+    tasks = job.wait(transfer_client, on_update=report_status)
+    ok = job.succeeded(tasks)
+    if ok:
         print(f"Transfer completed successfully.")
-        break
-    elif status == 'FAILED':
+    else:
         print(f"Transfer failed. Check Globus dashboard for details.")
-        break
-    
-    print(f"Transfer status: {status}. Waiting 5 seconds...")
-    time.sleep(5)
+    # Each changed directory's ancestors are dropped too: a new session's
+    # directories are missing from their cached listings.
+    changed_dirs = {posixpath.dirname(posixpath.join(target.destination_path, r.path)) for r in changed}
+    listing_cache.invalidate_paths(target.destination, changed_dirs, recursive=False)
+    if not ok:
+        return False
+    index.commit(changed)
+    return True
 
-# Set the source and destination transfers, and build filters to
-# eliminate the deletion file. Transfer all zips in the working scratch dir
-# and ignore the MANIFESTS directory, otherwise it'll be placed into
-# the DATA directory.
 
-# task_data.add_item(
-#    f"./{args.DATA_LOCATION}/{args.TODAY}/",  # Source
-#    f"./{args.DATA_LOCATION}/DATA/",  # Dest
-#    recursive=True
-#)
+def report_status(task_id, task):
+    print(f"Transfer {task_id} status: {task_waiter.task_state(task)}")
 
 
-# Rules set following directions at 
-# https://docs.globus.org/api/transfer/task_submit/#filter_rules
+def wait_transfer(transfer_client, transfer_id, jrnl, run_key=RUN_KEY):
+    if transfer_id is None:
+        return False
+    print(f"Transfer started with task ID: {transfer_id}")
 
-
-# task_data.add_filter_rule(name="*", method="include", type="dir")
-# task_data.add_filter_rule(name="MANIFESTS", method="exclude", type="dir")
-# task_data.add_filter_rule(name=f"eligible_for_deletion_{args.TODAY}.txt", method="exclude", type="file")
- 
-
-# Now all the MANIFESTS directory back and transfer it to its own location
-
-# task_data.add_item(
-#    f"./{args.DATA_LOCATION}/{args.TODAY}/MANIFESTS/",  # Source
-#    f"./{args.DATA_LOCATION}/MANIFESTS/",  # Dest
-#    recursive=True
-#)
-
-task_data.add_filter_rule(name="*.txt", method="include", type="file")
-
-
-def do_submit(client):
-    task_doc = client.submit_transfer(task_data)
-    task_id = task_doc["task_id"]
-    print(f"submitted transfer, task_id={task_id}")
-
-
-try:
-    do_submit(transfer_client)
-except globus_sdk.TransferAPIError as err:
-    if not err.info.consent_required:
-        raise
-    print(
-        "Encountered a ConsentRequired error.\n"
-        "You must login a second time to grant consents.\n\n"
-    )
-#
+    task = task_waiter.wait_for_task(transfer_client, transfer_id)
+    jrnl.task_finished(run_key, transfer_id, task['status'])
+    if task['status'] == 'SUCCEEDED':
+        print(f"Transfer completed successfully.")
+        return True
+    print(f"Transfer failed. Check Globus dashboard for details.")
+    return False
+
+
+def watch_sync(transfer_client, index, jrnl, args, target=DEFAULT_TARGET):
+    """
+    Sync each session on its own once it has been quiet for --quiet-seconds,
+    and the whole tree when the periodic full sync falls due, until
+    interrupted. A sync that fails or raises is logged and tried again after
+    another quiet period, so one bad session or API outage does not stop the
+    watch.
+    """
+    watcher = watch.make_watcher(args.local_root, args.session_depth, args.poll_interval, not args.no_inotify)
+    debouncer = watch.Debouncer(args.quiet_seconds)
+    print(f"Watching {args.local_root} for new sessions...")
+
+    def attempt(what, run_key, sync_func):
+        try:
+            return run(jrnl, run_key, sync_func)
+        except Exception as err:
+            print(f"Sync of {what} failed: {err!r}; will retry", file=sys.stderr)
+            return False
+
+    full_retry_at = 0.0
+    try:
+        while True:
+            if time.monotonic() >= full_retry_at and index.full_sync_due(args.full_every_days):
+                print("A full sync is due")
+                if not attempt("the whole tree", target.run_key,
+                               lambda: full_sync(transfer_client, index, jrnl, target)):
+                    full_retry_at = time.monotonic() + FULL_SYNC_RETRY_SECONDS
+            due = debouncer.next_due()
+            changed = watcher.changes(args.poll_interval if due is None else min(due, args.poll_interval))
+            if changed is watch.LOST_TRACK:
+                print("Lost track of changes; scanning the whole tree")
+                attempt("the whole tree", target.run_key,
+                        lambda: changed_sync(transfer_client, index, args.hash, jrnl, target=target))
+                continue
+            for path in changed:
+                session = watch.session_of(path, args.session_depth)
+                if session is not None:
+                    debouncer.touch(session)
+            for session in debouncer.ready():
+                print(f"Session {session} is complete; sending it")
+                run_key = f"{target.run_key}:{session}"
+                ok = attempt(session, run_key, lambda: changed_sync(
+                    transfer_client, index, args.hash, jrnl, top=session, run_key=run_key, target=target
+                ))
+                if not ok:
+                    # Try again after another quiet period.
+                    debouncer.touch(session)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        watcher.close()
+
+
+@contextlib.contextmanager
+def exclusive_lock(lock_file):
+    """
+    Hold an exclusive lock on ``lock_file`` for the duration, so a watching
+    sync.py and one started from cron never share the index and journal at
+    once. Yields False, without waiting, if another process holds it.
+    """
+    with open(lock_file, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def run(jrnl, run_key, sync_func):
+    """Run ``sync_func()`` as the journaled run ``run_key`` and return whether it succeeded."""
+    if jrnl.start_run(run_key):
+        print("Resuming the interrupted previous run")
+    ok = sync_func()
+    jrnl.finish_run(run_key, journal.SUCCEEDED if ok else journal.FAILED)
+    return ok
+
+
+def run_sync(args, target=DEFAULT_TARGET, client_id=CLIENT_ID, token_file=TOKEN_FILE):
+    """The usual run, then --watch if asked for. Returns whether the usual run succeeded."""
+    transfer_client = globus_client.get_transfer_client(client_id, token_file)
+
+    with change_index.ChangeIndex(args.index, args.local_root) as index, journal.Journal(args.journal) as jrnl:
+        if args.full or index.full_sync_due(args.full_every_days):
+            ok = run(jrnl, target.run_key, lambda: full_sync(transfer_client, index, jrnl, target))
+        else:
+            ok = run(jrnl, target.run_key, lambda: changed_sync(
+                transfer_client, index, hash_changed=args.hash, jrnl=jrnl, target=target
+            ))
+        if args.watch:
+            # The run above catches up on whatever changed while not watching.
+            watch_sync(transfer_client, index, jrnl, args, target)
+    return ok
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics.configure(args.metrics_log, args.metrics_prom, script="sync")
+    profiling.configure(args.profile, args.profile_cprofile, args.profile_sample)
+    config, route = routes.configured_route(args, check=check_route)
+    target, client_id, token_file = DEFAULT_TARGET, CLIENT_ID, TOKEN_FILE
+    if route is not None:
+        target, client_id, token_file = route_target(route), config.client_id, config.token_file
+
+    with exclusive_lock(args.lock_file) as locked:
+        if not locked:
+            print(f"Another sync.py holds {args.lock_file}; not starting a second one.")
+            return
+        ok = run_sync(args, target, client_id, token_file)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+# Adaptive waiter for Globus transfer tasks.
+#
+# Instead of calling get_task every 5 seconds, each task is polled on its own
+# schedule: the first polls come quickly so short transfers are noticed right
+# away, then the interval backs off exponentially (with jitter) up to a cap so
+# long MRI transfers make only a handful of calls per hour. Any status change
+# resets the interval. Every task being waited on shares a single scheduling
+# loop, and a rate-limit response from the API pushes all of them back.
+# Each poll and each finished task is passed to metrics.recorder.
+#
+
+import datetime
+import heapq
+import random
+import time
+
+import globus_sdk
+
+import metrics
+import profiling
+
+TERMINAL_STATUSES = ("SUCCEEDED", "FAILED")
+
+DEFAULT_MIN_INTERVAL = 1.0
+DEFAULT_MAX_INTERVAL = 120.0
+DEFAULT_BACKOFF = 2.0
+DEFAULT_JITTER = 0.2
+
+# Used when a 429 arrives without a usable Retry-After header.
+DEFAULT_RATE_LIMIT_DELAY = 30.0
+
+
+def _parse_deadline(value):
+    if not value:
+        return None
+    try:
+        deadline = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=datetime.timezone.utc)
+    return deadline.timestamp()
+
+
+def _retry_after(err):
+    try:
+        return max(float(err.headers.get("Retry-After")), 0.0)
+    except (TypeError, ValueError):
+        return DEFAULT_RATE_LIMIT_DELAY
+
+
+def task_state(task):
+    """
+    Return a short state name for a task document: the task status, except
+    that a paused ACTIVE task is reported as PAUSED.
+    """
+    status = task["status"]
+    if status == "ACTIVE" and task.get("is_paused"):
+        return "PAUSED"
+    return status
+
+
+class TaskWaiter:
+    """
+    Wait on any number of transfer tasks from a single loop.
+
+    ``min_interval`` is the first poll delay, which is multiplied by
+    ``backoff`` after every unchanged poll up to ``max_interval``. A random
+    fraction (``jitter``) is added to each delay so many waiters started at the
+    same time do not poll in lockstep.
+    """
+
+    def __init__(self, transfer_client, min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL, backoff=DEFAULT_BACKOFF,
+                 jitter=DEFAULT_JITTER, clock=time.time, sleep=time.sleep):
+        self.transfer_client = transfer_client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.clock = clock
+        self.sleep = sleep
+        self.api_calls = 0
+
+    def _delay(self, interval):
+        return interval * (1 + random.uniform(0, self.jitter))
+
+    @profiling.timed("wait")
+    def wait(self, task_ids, timeout=None, on_update=None, stop_on_inactive=False):
+        """
+        Poll until every task in ``task_ids`` is SUCCEEDED or FAILED, and return
+        a dict of task_id to its last task document.
+
+        ``on_update(task_id, task)`` is called whenever a task's state changes.
+        If ``stop_on_inactive`` is set, a task that goes INACTIVE (for example
+        because its credentials expired) is returned instead of waited on.
+        Tasks still running when ``timeout`` seconds have passed are returned
+        with their last known document, or None if never fetched.
+        """
+        now = self.clock()
+        give_up_at = now + timeout if timeout is not None else None
+
+        results = {}
+        states = {}
+        intervals = {}
+        deadlines = {}
+        schedule = []
+        for task_id in task_ids:
+            if task_id in intervals:
+                continue
+            results[task_id] = None
+            intervals[task_id] = self.min_interval
+            heapq.heappush(schedule, (now, task_id))
+
+        while schedule:
+            due, task_id = heapq.heappop(schedule)
+            now = self.clock()
+            if give_up_at is not None and due > give_up_at:
+                break
+            if due > now:
+                self.sleep(due - now)
+
+            try:
+                self.api_calls += 1
+                task = self.transfer_client.get_task(task_id)
+            except globus_sdk.GlobusAPIError as err:
+                if err.http_status == 429:
+                    # Rate limited: hold every task back, not just this one.
+                    resume = self.clock() + _retry_after(err)
+                    schedule = [(max(t, resume), tid) for t, tid in schedule]
+                    heapq.heapify(schedule)
+                    heapq.heappush(schedule, (resume, task_id))
+                    continue
+                if err.http_status >= 500:
+                    intervals[task_id] = min(intervals[task_id] * self.backoff, self.max_interval)
+                    heapq.heappush(schedule, (self.clock() + self._delay(intervals[task_id]), task_id))
+                    continue
+                raise
+            except globus_sdk.NetworkError:
+                intervals[task_id] = min(intervals[task_id] * self.backoff, self.max_interval)
+                heapq.heappush(schedule, (self.clock() + self._delay(intervals[task_id]), task_id))
+                continue
+
+            results[task_id] = task
+            metrics.recorder.observe(task_id, task, self.clock())
+            state = task_state(task)
+            if state != states.get(task_id):
+                states[task_id] = state
+                intervals[task_id] = self.min_interval
+                deadlines[task_id] = _parse_deadline(task.get("deadline"))
+                if on_update is not None:
+                    on_update(task_id, task)
+            else:
+                intervals[task_id] = min(intervals[task_id] * self.backoff, self.max_interval)
+
+            if state in TERMINAL_STATUSES:
+                metrics.recorder.finished(task_id, task)
+                continue
+            if state == "INACTIVE" and stop_on_inactive:
+                continue
+
+            next_poll = self.clock() + self._delay(intervals[task_id])
+            deadline = deadlines.get(task_id)
+            if deadline is not None and self.clock() < deadline < next_poll:
+                # The service fails the task at its deadline; look again just
+                # after that rather than sleeping through it.
+                next_poll = deadline + self.min_interval
+            heapq.heappush(schedule, (next_poll, task_id))
+
+        return results
+
+
+def wait_for_task(transfer_client, task_id, **kwargs):
+    """Wait for a single task, printing status changes, and return its document."""
+    def report(task_id, task):
+        print(f"Transfer {task_id} status: {task_state(task)}")
+
+    kwargs.setdefault("on_update", report)
+    return TaskWaiter(transfer_client).wait([task_id], **kwargs)[task_id]
@@ -0,0 +1,9 @@
+# The scripts import each other as top-level modules, and the tests use the
+# local Globus stand-in from fixtures/, as benchmark.py does.
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "fixtures"))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
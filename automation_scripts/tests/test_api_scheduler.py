@@ -0,0 +1,153 @@
+# Token buckets, the circuit breaker and retries of api_scheduler.
+
+import globus_sdk
+import pytest
+
+import api_scheduler
+import fake_transfer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class APIError(globus_sdk.GlobusAPIError):
+    """A GlobusAPIError without an HTTP response behind it."""
+
+    headers = {}
+
+    def __init__(self, http_status, code=None):
+        Exception.__init__(self, http_status, code)
+        self._http_status = http_status
+        self._code = code
+
+    http_status = property(lambda self: self._http_status)
+    code = property(lambda self: self._code)
+
+
+def scheduler(**kwargs):
+    return api_scheduler.APIScheduler(
+        buckets=api_scheduler.TokenBuckets(":memory:"), backoff_base=0, backoff_max=0, **kwargs
+    )
+
+
+def test_bucket_allows_a_burst_then_spaces_calls():
+    buckets = api_scheduler.TokenBuckets(":memory:", budgets={"submit": (2.0, 3)})
+    assert [buckets.reserve("submit") for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Each further call owes another half second at 2 per second.
+    waits = [buckets.reserve("submit") for _ in range(2)]
+    assert 0.4 < waits[0] <= 0.5 and 0.9 < waits[1] <= 1.0
+
+
+def test_buckets_are_shared_through_the_database(tmp_path):
+    db_path = str(tmp_path / "budget.sqlite")
+    first = api_scheduler.TokenBuckets(db_path, budgets={"ls": (1.0, 2)})
+    second = api_scheduler.TokenBuckets(db_path, budgets={"ls": (1.0, 2)})
+    assert first.reserve("ls") == 0.0
+    assert second.reserve("ls") == 0.0
+    assert first.reserve("ls") > 0.9
+
+
+def test_breaker_opens_probes_and_closes():
+    clock = Clock()
+    breaker = api_scheduler.CircuitBreaker(failures=3, cooldown=10, max_cooldown=40, clock=clock)
+    for _ in range(3):
+        assert breaker.before_call() is False
+        breaker.record(False)
+    assert breaker.state == "open"
+
+    clock.now = 10
+    assert breaker.state == "half-open"
+    assert breaker.before_call() is True
+    # A failed probe reopens the breaker for twice as long.
+    breaker.record(False, probe=True)
+    assert breaker.state == "open" and breaker.open_until == 30
+
+    clock.now = 30
+    assert breaker.before_call() is True
+    breaker.record(True, probe=True)
+    assert breaker.state == "closed" and breaker.cooldown == 10
+    assert breaker.before_call() is False
+
+
+def test_breaker_ignores_failures_separated_by_a_success():
+    breaker = api_scheduler.CircuitBreaker(failures=2, clock=Clock())
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == "closed"
+
+
+@pytest.mark.parametrize("err, retryable", [
+    (APIError(429), True),
+    (APIError(500), True),
+    (APIError(503), True),
+    (APIError(501), False),
+    (APIError(502, "ExternalError.DirListingFailed"), False),
+    (APIError(503, "EndpointError"), False),
+    (APIError(404, "ClientError.NotFound"), False),
+    (globus_sdk.NetworkError("reset", Exception()), True),
+])
+def test_is_retryable(err, retryable):
+    assert api_scheduler.is_retryable(err) is retryable
+
+
+def test_transient_errors_are_retried():
+    outcomes = [APIError(503), APIError(429), "ok"]
+
+    def call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    s = scheduler()
+    assert s.call("other", call) == "ok"
+    assert s.retries["other"] == 2
+
+
+def test_other_errors_are_not_retried():
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise APIError(502, "EndpointError")
+
+    with pytest.raises(APIError):
+        scheduler().call("other", call)
+    assert len(calls) == 1
+
+
+def test_retries_stop_when_the_budget_runs_out():
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise APIError(503)
+
+    s = scheduler(retry_budget=api_scheduler.RetryBudget(ratio=0, minimum=2), max_attempts=10)
+    with pytest.raises(APIError):
+        s.call("other", call)
+    assert len(calls) == 3
+
+
+def test_task_polls_are_left_to_the_waiter():
+    assert api_scheduler.is_task_poll("GET", "/task/abc")
+    assert not api_scheduler.is_task_poll("GET", "task/abc/successful_transfers")
+
+    tc = fake_transfer.FakeTransferClient(fake_transfer.SyntheticTree(10))
+    calls = []
+
+    def get_task(task_id):
+        calls.append(task_id)
+        raise APIError(503)
+
+    tc.get_task = get_task
+    api_scheduler.install(tc, scheduler())
+    with pytest.raises(APIError):
+        tc.get_task("t")
+    assert calls == ["t"]
@@ -0,0 +1,122 @@
+# Journal resume behaviour, directly and through batching against the stand-in.
+
+import time
+
+import pytest
+
+import batching
+import change_index
+import fake_transfer
+import journal
+import listing_cache
+import sync
+import task_waiter
+
+
+def fake_client():
+    return fake_transfer.FakeTransferClient(fake_transfer.SyntheticTree(100), task_seconds=0.0)
+
+
+def test_fingerprint_of_plain_paths_is_unchanged_by_empty_versions():
+    assert journal.fingerprint(["/a", "/b"]) == journal.fingerprint([("/a",), ("/b",)])
+
+
+def test_fingerprint_changes_with_version():
+    assert journal.fingerprint([("/a", 10, 1)]) != journal.fingerprint([("/a", 10, 2)])
+    assert journal.fingerprint([("/a", 10, 1)]) != journal.fingerprint([("/a", 11, 1)])
+    assert journal.fingerprint(["/a", "/b"]) != journal.fingerprint(["/b", "/a"])
+
+
+def test_start_run_resumes_until_finished(tmp_path):
+    with journal.Journal(str(tmp_path / "j.sqlite")) as jrnl:
+        assert jrnl.start_run("k") is False
+        assert jrnl.start_run("k") is True
+        jrnl.finish_run("k", journal.FAILED)
+        assert jrnl.start_run("k") is True
+        jrnl.finish_run("k")
+        assert jrnl.start_run("k") is False
+
+
+def test_resume_or_submit(tmp_path):
+    submitted = []
+
+    def submit():
+        submitted.append(len(submitted))
+        return f"task-{len(submitted)}"
+
+    with journal.Journal(str(tmp_path / "j.sqlite")) as jrnl:
+        jrnl.start_run("k")
+        assert journal.resume_or_submit(jrnl, "k", "fp", submit) == ("task-1", False)
+        # Submitted but not finished: reattach rather than send again.
+        assert journal.resume_or_submit(jrnl, "k", "fp", submit) == ("task-1", False)
+        jrnl.task_finished("k", "task-1", journal.SUCCEEDED)
+        assert journal.resume_or_submit(jrnl, "k", "fp", submit) == (None, True)
+        jrnl.task_finished("k", "task-1", journal.FAILED)
+        assert journal.resume_or_submit(jrnl, "k", "fp", submit) == ("task-2", False)
+        # A new run starts afresh.
+        jrnl.finish_run("k")
+        jrnl.start_run("k")
+        assert journal.resume_or_submit(jrnl, "k", "fp", submit) == ("task-3", False)
+    assert len(submitted) == 3
+
+
+def _items(versions):
+    return [(f"/src/f{i}", f"/dst/f{i}", None, size, 0) for i, size in enumerate(versions)]
+
+
+def test_resumed_batches_are_skipped_unless_their_files_changed(tmp_path):
+    tc = fake_client()
+    with journal.Journal(str(tmp_path / "j.sqlite")) as jrnl:
+        jrnl.start_run("k")
+        job = batching.submit_batches(tc, "a", "b", _items([1, 2, 3, 4]), max_items=2, journal=jrnl, run_key="k")
+        tasks = job.wait(tc)
+        assert job.succeeded(tasks) and len(job.task_ids) == 2
+
+        # The run is still open: the same batches are not sent again.
+        again = batching.submit_batches(tc, "a", "b", _items([1, 2, 3, 4]), max_items=2, journal=jrnl, run_key="k")
+        assert sorted(again.skipped) == [1, 2] and again.task_ids == []
+
+        # A file of the second batch changed size since: only that batch is sent.
+        changed = batching.submit_batches(tc, "a", "b", _items([1, 2, 3, 5]), max_items=2, journal=jrnl, run_key="k")
+        assert changed.skipped == [1] and len(changed.task_ids) == 1
+    assert tc.calls["submit_transfer"] == 3
+
+
+def test_unexpected_errors_fail_the_job():
+    class BrokenJournal:
+        def lookup(self, *args):
+            raise KeyError("broken")
+
+    job = batching.submit_batches(fake_client(), "a", "b", _items([1]), journal=BrokenJournal(), run_key="k")
+    assert [number for number, _ in job.errors] == [1]
+    assert not job.succeeded({})
+
+
+def test_resumed_full_sync_does_not_index_files_written_since_submission(tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    root.mkdir()
+    (root / "old").write_text("x")
+    monkeypatch.setattr(listing_cache, "invalidate_paths", lambda *args, **kwargs: None)
+    tc = fake_client()
+
+    class Interrupted(BaseException):
+        pass
+
+    def interrupted_wait(*args, **kwargs):
+        raise Interrupted
+
+    with change_index.ChangeIndex(str(tmp_path / "i.sqlite"), str(root)) as index, \
+            journal.Journal(str(tmp_path / "j.sqlite")) as jrnl:
+        with monkeypatch.context() as patch:
+            patch.setattr(task_waiter, "wait_for_task", interrupted_wait)
+            with pytest.raises(Interrupted):
+                sync.run(jrnl, sync.RUN_KEY, lambda: sync.full_sync(tc, index, jrnl))
+
+        # Written after the first process submitted the sync, before the resume.
+        time.sleep(0.01)
+        (root / "new").write_text("y")
+        time.sleep(0.01)
+
+        assert sync.run(jrnl, sync.RUN_KEY, lambda: sync.full_sync(tc, index, jrnl))
+        assert tc.calls["submit_transfer"] == 1
+        assert [record.path for record in index.scan()] == ["new"]
@@ -0,0 +1,86 @@
+# Filter rule matching and walking in planner.
+
+import listing_cache
+import planner
+import transfer_to_archive
+
+
+def rules(*specs):
+    return [planner.parse_rule(spec) for spec in specs]
+
+
+def test_first_matching_rule_decides():
+    compiled = planner.compile_rules(rules("include:file:*.zip", "exclude:file:*"))
+    assert planner.included(compiled, "a.zip", False)
+    assert not planner.included(compiled, "a.txt", False)
+    # No rule of the entry's type matches: included.
+    assert planner.included(compiled, "a.txt", True)
+
+
+def test_typed_rules_match_only_their_type():
+    compiled = planner.compile_rules(rules("exclude:dir:MANIFESTS"))
+    assert not planner.included(compiled, "MANIFESTS", True)
+    assert planner.included(compiled, "MANIFESTS", False)
+
+
+def test_typeless_rules_match_files_and_directories():
+    compiled = planner.compile_rules([{"name": "tmp*", "method": "exclude"}])
+    assert not planner.included(compiled, "tmp", True)
+    assert not planner.included(compiled, "tmp.1", False)
+    assert planner.included(compiled, "data", True)
+    assert rules("exclude:any:tmp*") == [{"name": "tmp*", "method": "exclude"}]
+
+
+def test_archive_rules():
+    compiled = planner.compile_rules(transfer_to_archive.archive_filter_rules("20241018"))
+    assert planner.included(compiled, "b1.zip", False)
+    assert planner.included(compiled, "notes.txt", False)
+    assert not planner.included(compiled, "eligible_for_deletion_20241018.txt", False)
+    assert not planner.included(compiled, "MANIFESTS", True)
+
+
+def test_local_walk_counts_and_skips_excluded_directories(tmp_path):
+    (tmp_path / "s1" / "MANIFESTS").mkdir(parents=True)
+    (tmp_path / "s1" / "a.dcm").write_bytes(b"x" * 2048)
+    (tmp_path / "s1" / "b.tmp").write_bytes(b"x" * 10)
+    (tmp_path / "s1" / "MANIFESTS" / "m.txt").write_bytes(b"x" * 5)
+    (tmp_path / "top.dcm").write_bytes(b"x" * 100)
+
+    totals = planner.plan_local([str(tmp_path)], rules("exclude:dir:MANIFESTS", "exclude:file:*.tmp"), workers=3)
+    assert (totals.files, totals.bytes, totals.dirs) == (2, 2148, 2)
+    assert (totals.excluded_files, totals.excluded_bytes, totals.excluded_dirs) == (1, 10, 1)
+    assert totals.largest == 2048 and totals.complete
+    assert totals.as_dict()["histogram"] == {"< 1 KiB": 1, "2 KiB - 4 KiB": 1}
+
+
+def test_listing_walk_reports_missing_and_failed_directories():
+    listings = {
+        "/lab": [{"name": "s1", "type": "dir"}, {"name": "s2", "type": "dir"}, {"name": "s3", "type": "dir"},
+                 {"name": "f", "type": "file", "size": 7}],
+        "/lab/s1": [{"name": "g", "type": "file", "size": 5}],
+    }
+
+    def lister(path):
+        if path == "/lab/s3":
+            raise RuntimeError("connection reset")
+        return listings.get(path)
+
+    totals = planner.plan_listing(lister, ["/lab", "/lab/f"], workers=4)
+    assert (totals.files, totals.bytes) == (3, 19)
+    assert (totals.unlisted_dirs, totals.errors) == (1, 1)
+    assert not totals.complete
+
+
+def test_invalidating_a_new_directory_drops_its_ancestors_listings(tmp_path):
+    def entry(name, kind, size=0):
+        return {"name": name, "type": kind, "size": size}
+
+    with listing_cache.ListingCache(str(tmp_path / "cache.sqlite")) as cache:
+        cache.put("c", "/", [entry("lab", "dir")])
+        cache.put("c", "/lab", [entry("s1", "dir")])
+        cache.put("c", "/lab/s1", [entry("a", "file", 5)])
+        # A transfer wrote the new session /lab/s2/series.
+        cache.invalidate("c", "/lab/s2/series", recursive=False)
+        assert cache.get("c", "/lab/s1") is not None
+        totals = planner.plan_listing(planner.cache_lister(cache, "c"), ["/"], workers=2)
+    assert not totals.complete
@@ -0,0 +1,107 @@
+# The quiet-period trigger and change detection used by sync.py --watch.
+
+import os
+import types
+
+import change_index
+import journal
+import sync
+import watch
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_session_of():
+    assert watch.session_of("lab/s1/series/f.dcm") == "lab/s1"
+    assert watch.session_of("lab/s1") == "lab/s1"
+    assert watch.session_of("lab") is None
+    assert watch.session_of("a/b/c", depth=3) == "a/b/c"
+
+
+def test_session_is_ready_only_after_quiet_period():
+    clock = Clock()
+    debouncer = watch.Debouncer(quiet_seconds=300, clock=clock)
+    assert debouncer.next_due() is None
+    debouncer.touch("lab/s1")
+    clock.now += 299
+    assert debouncer.ready() == []
+    assert debouncer.next_due() == 1
+    clock.now += 1
+    assert debouncer.ready() == ["lab/s1"]
+    assert debouncer.ready() == [] and debouncer.next_due() is None
+
+
+def test_new_changes_restart_the_quiet_period():
+    clock = Clock()
+    debouncer = watch.Debouncer(quiet_seconds=300, clock=clock)
+    debouncer.touch("lab/s1")
+    clock.now += 200
+    debouncer.touch("lab/s2")
+    clock.now += 10
+    debouncer.touch("lab/s1")
+    clock.now += 200
+    assert debouncer.ready() == []
+    clock.now += 90
+    assert debouncer.ready() == ["lab/s2"]
+    clock.now += 10
+    assert debouncer.ready() == ["lab/s1"]
+
+
+def test_polling_watcher_reports_changed_sessions(tmp_path):
+    (tmp_path / "lab" / "s1").mkdir(parents=True)
+    (tmp_path / "lab" / "s2").mkdir()
+    (tmp_path / "lab" / "s1" / "a").write_text("x")
+    watcher = watch.PollingWatcher(str(tmp_path), interval=0)
+    assert watcher.changes(0) == set()
+    (tmp_path / "lab" / "s2" / "b").write_text("y")
+    (tmp_path / "lab" / "s3").mkdir()
+    assert watcher.changes(0) == {"lab/s2", "lab/s3"}
+    (tmp_path / "lab" / "s1" / "a").write_text("longer")
+    assert watcher.changes(0) == {"lab/s1"}
+
+
+def test_watch_survives_a_failed_sync_and_retries_the_session(tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    (root / "lab" / "s1").mkdir(parents=True)
+    attempts = []
+
+    class Stop(BaseException):
+        pass
+
+    def changed_sync(transfer_client, index, hash_changed=False, jrnl=None, top="", run_key=None,
+                     target=sync.DEFAULT_TARGET):
+        attempts.append(top)
+        if len(attempts) == 1:
+            raise OSError("scratch went away")
+        raise Stop
+
+    watcher = watch.PollingWatcher(str(root), interval=0)
+    (root / "lab" / "s1" / "f").write_text("x")
+    monkeypatch.setattr(sync, "changed_sync", changed_sync)
+    monkeypatch.setattr(watch, "make_watcher", lambda *args: watcher)
+    args = types.SimpleNamespace(local_root=str(root), session_depth=2, poll_interval=0.01, no_inotify=True,
+                                 quiet_seconds=0, hash=False, full_every_days=7)
+    with change_index.ChangeIndex(str(tmp_path / "i.sqlite"), str(root)) as index, \
+            journal.Journal(str(tmp_path / "j.sqlite")) as jrnl:
+        index.set_meta("last_full_sync", 1e12)
+        try:
+            sync.watch_sync(None, index, jrnl, args)
+        except Stop:
+            pass
+    assert attempts == ["lab/s1", "lab/s1"]
+
+
+def test_only_one_sync_holds_the_lock(tmp_path):
+    lock_file = str(tmp_path / "sync.lock")
+    with sync.exclusive_lock(lock_file) as first:
+        with sync.exclusive_lock(lock_file) as second:
+            assert first and not second
+    with sync.exclusive_lock(lock_file) as again:
+        assert again
+    assert os.path.exists(lock_file)
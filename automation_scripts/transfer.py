@@ -1,45 +1,34 @@
 #!/usr/bin/env python
 
-# This script will list the contents of a user-defined Globus Guest Collection,
-# using Globus and persistent authentication using a refresh token. 
+# This script will transfer the contents of a user-defined Globus Guest Collection,
+# using Globus and persistent authentication using a refresh token.
 #
 # This makes use of the Globus-hosted native app "MRI_2_RC_Test_App".
-# 
+#
 # The first time this app is run, it will open a web browser for initial authentication,
-# after which a token file will be saved in the $CWD. Tokens can be 
-# recinded by deleting the file or going to 
-# https://app.globus.org/settings/consents, referencing the consent, and
-# then deleting it.
+# after which a token file will be saved. Authentication is handled by
+# globus_client.py; see there for how to recind the tokens.
 #
 # Written by Lindsay Wells adapted from J. Nucciarone and Globus support
 # January 23, 2025.
 #
 # Version 1.0
 #
-import os
-
-import time
-
 import argparse
+import sys
 
-import webbrowser
+import globus_client
+import listing_cache
+import metrics
+import orchestrator
+import profiling
+import routes
 
-import globus_sdk
-from globus_sdk import GroupsClient, NativeAppAuthClient, RefreshTokenAuthorizer
-from globus_sdk.tokenstorage import SimpleJSONFileAdapter
-from globus_sdk.scopes import TransferScopes
-
-# Obtain command line args that contain the location and date info
-# parser = argparse.ArgumentParser()
-# parser.add_argument("DATA_LOCATION")
-# parser.add_argument("TODAY")
-# args = parser.parse_args()
- 
 # Set source and destination endpoint UUID
 # Source is the Guest Collection "MRI_Converge_Guest_Collection"
 # This guest collection corrsponds to directory /storage/long/ on converge.mri.psu.edu
 
-source_collection_id = "095bd11b-e263-44dc-ad19-6dd4b463207e" 
+source_collection_id = "095bd11b-e263-44dc-ad19-6dd4b463207e"
 
 # Destination is the Guest Collection "MRI_Data_Transfer_Guest_Collection"
 # This guest collection corresponds to directory /storage/group/MCL/default/globus-share/
@@ -52,145 +41,89 @@ dest_collection_id = "eef905af-dc3e-4f55-8c87-7b804cfb654f"
 
 CLIENT_ID = "0ba8e7a7-3f08-49bd-adde-61491161882c"
 
-# Set the source and destination paths
-source_path = '/lab396'
-destination_path = '/'
-
-auth_client = NativeAppAuthClient(CLIENT_ID)
-my_file_adapter = SimpleJSONFileAdapter(
-    os.path.expanduser("/root/globus_auth_scripts/my-globus-refresh-token.json")
-)
-
-if not my_file_adapter.file_exists():
-    # requested_scopes specifies a list of scopes to request
-    # instead of the defaults, only request access to the Transfer API
-
-    auth_client.oauth2_start_flow(requested_scopes=TransferScopes.all, refresh_tokens=True)
-    authorize_url = auth_client.oauth2_get_authorize_url()
-     
-    print(f"Native App Authorizaion URL:\n{authorize_url}\n")
-    
-    try:
-        webbrowser.open(authorize_url, new=1)
-    except:
-        print(f"Please go to this URL and login:\n\n{authorize_url}\n")
-
-    auth_code = input("Please enter the code here: ").strip()
-
-    token_response = auth_client.oauth2_exchange_code_for_tokens(auth_code)
-
-    # Store tokens for later
-    my_file_adapter.store(token_response)
-
-    # Use the current transfer tokens
-
-    transfer_tokens = token_response.by_resource_server["transfer.api.globus.org"]
-else:
-    # otherwise, we already did this whole song-and-dance, so just
-    # load the tokens from that file
-    transfer_tokens = my_file_adapter.get_token_data("transfer.api.globus.org")
-
-authorizer = globus_sdk.RefreshTokenAuthorizer(
-    transfer_tokens["refresh_token"],
-    auth_client,
-    access_token=transfer_tokens["access_token"],
-    expires_at=transfer_tokens["expires_at_seconds"],
-    on_refresh=my_file_adapter.on_refresh,
-)
-
-# construct an AccessTokenAuthorizer and use it to construct the
-# TransferClient
-
-transfer_client = globus_sdk.TransferClient(authorizer=authorizer)
-
-# create a Transfer task consisting of one or more items
-task_data = globus_sdk.TransferData(
-    transfer_client,source_endpoint=source_collection_id, destination_endpoint=dest_collection_id
-)
-
-# Create a transfer data object
-transfer_data = globus_sdk.TransferData(
-    transfer_client,
-    source_collection_id,
-    dest_collection_id,
-    label="Transfer from /storage/long to /storage/group/MCL/default/globus-share",
-    sync_level="checksum",  # Use "checksum" for data validation
-)
-
-# Add file paths to the transfer data object
-transfer_data.add_item(source_path, destination_path)
-
-task_data.add_filter_rule(name="*", method="include", type="dir")
-
-# Start the transfer
-print("Starting transfer...")
-transfer_result = transfer_client.submit_transfer(transfer_data)
-
-# Monitor the transfer status
-transfer_id = transfer_result['task_id']
-print(f"Transfer started with task ID: {transfer_id}")
-
-while True:
-    task = transfer_client.get_task(transfer_id)
-    status = task['status']
-    
-    if status == 'SUCCEEDED':
-        print(f"Transfer completed successfully.")
-        break
-    elif status == 'FAILED':
-        print(f"Transfer failed. Check Globus dashboard for details.")
-        break
-    
-    print(f"Transfer status: {status}. Waiting 5 seconds...")
-    time.sleep(5)
-
-
-# Set the source and destination transfers, and build filters to
-# eliminate the deletion file. Transfer all zips in the working scratch dir
-# and ignore the MANIFESTS directory, otherwise it'll be placed into
-# the DATA directory.
-#
-
-# task_data.add_item(
-#    f"./{args.DATA_LOCATION}/{args.TODAY}/",  # Source
-#    f"./{args.DATA_LOCATION}/DATA/",  # Dest
-#    recursive=True
-#)
+TOKEN_FILE = "/root/globus_auth_scripts/my-globus-refresh-token.json"
 
+# Set the source and destination paths. Each source path is copied into
+# destination_path as its own task.
+source_paths = ['/lab396']
+destination_path = '/'
 
-# Rules set following directions at 
-# https://docs.globus.org/api/transfer/task_submit/#filter_rules
-
-
-# task_data.add_filter_rule(name="*", method="include", type="dir")
-# task_data.add_filter_rule(name="MANIFESTS", method="exclude", type="dir")
-# task_data.add_filter_rule(name=f"eligible_for_deletion_{args.TODAY}.txt", method="exclude", type="file")
- 
-
-# Now all the MANIFESTS directory back and transfer it to its own location
-
-# task_data.add_item(
-#    f"./{args.DATA_LOCATION}/{args.TODAY}/MANIFESTS/",  # Source
-#    f"./{args.DATA_LOCATION}/MANIFESTS/",  # Dest
-#    recursive=True
-#)
-
-task_data.add_filter_rule(name="*.txt", method="include", type="file")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source_paths", nargs="*",
+                        help="paths on the source collection to transfer; default the route's paths with "
+                             "--config, else the built-in ones")
+    parser.add_argument("--destination-path", default=destination_path)
+    parser.add_argument("--concurrency", type=int,
+                        help="maximum number of transfer tasks in flight; default the route's with --config, "
+                             f"else {orchestrator.DEFAULT_CONCURRENCY}")
+    parser.add_argument("--retries", type=int,
+                        help=f"default the route's with --config, else {orchestrator.DEFAULT_RETRIES}")
+    routes.add_arguments(parser)
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def build_jobs(paths, destination):
+    """One TransferJob per source path, each copied into ``destination``."""
+    return [
+        orchestrator.TransferJob(
+            source_collection_id,
+            dest_collection_id,
+            path,
+            destination,
+            label=f"Transfer {path} from /storage/long to /storage/group/MCL/default/globus-share",
+            options={"sync_level": "checksum"},  # Use "checksum" for data validation
+        )
+        for path in paths
+    ]
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics.configure(args.metrics_log, args.metrics_prom, script="transfer")
+    profiling.configure(args.profile, args.profile_cprofile, args.profile_sample)
+
+    # Without source paths on the command line a route must have its own.
+    config, route = routes.configured_route(
+        args, check=None if args.source_paths else lambda route: routes.check_paths([route])
+    )
 
-def do_submit(client):
-    task_doc = client.submit_transfer(task_data)
-    task_id = task_doc["task_id"]
-    print(f"submitted transfer, task_id={task_id}")
+    if route is not None:
+        transfer_client = globus_client.get_transfer_client(config.client_id, config.token_file)
+        if args.source_paths:
+            # Paths given on the command line replace the route's; its
+            # collections, label, options and filter rules still apply.
+            route = route._replace(paths=[(path, args.destination_path) for path in args.source_paths])
+        jobs = routes.route_jobs(route)
+        destination_collection = route.destination
+        destinations = [dst for _, dst in route.paths]
+        concurrency, retries = route.concurrency, route.retries
+    else:
+        transfer_client = globus_client.get_transfer_client(CLIENT_ID, TOKEN_FILE)
+        jobs = build_jobs(args.source_paths or source_paths, args.destination_path)
+        destination_collection = dest_collection_id
+        destinations = [args.destination_path]
+        concurrency, retries = orchestrator.DEFAULT_CONCURRENCY, orchestrator.DEFAULT_RETRIES
+    if args.concurrency is not None:
+        concurrency = args.concurrency
+    if args.retries is not None:
+        retries = args.retries
+
+    print(f"Starting {len(jobs)} transfers...")
+    results = orchestrator.Orchestrator(
+        transfer_client, concurrency=concurrency, retries=retries
+    ).run(jobs)
+    listing_cache.invalidate_paths(destination_collection, destinations)
+
+    if all(r.task is not None and r.task['status'] == 'SUCCEEDED' for r in results):
+        print(f"Transfer completed successfully.")
+    else:
+        print(f"Transfer failed. Check Globus dashboard for details.")
+        sys.exit(1)
 
 
-try:
-    do_submit(transfer_client)
-except globus_sdk.TransferAPIError as err:
-    if not err.info.consent_required:
-        raise
-    print(
-        "Encountered a ConsentRequired error.\n"
-        "You must login a second time to grant consents.\n\n"
-    )
-#
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,32 @@
 # This helper script will transfer the zip data and manifest files
 # from the CQI working scratch directory to the appropriate archive
 # directoryusing Globus and persistent authentication using
-# a Globus refresh token. 
+# a Globus refresh token.
 #
 # This makes use of the Globus hosted native app "Archive_Tranfer".
-# 
+#
 # Upon initial run it will open a web browser for initial authentication,
-# after which a token file will be saved in the $CWD. Tokens can be 
-# recinded by deleting the file or going to 
-# https://app.globus.org/settings/consents, referencing the consent, and
-# then deleting it.
+# after which a token file will be saved. Authentication is handled by
+# globus_client.py; see there for how to recind the tokens.
 #
 # It requires two command line arguesments to function:
 #    The $LOCATION variable, that specifies which CQI location src and dest
 #    The $today variable, that specifies the date of the archive run and
-#      location directory 
+#      location directory
+#
+# With --pipeline (and --pack-from), packing and transfer overlap: bundles
+# are sent in waves of --wave-bundles as soon as they are written, while
+# later bundles are still being packed. A wave's MANIFESTS files are sent
+# once its bundles arrive, and eligible_for_deletion_TODAY.txt, listing the
+# packed source files, is only written after every wave has succeeded and
+# the archive listing has been checked.
+#
+# The deletion list is built by reconcile.py from the tasks' successful
+# transfers, so a bundle and the files packed into it are only listed once
+# Globus reports that bundle delivered. Without --pipeline, --reconcile does
+# the same for the single task (and implies --verify). With --delete the
+# files in that list are then removed from scratch by bulk_delete.py, in
+# journaled DeleteData batches on the source collection.
 #
 # Written by J. Nucciarone with assistance from Globus support
 # April 29, 2024.
@@ -24,130 +36,546 @@
 #  Version 1.0
 #
 
-import os
-
 import argparse
-import webbrowser
+import concurrent.futures
+import fnmatch
+import os
+import posixpath
+import sys
 
 import globus_sdk
-from globus_sdk import GroupsClient, NativeAppAuthClient, RefreshTokenAuthorizer
-from globus_sdk.tokenstorage import SimpleJSONFileAdapter
-from globus_sdk.scopes import TransferScopes
 
-# Obtain command line args that contain the location and date info
-parser = argparse.ArgumentParser()
-parser.add_argument("DATA_LOCATION")
-parser.add_argument("TODAY")
-args = parser.parse_args()
+import bulk_delete
+import checksums
+import globus_client
+import journal
+import listing_cache
+import metrics
+import profiling
+import packing
+import reconcile
+import routes
+import recursive_ls
+import task_waiter
 
 # Set source and destination endpoint UUID
 # Source is the Guest Collection "CQI Transfer Directory"
-source_collection_id = "a7b0d0fe-f0ef-4186-a96b-fc89ee61679a" 
+source_collection_id = "a7b0d0fe-f0ef-4186-a96b-fc89ee61679a"
 # Destination is the Guest Collection "CQI Archive Transfer"
 dest_collection_id = "e3a52e0a-b824-4d4b-9b04-1dad86e54c07"
 
 # My client ID - "Archive Transfer" native app
 CLIENT_ID = "a619acea-bc58-40c7-ad6a-fd422c75bfd0"
 
-auth_client = NativeAppAuthClient(CLIENT_ID)
-my_file_adapter = SimpleJSONFileAdapter(
-    os.path.expanduser("~/svc-acct-globus-groups-tokens.json")
-)
-
-if not my_file_adapter.file_exists():
-    # requested_scopes specifies a list of scopes to request
-    # instead of the defaults, only request access to the Transfer API
-    auth_client.oauth2_start_flow(requested_scopes=TransferScopes.all, refresh_tokens=True)
-    authorize_url = auth_client.oauth2_get_authorize_url()
-    #print(f"Please go to this URL and login:\n\n{authorize_url}\n")
-    print(f"Native App Authorizaion URL:\n{authorize_url}\n")
-
-    try:
-        webbrowser.open(authorize_url, new=1)
-    except:
-        print(f"Please go to this URL and login:\n\n{authorize_url}\n")
-
-    auth_code = input("Please enter the code here: ").strip()
-    token_response = auth_client.oauth2_exchange_code_for_tokens(auth_code)
-    # Store tokens for later
-    my_file_adapter.store(token_response)
-    # Use the current transfer tokens
-    transfer_tokens = token_response.by_resource_server["transfer.api.globus.org"]
-else:
-    # otherwise, we already did this whole song-and-dance, so just
-    # load the tokens from that file
-    transfer_tokens = my_file_adapter.get_token_data("transfer.api.globus.org")
-
-authorizer = globus_sdk.RefreshTokenAuthorizer(
-    transfer_tokens["refresh_token"],
-    auth_client,
-    access_token=transfer_tokens["access_token"],
-    expires_at=transfer_tokens["expires_at_seconds"],
-    on_refresh=my_file_adapter.on_refresh,
-)
-
-# construct an AccessTokenAuthorizer and use it to construct the
-# TransferClient
-
-transfer_client = globus_sdk.TransferClient(authorizer=authorizer)
-
-# create a Transfer task consisting of one or more items
-task_data = globus_sdk.TransferData(
-    transfer_client,source_endpoint=source_collection_id, destination_endpoint=dest_collection_id
-)
-
-
-# Set the source and destination transfers, and build filters to
-# eliminate the deletion file. Transfer all zips in the working scratch dir
-# and ignore the MANIFESTS directory, otherwise it'll be placed into
-# the DATA directory.
-#
+TOKEN_FILE = "~/svc-acct-globus-groups-tokens.json"
+
+# Local path of the CQI working scratch directory that the source collection
+# exposes. Bundles made with --pack-from are written under it.
+SCRATCH_ROOT = "/storage/work/other_d666f751616c41/prod"
+
+# Bundles per transfer task with --pipeline.
+DEFAULT_WAVE_BUNDLES = 8
+
+
+def check_route(route):
+    """
+    Raise ConfigError for a route that sets paths or filter rules, which
+    transfer_to_archive.py decides itself from DATA_LOCATION and TODAY. The
+    route's collections, auth and transfer options are used; its label,
+    concurrency and retries do not apply.
+    """
+    if route.paths or route.filter_rules:
+        raise routes.ConfigError(
+            f"route {route.name!r}: transfer_to_archive.py sends DATA_LOCATION/TODAY with its own filter rules; "
+            "leave out paths and filter_rules"
+        )
 
-task_data.add_item(
-    f"./{args.DATA_LOCATION}/{args.TODAY}/",  # Source
-    f"./{args.DATA_LOCATION}/DATA/",  # Dest
-    recursive=True
-)
-
-# Rules set following directions at 
-# https://docs.globus.org/api/transfer/task_submit/#filter_rules
-
-task_data.add_filter_rule(name="*.zip", method="include", type="file")
-task_data.add_filter_rule(name="MANIFESTS", method="exclude", type="dir")
-task_data.add_filter_rule(name=f"eligible_for_deletion_{args.TODAY}.txt", method="exclude", type="file")
-#task_data.add_filter_rule(name="*", method="exclude", type="file")
-
-# Now all the MANIFESTS directory back and transfer it to its own location
-
-task_data.add_item(
-    f"./{args.DATA_LOCATION}/{args.TODAY}/MANIFESTS/",  # Source
-    f"./{args.DATA_LOCATION}/MANIFESTS/",  # Dest
-    recursive=True
-)
-
-task_data.add_filter_rule(name="*.txt", method="include", type="file")
-
-def do_submit(client):
-    task_doc = client.submit_transfer(task_data)
-    task_id = task_doc["task_id"]
-    print(f"submitted transfer, task_id={task_id}")
-
-try:
-    do_submit(transfer_client)
-except globus_sdk.TransferAPIError as err:
-    if not err.info.consent_required:
-        raise
-    print(
-        "Encountered a ConsentRequired error.\n"
-        "You must login a second time to grant consents.\n\n"
+
+def parse_args(argv=None):
+    # Obtain command line args that contain the location and date info
+    parser = argparse.ArgumentParser()
+    parser.add_argument("DATA_LOCATION")
+    parser.add_argument("TODAY")
+    parser.add_argument("--pack-from", metavar="DIR",
+                        help="pack the small files under DIR into bundles before transferring")
+    parser.add_argument("--scratch-root", default=SCRATCH_ROOT)
+    parser.add_argument("--target-size", type=float, default=packing.DEFAULT_TARGET_SIZE / 1024 ** 3,
+                        help="target bundle size in GiB for --pack-from")
+    parser.add_argument("--format", choices=["zip", "tar"], default=packing.DEFAULT_FORMAT,
+                        help="bundle format for --pack-from")
+    parser.add_argument("--checksums", action="store_true",
+                        help="precompute bundle checksums into MANIFESTS and have Globus verify against them")
+    parser.add_argument("--verify", action="store_true",
+                        help="wait for the transfer and check the archive listing against the checksum manifest")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes to use for packing and hashing")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="wait for the transfer and write eligible_for_deletion_TODAY.txt "
+                             "from its successful transfers")
+    parser.add_argument("--delete", action="store_true",
+                        help="then delete the files in eligible_for_deletion_TODAY.txt from scratch "
+                             "through Globus (implies --reconcile)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="transfer bundles in waves while --pack-from is still packing")
+    parser.add_argument("--wave-bundles", type=int, default=DEFAULT_WAVE_BUNDLES,
+                        help="bundles per transfer task with --pipeline")
+    parser.add_argument("--journal", default=journal.DEFAULT_JOURNAL_FILE,
+                        help="journal of submitted tasks, used to resume an interrupted run")
+    routes.add_arguments(parser)
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    # Replaced by the route's with --config.
+    parser.set_defaults(source_collection=source_collection_id, dest_collection=dest_collection_id,
+                        client_id=CLIENT_ID, token_file=TOKEN_FILE, transfer_options={})
+    args = parser.parse_args(argv)
+    if args.pipeline and not args.pack_from:
+        parser.error("--pipeline needs --pack-from")
+    if args.delete:
+        args.reconcile = True
+    if args.reconcile:
+        args.verify = True
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics.configure(args.metrics_log, args.metrics_prom, script="transfer_to_archive")
+    profiling.configure(args.profile, args.profile_cprofile, args.profile_sample)
+    config, route = routes.configured_route(args, check=check_route)
+    if route is not None:
+        args.source_collection, args.dest_collection = route.source, route.destination
+        args.client_id, args.token_file = config.client_id, config.token_file
+        args.transfer_options = route.options
+
+    # A run that died after submitting is picked up again from the journal
+    # rather than packing and sending everything a second time.
+    run_key = f"archive:{args.DATA_LOCATION}:{args.TODAY}"
+    with journal.Journal(args.journal) as jrnl:
+        if jrnl.start_run(run_key):
+            print(f"Resuming the interrupted run for {args.DATA_LOCATION} {args.TODAY}")
+        if args.pipeline:
+            transfer_client = globus_client.get_transfer_client(args.client_id, args.token_file)
+            ok = run_pipeline(transfer_client, args, jrnl, run_key)
+        else:
+            ok = run_single(args, jrnl, run_key)
+        # None: submitted without waiting, so the run stays open for the
+        # next one to check on the task.
+        jrnl.finish_run(run_key, journal.SUCCEEDED if ok else journal.FAILED)
+        if ok and args.delete:
+            ok = delete_scratch(args, jrnl)
+    if ok is False:
+        sys.exit(1)
+
+
+def delete_scratch(args, jrnl):
+    """Delete the files in eligible_for_deletion_TODAY.txt through the source collection."""
+    local_dir = os.path.join(args.scratch_root, args.DATA_LOCATION, args.TODAY)
+    deletion_file = os.path.join(local_dir, f"eligible_for_deletion_{args.TODAY}.txt")
+    transfer_client = globus_client.get_transfer_client(args.client_id, args.token_file)
+    print(f"Deleting the files in {deletion_file}...")
+    return bulk_delete.delete_list(
+        transfer_client, args.source_collection, deletion_file, args.scratch_root, jrnl,
+        run_key=f"delete:{args.DATA_LOCATION}:{args.TODAY}",
+        label=f"Delete archived {args.DATA_LOCATION} {args.TODAY}",
     )
-#
-# Everything below here is old code from an example I could
-# not get to work. Leaving it here in case I get inspired to 
-# rewrite the function to manage the consents.
 
-#    transfer_client = login_and_get_transfer_client(
-#        scopes=err.info.consent_required.required_scopes
-#    )
-#    do_submit(transfer_client)
 
+def local_bundles(local_dir):
+    """The zip and tar bundles under ``local_dir``, outside MANIFESTS, as "/"-separated relative paths."""
+    return [
+        posixpath.relpath(os.path.join(dir_path, name), local_dir).replace(os.sep, "/")
+        for dir_path, dir_names, names in os.walk(local_dir)
+        if checksums.MANIFEST_DIR not in dir_path.split(os.sep)
+        for name in names
+        if fnmatch.fnmatch(name, "*.zip") or fnmatch.fnmatch(name, "*.tar")
+    ]
+
+
+def prepare(args, local_dir, manifest_path):
+    """Pack --pack-from and write the checksum manifest, as asked; return the manifest entries or None."""
+    if args.pack_from:
+        with profiling.phase("pack"):
+            packing.pack_directory(
+                args.pack_from,
+                local_dir,
+                target_size=int(args.target_size * 1024 ** 3),
+                fmt=args.format,
+                workers=args.workers,
+            )
+
+    if not args.checksums:
+        return None
+    bundles = [os.path.join(local_dir, name) for name in local_bundles(local_dir)]
+    with profiling.phase("checksum"), checksums.DigestCache() as cache:
+        entries = checksums.compute_digests(local_dir, cache, workers=args.workers, paths=bundles)
+    checksums.write_manifest(entries, manifest_path)
+    return entries
+
+
+def invalidate_archive(args):
+    """Drop the cached listings of the archive DATA and MANIFESTS directories, once a task wrote to them."""
+    listing_cache.invalidate_paths(
+        args.dest_collection, [f"./{args.DATA_LOCATION}/DATA/", f"./{args.DATA_LOCATION}/MANIFESTS/"]
+    )
+
+
+def archive_filter_rules(today):
+    """The filter rules of the archive task, in order, as add_filter_rule keyword arguments."""
+    return [
+        {"name": "*.zip", "method": "include", "type": "file"},
+        {"name": "*.tar", "method": "include", "type": "file"},
+        {"name": "MANIFESTS", "method": "exclude", "type": "dir"},
+        {"name": f"eligible_for_deletion_{today}.txt", "method": "exclude", "type": "file"},
+        #{"name": "*", "method": "exclude", "type": "file"},
+        {"name": "*.txt", "method": "include", "type": "file"},
+    ]
+
+
+def build_task_data(transfer_client, args, entries):
+    # create a Transfer task consisting of one or more items
+    task_data = globus_sdk.TransferData(
+        transfer_client, source_endpoint=args.source_collection, destination_endpoint=args.dest_collection,
+        **args.transfer_options,
+    )
+
+    # Set the source and destination transfers, and build filters to
+    # eliminate the deletion file. Transfer all zips in the working scratch dir
+    # and ignore the MANIFESTS directory, otherwise it'll be placed into
+    # the DATA directory.
+    #
+
+    if entries is not None:
+        # Send each bundle explicitly with its precomputed checksum, so
+        # Globus checks the archive copy against it.
+        checksums.add_items_with_checksums(
+            task_data, entries, f"./{args.DATA_LOCATION}/{args.TODAY}/", f"./{args.DATA_LOCATION}/DATA/"
+        )
+    else:
+        task_data.add_item(
+            f"./{args.DATA_LOCATION}/{args.TODAY}/",  # Source
+            f"./{args.DATA_LOCATION}/DATA/",  # Dest
+            recursive=True
+        )
+
+    # Rules set following directions at
+    # https://docs.globus.org/api/transfer/task_submit/#filter_rules
+
+    for rule in archive_filter_rules(args.TODAY):
+        task_data.add_filter_rule(**rule)
+
+    # Now all the MANIFESTS directory back and transfer it to its own location
+
+    task_data.add_item(
+        f"./{args.DATA_LOCATION}/{args.TODAY}/MANIFESTS/",  # Source
+        f"./{args.DATA_LOCATION}/MANIFESTS/",  # Dest
+        recursive=True
+    )
+
+    return task_data
+
+
+def run_single(args, jrnl, run_key):
+    """
+    Send DATA_LOCATION/TODAY as one task, verifying it with --verify. Returns
+    True once the task has succeeded (and checked out), False on failure, or
+    None if, without --verify, the task was submitted or is still running.
+    """
+    local_dir = os.path.join(args.scratch_root, args.DATA_LOCATION, args.TODAY)
+    manifest_path = os.path.join(local_dir, checksums.MANIFEST_DIR, f"checksums_{args.TODAY}.txt")
+
+    transfer_client = globus_client.get_transfer_client(args.client_id, args.token_file)
+
+    batch = jrnl.lookup(run_key, "archive")
+    if not args.verify and batch is not None and batch.status == journal.SUBMITTED:
+        # An earlier run submitted without waiting: check on its task rather
+        # than waiting for it or sending it again.
+        task = transfer_client.get_task(batch.task_id)
+        if task["status"] not in task_waiter.TERMINAL_STATUSES:
+            print(f"Transfer {batch.task_id} from an earlier run is still {task_waiter.task_state(task)}.")
+            return None
+        jrnl.task_finished(run_key, batch.task_id, task["status"])
+        invalidate_archive(args)
+
+    def submit():
+        entries = prepare(args, local_dir, manifest_path)
+        return globus_client.submit_transfer(transfer_client, build_task_data(transfer_client, args, entries))
+
+    task_id, done = journal.resume_or_submit(jrnl, run_key, "archive", submit, item_count=1)
+    if done:
+        print(f"{args.DATA_LOCATION} {args.TODAY} was already transferred.")
+        return True
+    if task_id is None:
+        return False
+    if not args.verify:
+        return None
+
+    task = task_waiter.wait_for_task(transfer_client, task_id)
+    jrnl.task_finished(run_key, task_id, task["status"])
+    invalidate_archive(args)
+    if task["status"] != "SUCCEEDED":
+        print(f"Transfer failed. Check Globus dashboard for details.")
+        return False
+    if args.checksums and not verify_archive(transfer_client, args, manifest_path):
+        return False
+    if args.reconcile:
+        if not write_deletion_list(transfer_client, args, local_dir, [task_id], local_bundles(local_dir)):
+            return False
+    return True
+
+
+def _bundle_files(args, local_dir, source_path):
+    """The local files a delivered bundle frees: the bundle and, with --pack-from, its members."""
+    name = posixpath.relpath(reconcile.normalize(source_path), f"{args.DATA_LOCATION}/{args.TODAY}")
+    yield os.path.join(local_dir, name)
+    manifest = os.path.join(local_dir, packing.MANIFEST_DIR, os.path.basename(name) + ".txt")
+    if args.pack_from and os.path.exists(manifest):
+        for entry in checksums.read_manifest(manifest):
+            yield os.path.join(os.path.abspath(args.pack_from), entry.path)
+
+
+@profiling.timed("reconcile")
+def write_deletion_list(transfer_client, args, local_dir, task_ids, bundle_names):
+    """
+    Write eligible_for_deletion_TODAY.txt from the bundles the tasks actually
+    delivered. Returns False if any planned bundle is missing from them.
+    """
+    deletion_file = os.path.join(local_dir, f"eligible_for_deletion_{args.TODAY}.txt")
+    missing = reconcile.reconcile_to_file(
+        transfer_client,
+        task_ids,
+        [f"./{args.DATA_LOCATION}/{args.TODAY}/{name}" for name in bundle_names],
+        deletion_file,
+        to_local=lambda path: _bundle_files(args, local_dir, path),
+    )
+    return not missing
+
+
+def verify_archive(transfer_client, args, manifest_path):
+    """Check the archive DATA listing against the checksum manifest."""
+    if not verify_entries(transfer_client, args, checksums.read_manifest(manifest_path)):
+        return False
+    print(f"All files in {manifest_path} are present in the archive.")
+    return True
+
+
+@profiling.timed("verify")
+def verify_entries(transfer_client, args, entries):
+    """Check that every ManifestEntry is in the archive DATA listing with its size."""
+    data_dir = f"./{args.DATA_LOCATION}/DATA/"
+    listing = (
+        (posixpath.relpath(posixpath.join(dir_path, entry["name"]), data_dir), entry["size"])
+        for dir_path, entry in recursive_ls.walk(transfer_client, args.dest_collection, data_dir)
+        if entry["type"] == "file"
+    )
+    missing, mismatched = checksums.verify_listing(entries, listing)
+    for path in missing:
+        print(f"Missing from archive: {path}")
+    for path in mismatched:
+        print(f"Size differs in archive: {path}")
+    return not missing and not mismatched
+
+
+def _pack_and_hash(source_dir, output_dir, bundle, hash_bundle):
+    """Pack one bundle in a worker process, hashing it afterwards if asked."""
+    result = packing.pack_bundle(source_dir, output_dir, bundle)
+    digest = checksums.hash_path(result.bundle_path) if hash_bundle else None
+    return bundle, result, digest
+
+
+def _submit_wave(transfer_client, args, number, wave):
+    """Submit one wave of (bundle, PackResult, digest) as a transfer task."""
+    transfer_data = globus_sdk.TransferData(
+        transfer_client, source_endpoint=args.source_collection, destination_endpoint=args.dest_collection,
+        label=f"CQI {args.DATA_LOCATION} {args.TODAY} wave {number}", **args.transfer_options,
+    )
+    for bundle, result, digest in wave:
+        kwargs = {}
+        if digest is not None:
+            kwargs = {"external_checksum": digest, "checksum_algorithm": checksums.DEFAULT_ALGORITHM.upper()}
+        transfer_data.add_item(
+            f"./{args.DATA_LOCATION}/{args.TODAY}/{bundle.name}",
+            f"./{args.DATA_LOCATION}/DATA/{bundle.name}",
+            **kwargs,
+        )
+    task_id = globus_client.submit_transfer(transfer_client, transfer_data)
+    if task_id is not None:
+        print(f"Wave {number}: {len(wave)} bundles submitted as task {task_id}")
+    return task_id
+
+
+def _submit_manifests(transfer_client, args, names):
+    """Send MANIFESTS/<name> files to the archive MANIFESTS directory."""
+    transfer_data = globus_sdk.TransferData(
+        transfer_client, source_endpoint=args.source_collection, destination_endpoint=args.dest_collection,
+        label=f"CQI {args.DATA_LOCATION} {args.TODAY} manifests", **args.transfer_options,
+    )
+    for name in names:
+        transfer_data.add_item(
+            f"./{args.DATA_LOCATION}/{args.TODAY}/MANIFESTS/{name}",
+            f"./{args.DATA_LOCATION}/MANIFESTS/{name}",
+        )
+    return globus_client.submit_transfer(transfer_client, transfer_data)
+
+
+def _journaled_wave(local_dir, bundles_by_name, members):
+    """Rebuild a wave's (bundle, PackResult, digest) list from its journal members."""
+    wave = []
+    for name, digest in members:
+        bundle = bundles_by_name[name]
+        wave.append((
+            bundle,
+            packing.PackResult(
+                os.path.join(local_dir, name),
+                os.path.join(local_dir, packing.MANIFEST_DIR, name + ".txt"),
+                len(bundle.members),
+                sum(size for _, size in bundle.members),
+            ),
+            digest,
+        ))
+    return wave
+
+
+def run_pipeline(transfer_client, args, jrnl, run_key):
+    """
+    Pack --pack-from in a process pool and submit the bundles in waves as
+    they are finished, then send the manifests of each wave that succeeds.
+    Returns True if every wave and manifest arrived and checked out.
+
+    Waves are journaled under ``run_key`` with their bundle names, so a
+    resumed run reattaches to waves still in flight, skips those that
+    arrived, and only packs and sends the rest. It fails without sending
+    anything if a bundle such a wave sent is no longer in the plan.
+    """
+    local_dir = os.path.join(args.scratch_root, args.DATA_LOCATION, args.TODAY)
+    os.makedirs(os.path.join(local_dir, packing.MANIFEST_DIR), exist_ok=True)
+    bundles = packing.plan_bundles(args.pack_from, int(args.target_size * 1024 ** 3), args.format)
+    bundles_by_name = {bundle.name: bundle for bundle in bundles}
+
+    waves = {}  # task_id -> wave, for waves to wait on
+    arrived = []  # waves that already succeeded in an interrupted run
+    journaled = set()
+    for batch in jrnl.batches(run_key):
+        if batch.members is None or not batch.fingerprint.startswith("wave:"):
+            continue
+        if batch.status not in (journal.SUCCEEDED, journal.SUBMITTED):
+            continue  # packed and sent again below
+        unplanned = sorted(name for name, _ in batch.members if name not in bundles_by_name)
+        if unplanned:
+            # Files under --pack-from were added or removed since the
+            # interrupted run, which already sent bundles of the old plan.
+            print(f"Cannot resume: wave {batch.number} (task {batch.task_id}) sent bundles that are no longer "
+                  f"planned from {args.pack_from}: {', '.join(unplanned)}. Restore the files that were there, "
+                  f"or pack them under a new TODAY.", file=sys.stderr)
+            return False
+        wave = _journaled_wave(local_dir, bundles_by_name, batch.members)
+        if batch.status == journal.SUCCEEDED:
+            arrived.append((batch.fingerprint, wave, batch.task_id))
+        else:
+            print(f"Reattaching to wave {batch.number}, task {batch.task_id}")
+            waves[batch.task_id] = wave
+        journaled.update(name for name, _ in batch.members)
+
+    to_pack = [bundle for bundle in bundles if bundle.name not in journaled]
+    print(f"Packing {sum(len(b.members) for b in to_pack)} files into {len(to_pack)} bundles, "
+          f"sending {args.wave_bundles} bundles per wave")
+
+    def submit_wave(wave):
+        number = len(waves) + len(arrived) + 1
+        members = [(bundle.name, digest) for bundle, _, digest in wave]
+        fingerprint = "wave:" + journal.fingerprint(name for name, _ in members)
+        task_id, _ = journal.resume_or_submit(
+            jrnl, run_key, fingerprint, lambda: _submit_wave(transfer_client, args, number, wave),
+            number, len(wave), members,
+        )
+        if task_id is not None:
+            waves[task_id] = wave
+        return task_id
+
+    failed = False
+    wave = []
+    # Submissions happen inside this phase, but count as their own.
+    with profiling.phase("pack"), concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(_pack_and_hash, args.pack_from, local_dir, bundle, args.checksums)
+            for bundle in to_pack
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            bundle, result, digest = future.result()
+            print(f"Wrote {result.bundle_path} ({result.members} files, {result.bytes / 1e6:.1f} MB)")
+            wave.append((bundle, result, digest))
+            if len(wave) >= args.wave_bundles:
+                if submit_wave(wave) is None:
+                    failed = True
+                    break
+                wave = []
+        else:
+            if wave and submit_wave(wave) is None:
+                failed = True
+        if failed:
+            for future in futures:
+                future.cancel()
+
+    # Each wave's manifests follow it as soon as it succeeds.
+    manifest_tasks = []
+
+    def send_manifests(wave_fingerprint, wave):
+        names = [os.path.basename(result.manifest_path) for _, result, _ in wave]
+        task_id, done = journal.resume_or_submit(
+            jrnl, run_key, "manifests:" + wave_fingerprint,
+            lambda: _submit_manifests(transfer_client, args, names), item_count=len(names),
+        )
+        if task_id is not None:
+            manifest_tasks.append(task_id)
+        return done or task_id is not None
+
+    fingerprints = {
+        batch.task_id: batch.fingerprint for batch in jrnl.batches(run_key) if batch.task_id is not None
+    }
+    manifests_sent = [send_manifests(fingerprint, wave) for fingerprint, wave, _ in arrived]
+
+    def on_update(task_id, task):
+        print(f"Transfer {task_id} status: {task_waiter.task_state(task)}")
+        if task["status"] in task_waiter.TERMINAL_STATUSES:
+            jrnl.task_finished(run_key, task_id, task["status"])
+            invalidate_archive(args)
+        if task["status"] == "SUCCEEDED" and task_id in waves:
+            manifests_sent.append(send_manifests(fingerprints[task_id], waves[task_id]))
+
+    tasks = task_waiter.TaskWaiter(transfer_client).wait(list(waves), on_update=on_update)
+    ok = not failed and all(tasks[task_id]["status"] == "SUCCEEDED" for task_id in waves)
+
+    entries = [
+        checksums.ManifestEntry(digest, os.path.getsize(result.bundle_path), bundle.name)
+        for wave in list(waves.values()) + [wave for _, wave, _ in arrived]
+        for bundle, result, digest in wave
+    ]
+    if ok and args.checksums:
+        manifest_path = os.path.join(local_dir, checksums.MANIFEST_DIR, f"checksums_{args.TODAY}.txt")
+        checksums.write_manifest(sorted(entries, key=lambda e: e.path), manifest_path)
+        task_id = _submit_manifests(transfer_client, args, [os.path.basename(manifest_path)])
+        if task_id is not None:
+            manifest_tasks.append(task_id)
+        manifests_sent.append(task_id is not None)
+
+    if manifest_tasks:
+        manifests = task_waiter.TaskWaiter(transfer_client).wait(manifest_tasks)
+        for task_id, task in manifests.items():
+            jrnl.task_finished(run_key, task_id, task["status"])
+        invalidate_archive(args)
+        ok = ok and all(task["status"] == "SUCCEEDED" for task in manifests.values())
+    ok = ok and all(manifests_sent)
+
+    if not ok:
+        print(f"Transfer failed. Check Globus dashboard for details.")
+        return False
+    if not verify_entries(transfer_client, args, entries):
+        return False
+
+    task_ids = list(waves) + [task_id for _, _, task_id in arrived]
+    if not write_deletion_list(transfer_client, args, local_dir, task_ids, [b.name for b in bundles]):
+        return False
+    print(f"All {len(bundles)} bundles verified in the archive")
+    return True
+
+if __name__ == "__main__":
+    main()
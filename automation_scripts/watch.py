@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+# Notice new scan sessions under the scanner share as they are written.
+#
+# sync.py --watch uses this to send each session as soon as the scanner has
+# finished writing it, instead of waiting for the next cron run. A session is
+# the directory SESSION_DEPTH levels below the root (lab/session). Every
+# change inside a session marks it dirty, and once nothing in it has changed
+# for the quiet period the session is handed back to be synced on its own.
+#
+# Changes come from inotify when the optional inotify_simple package is
+# installed and the watches can be set up; otherwise the tree is walked with
+# os.scandir every poll interval and sessions whose file count, size or
+# newest mtime moved are reported. Either way the watcher can report that it
+# lost track (an inotify queue overflow), and the caller then falls back to
+# an ordinary scan of the whole tree.
+#
+
+import os
+import time
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+SESSION_DEPTH = 2
+DEFAULT_QUIET_SECONDS = 300
+DEFAULT_POLL_INTERVAL = 60
+
+if INotify is not None:
+    WATCH_MASK = (
+        flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM
+        | flags.DELETE | flags.ATTRIB
+    )
+
+# Returned by a watcher's changes() when it can no longer say what changed.
+LOST_TRACK = None
+
+
+def session_of(rel_path, depth=SESSION_DEPTH):
+    """The session directory of a path relative to the root, or None if it is above any session."""
+    parts = [part for part in rel_path.split("/") if part]
+    if len(parts) < depth:
+        return None
+    return "/".join(parts[:depth])
+
+
+class InotifyWatcher:
+    """Reports the paths written under ``root`` using inotify watches on every directory."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.inotify = INotify()
+        self.dirs = {}
+        self.pending = set()
+        self._watch_tree("")
+
+    def close(self):
+        self.inotify.close()
+
+    def _watch_tree(self, rel_top):
+        """Watch ``rel_top`` and every directory below it, noting the files already there."""
+        stack = [rel_top]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                wd = self.inotify.add_watch(os.path.join(self.root, rel_dir), WATCH_MASK)
+            except FileNotFoundError:
+                continue
+            self.dirs[wd] = rel_dir
+            try:
+                with os.scandir(os.path.join(self.root, rel_dir)) as it:
+                    for entry in it:
+                        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(rel_path)
+                        elif rel_top:
+                            # Written before the watch existed.
+                            self.pending.add(rel_path)
+            except OSError:
+                continue
+
+    def changes(self, timeout):
+        """
+        Wait up to ``timeout`` seconds and return the set of relative paths that
+        changed, or LOST_TRACK after a queue overflow.
+        """
+        changed, self.pending = self.pending, set()
+        for event in self.inotify.read(timeout=int(timeout * 1000), read_delay=100):
+            if event.mask & flags.Q_OVERFLOW:
+                return LOST_TRACK
+            rel_dir = self.dirs.get(event.wd)
+            if rel_dir is None:
+                continue
+            if event.mask & flags.IGNORED:
+                del self.dirs[event.wd]
+                continue
+            rel_path = f"{rel_dir}/{event.name}" if rel_dir else event.name
+            if event.mask & flags.ISDIR and event.mask & (flags.CREATE | flags.MOVED_TO):
+                self._watch_tree(rel_path)
+            changed.add(rel_path)
+        changed |= self.pending
+        self.pending = set()
+        return changed
+
+
+class PollingWatcher:
+    """Reports the sessions under ``root`` whose contents changed between scandir walks."""
+
+    def __init__(self, root, depth=SESSION_DEPTH, interval=DEFAULT_POLL_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.depth = depth
+        self.interval = interval
+        self.next_poll = 0.0
+        self.signatures = self._signatures()
+
+    def close(self):
+        pass
+
+    def _signatures(self):
+        """(files, bytes, newest mtime) of every session, walking the whole tree once."""
+        signatures = {}
+        stack = [("", 0)]
+        while stack:
+            rel_dir, level = stack.pop()
+            session = session_of(rel_dir, self.depth)
+            try:
+                with os.scandir(os.path.join(self.root, rel_dir)) as it:
+                    for entry in it:
+                        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((rel_path, level + 1))
+                            if level + 1 == self.depth:
+                                signatures.setdefault(rel_path, (0, 0, 0))
+                        elif session is not None and entry.is_file(follow_symlinks=False):
+                            try:
+                                st = entry.stat(follow_symlinks=False)
+                            except OSError:
+                                continue
+                            files, size, newest = signatures.get(session, (0, 0, 0))
+                            signatures[session] = (files + 1, size + st.st_size, max(newest, st.st_mtime_ns))
+            except OSError:
+                continue
+        return signatures
+
+    def changes(self, timeout):
+        """Wait for the next poll, at most ``timeout`` seconds, and return the sessions that changed."""
+        wait = self.next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        if wait > 0:
+            time.sleep(wait)
+        self.next_poll = time.monotonic() + self.interval
+        signatures = self._signatures()
+        changed = {
+            session for session, signature in signatures.items()
+            if self.signatures.get(session) != signature
+        }
+        self.signatures = signatures
+        return changed
+
+
+def make_watcher(root, depth=SESSION_DEPTH, poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True):
+    """An InotifyWatcher if inotify is available and usable, else a PollingWatcher."""
+    if use_inotify and INotify is not None:
+        try:
+            return InotifyWatcher(root)
+        except OSError as err:
+            # Typically fs.inotify.max_user_watches is too low for the tree.
+            print(f"inotify unavailable ({err}); polling every {poll_interval:g} s instead")
+    elif use_inotify:
+        print(f"inotify_simple is not installed; polling every {poll_interval:g} s instead")
+    return PollingWatcher(root, depth, poll_interval)
+
+
+class Debouncer:
+    """Holds dirty sessions until none of their files has changed for ``quiet_seconds``."""
+
+    def __init__(self, quiet_seconds=DEFAULT_QUIET_SECONDS, clock=time.monotonic):
+        self.quiet_seconds = quiet_seconds
+        self.clock = clock
+        self.last_change = {}
+
+    def touch(self, session):
+        self.last_change[session] = self.clock()
+
+    def ready(self):
+        """Remove and return the sessions that have gone quiet, oldest first."""
+        cutoff = self.clock() - self.quiet_seconds
+        quiet = sorted((when, session) for session, when in self.last_change.items() if when <= cutoff)
+        for _, session in quiet:
+            del self.last_change[session]
+        return [session for _, session in quiet]
+
+    def next_due(self):
+        """Seconds until the next session could go quiet, or None if none is dirty."""
+        if not self.last_change:
+            return None
+        return max(min(self.last_change.values()) + self.quiet_seconds - self.clock(), 0.0)